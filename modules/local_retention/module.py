@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module saves the retention of the scheduler in local files, and
+# only what changed at each save. The hosts and services that changed
+# are appended to a log, and the log is compacted in a snapshot when it
+# gets too big (see shinken/localretention.py).
+#
+# define module {
+#     module_name     local-retention
+#     module_type     local_retention
+#     path            /var/lib/shinken/retention.dat
+#     max_log_ratio   1.0
+# }
+
+from shinken.basemodule import BaseModule
+from shinken.localretention import LocalRetention
+from shinken.log import logger
+
+properties = {
+    'daemons': ['scheduler'],
+    'type': 'local_retention',
+    'external': False,
+    'phases': ['retention'],
+    }
+
+
+# called by the plugin manager to get a scheduler module
+def get_instance(mod_conf):
+    logger.info("[Local Retention] Get a local retention module for plugin %s", mod_conf.get_name())
+    instance = Local_retention(mod_conf)
+    return instance
+
+
+class Local_retention(BaseModule):
+
+    def __init__(self, mod_conf):
+        BaseModule.__init__(self, mod_conf)
+        self.path = getattr(mod_conf, 'path', '/var/lib/shinken/retention.dat')
+        self.max_log_ratio = float(getattr(mod_conf, 'max_log_ratio', 1.0))
+
+    # Called by Scheduler to say 'let's prepare yourself guy'
+    def init(self):
+        logger.info("[Local Retention] Initialization of the local retention module")
+        self.retention = LocalRetention(self.path, self.max_log_ratio)
+
+    # Save what changed since the last time
+    def hook_save_retention(self, daemon):
+        logger.debug("[Local Retention] Asking me to update the retention objects")
+        self.retention.save(daemon)
+
+    # Load the snapshot and its log, and give them to the scheduler.
+    # Return if we got something
+    def hook_load_retention(self, daemon):
+        logger.debug("[Local Retention] Asking me to load the retention objects")
+        data = self.retention.load()
+        if data is None:
+            logger.info("[Local Retention] No retention in %s", self.path)
+            return False
+        daemon.restore_retention_data(data)
+        return True
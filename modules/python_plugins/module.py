@@ -0,0 +1,173 @@
+#!/usr/bin/python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module runs the registered python plugins in its workers processes,
+# without launching a new python each time. Commands go to it with
+# module_type python_plugins. The commands that are not registered
+# plugins are launched like with the fork workers.
+#
+# define module {
+#     module_name     python-plugins
+#     module_type     python_plugins
+#     # The plugins files, with the function to call if not main
+#     plugins         /usr/lib/nagios/plugins/check_foo.py, /usr/lib/nagios/plugins/check_bar.py:run
+# }
+
+import sys
+import signal
+import time
+from Queue import Empty
+
+from shinken.basemodule import BaseModule
+from shinken.pythonplugins import PythonPlugins
+from shinken.log import logger
+
+properties = {
+    'daemons': ['poller', 'reactionner'],
+    'type': 'python_plugins',
+    'external': False,
+    # To be a real worker module, you must set this
+    'worker_capable': True,
+}
+
+
+# called by the plugin manager to get a poller module
+def get_instance(mod_conf):
+    logger.info("[Python Plugins] Get a python plugins module for plugin %s", mod_conf.get_name())
+    instance = Python_plugins(mod_conf)
+    return instance
+
+
+class Python_plugins(BaseModule):
+
+    def __init__(self, mod_conf):
+        BaseModule.__init__(self, mod_conf)
+        self.plugins_list = getattr(mod_conf, 'plugins', '')
+        self.max_plugins_output_length = int(getattr(mod_conf, 'max_plugins_output_length', 8192))
+        self.processes_by_worker = int(getattr(mod_conf, 'processes_by_worker', 256))
+
+    # Called by poller to say 'let's prepare yourself guy'
+    def init(self):
+        logger.info("[Python Plugins] Initialization of the python plugins module")
+        self.i_am_dying = False
+        # The registered plugin check we got, with its argv
+        self.plugin_check = None
+        self.plugins = PythonPlugins()
+        self.plugins.register_from_string(self.plugins_list)
+
+    # Get new checks if less than processes_by_worker. We wait for them
+    # a little if we have nothing to do. A registered plugin runs in our
+    # process and blocks us, so we take only one, and no more checks after
+    # it: the other workers can take them meanwhile
+    # REF: doc/shinken-action-queues.png (3)
+    def get_new_checks(self):
+        try:
+            while len(self.checks) < self.processes_by_worker and self.plugin_check is None:
+                if self.checks:
+                    msg = self.s.get(block=False)
+                else:
+                    msg = self.s.get(timeout=1)
+                if msg is not None:
+                    chk = msg.get_data()
+                    self.checks.append(chk)
+                    argv = self.plugins.get_argv(chk)
+                    if argv is not None:
+                        self.plugin_check = (chk, argv)
+        except Empty:
+            pass
+
+    # Launch the checks that are not registered plugins, then run the
+    # plugin one, if any, while they run
+    # REF: doc/shinken-action-queues.png (4)
+    def launch_new_checks(self):
+        plugin_chk = None
+        if self.plugin_check is not None:
+            plugin_chk = self.plugin_check[0]
+        for chk in self.checks:
+            if chk.status == 'queue' and chk is not plugin_chk:
+                if chk.execute() == 'toomanyopenfiles':
+                    logger.error("[Python Plugins] I am dying Too many open files %s ... ", chk)
+                    self.i_am_dying = True
+        if self.plugin_check is not None:
+            (chk, argv) = self.plugin_check
+            self.plugin_check = None
+            self.plugins.run(chk, argv, self.max_plugins_output_length)
+
+    # Check the status of checks
+    # if done, return message finished :)
+    # REF: doc/shinken-action-queues.png (5)
+    def manage_finished_checks(self):
+        to_del = []
+        for action in self.checks:
+            if action.status == 'launched':
+                action.check_finished(self.max_plugins_output_length)
+            if action.status in ('done', 'timeout'):
+                to_del.append(action)
+                try:
+                    self.returns_queue.put(action)
+                except IOError, exp:
+                    logger.info("[Python Plugins] %s exiting: %s", self.get_name(), exp)
+                    sys.exit(2)
+        for chk in to_del:
+            self.checks.remove(chk)
+        # Processes are still running, look at them again soon
+        if self.checks:
+            time.sleep(0.01)
+
+    # s = Global Queue Master->Slave
+    # return_queue = queue managed by manager
+    # c = Control Queue for the worker
+    def work(self, s, returns_queue, c):
+        logger.info("[Python Plugins] Module started!")
+        ## restore default signal handler for the workers:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.set_proctitle(self.get_name())
+        self.checks = []
+        self.returns_queue = returns_queue
+        self.s = s
+        while True:
+            # If we are dying (big problem!) we do not
+            # take new jobs, we just finished the current one
+            if not self.i_am_dying:
+                # REF: doc/shinken-action-queues.png (3)
+                self.get_new_checks()
+                # REF: doc/shinken-action-queues.png (4)
+                self.launch_new_checks()
+            # REF: doc/shinken-action-queues.png (5)
+            self.manage_finished_checks()
+
+            # Now get order from master
+            try:
+                cmsg = c.get(block=False)
+                if cmsg.get_type() == 'Die':
+                    logger.info("[Python Plugins] %s : Dad say we are dying...", self.get_name())
+                    break
+            except Exception:
+                pass
+
+            if not self.checks and self.i_am_dying:
+                logger.warning("[Python Plugins] I DIE because I cannot do my job as I should"
+                               "(too many open files?)... forgot me please.")
+                break
@@ -37,6 +37,7 @@ except ImportError:
     fcntl = None
 
 from shinken.log import logger
+from shinken import posixspawn
 
 __all__ = ('Action', )
 
@@ -103,25 +104,31 @@ class __Action(object):
         return local_env
 
 
-    def execute(self):
+    def execute(self, spawn_method='popen'):
         """
         Start this action command. The command will be executed in a
-        subprocess.
+        subprocess, launched with subprocess.Popen, or with posix_spawn
+        if spawn_method is 'posix_spawn' (and available).
         """
 
+        if spawn_method == 'posix_spawn' and not posixspawn.is_available():
+            spawn_method = 'popen'
+
         self.status = 'launched'
         self.check_time = time.time()
         self.wait_time = 0.0001
         self.last_poll = self.check_time
-        # Get a local env variables with our additional values
-        self.local_env = self.get_local_environnement()
+        # Get a local env variables with our additional values. The
+        # posix_spawn way prepares it by itself
+        if spawn_method != 'posix_spawn':
+            self.local_env = self.get_local_environnement()
 
         # Initialize stdout and stderr. we will read them in small parts
         # if the fcntl is available
         self.stdoutdata = ''
         self.stderrdata = ''
 
-        return self.execute__()  # OS specific part
+        return self.execute__(spawn_method=spawn_method)  # OS specific part
 
 
     def get_outputs(self, out, max_plugins_output_length):
@@ -159,6 +166,23 @@ class __Action(object):
         self.long_output = '\n'.join(long_output)
 
 
+    # The file descriptors of the process outputs, so the worker can
+    # wait for them
+    def get_outputs_fds(self):
+        process = getattr(self, 'process', None)
+        if process is None or not fcntl:
+            return []
+        return [process.stdout.fileno(), process.stderr.fileno()]
+
+
+    # Read what the process wrote on its outputs, without blocking
+    def read_outputs(self):
+        if getattr(self, 'process', None) is None or not fcntl:
+            return
+        self.stdoutdata += no_block_read(self.process.stdout)
+        self.stderrdata += no_block_read(self.process.stderr)
+
+
     def check_finished(self, max_plugins_output_length):
         # We must wait, but checks are variable in time
         # so we do not wait the same for an little check
@@ -271,7 +295,7 @@ if os.name != 'nt':
         # We allow direct launch only for 2.7 and higher version
         # because if a direct launch crash, under this the file handles
         # are not releases, it's not good.
-        def execute__(self, force_shell=sys.version_info < (2, 7)):
+        def execute__(self, force_shell=sys.version_info < (2, 7), spawn_method='popen'):
             # If the command line got shell characters, we should go
             # in a shell mode. So look at theses parameters
             force_shell |= self.got_shell_characters()
@@ -300,17 +324,21 @@ if os.name != 'nt':
             # http://www.doughellmann.com/PyMOTW/subprocess/ for
             # detail about this.
             try:
-                self.process = subprocess.Popen(
-                    cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                    close_fds=True, shell=force_shell, env=self.local_env,
-                    preexec_fn=os.setsid)
+                if spawn_method == 'posix_spawn':
+                    # The process group is set without running python in the child
+                    self.process = posixspawn.spawn(cmd, force_shell, self.env)
+                else:
+                    self.process = subprocess.Popen(
+                        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                        close_fds=True, shell=force_shell, env=self.local_env,
+                        preexec_fn=os.setsid)
             except OSError, exp:
                 logger.error("Fail launching command: %s %s %s",
                              self.command, exp, force_shell)
                 # Maybe it's just a shell we try to exec. So we must retry
                 if (not force_shell and exp.errno == 8
                    and exp.strerror == 'Exec format error'):
-                    return self.execute__(True)
+                    return self.execute__(True, spawn_method)
                 self.output = exp.__str__()
                 self.exit_status = 2
                 self.status = 'done'
@@ -322,7 +350,8 @@ if os.name != 'nt':
 
         def kill__(self):
             # We kill a process group because we launched them with
-            # preexec_fn=os.setsid and so we can launch a whole kill
+            # preexec_fn=os.setsid (or in a new process group with
+            # posix_spawn) and so we can launch a whole kill
             # tree instead of just the first one
             os.killpg(self.process.pid, signal.SIGKILL)
             # Try to force close the descriptors, because python seems to have problems with them
@@ -341,7 +370,7 @@ else:
 
     class Action(__Action):
 
-        def execute__(self):
+        def execute__(self, spawn_method='popen'):
             # 2.7 and higher Python version need a list of args for cmd
             # 2.4->2.6 accept just the string command
             if sys.version_info < (2, 7):
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#     Gabes Jean, naparuba@gmail.com
+#     Gerhard Lausser, Gerhard.Lausser@consol.de
+#     Gregory Starck, g.starck@gmail.com
+#     Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module packs the checks and actions batches exchanged between the
+schedulers and the pollers/reactionners (get_checks and put_results).
+
+Instead of pickling the whole shells, we only send the useful attributes
+as marshal'ed tuples in a raw binary body. The format is versioned with a
+magic header so each side can see if the other one speak it, and fall
+back to the old base64(zlib(cPickle)) encoding if not.
+"""
+
+import marshal
+import zlib
+
+from shinken.action import only_copy_prop
+from shinken.check import Check
+from shinken.notification import Notification
+from shinken.eventhandler import EventHandler
+
+# The version is the last byte of the magic
+MAGIC = 'SHKP\x01'
+# The value a poller give in its get_checks call to ask for this format
+FORMAT = 'packed1'
+
+# What the schedulers want back from a launched action
+result_prop = ('id', 'status', 'command', 'exit_status', 'output', 'long_output',
+               'perf_data', 'check_time', 'execution_time', 'u_time', 's_time')
+
+
+# Create an empty shell for this kind of action
+def _new_shell(is_a, c_id, is_snapshot):
+    if is_a == 'check':
+        return Check('', '', '', '', '', id=c_id)
+    if is_a == 'notification':
+        return Notification('', '', '', '', '', '', '', id=c_id)
+    if is_a == 'eventhandler':
+        return EventHandler('', id=c_id, is_snapshot=is_snapshot)
+    raise ValueError('Unknown action type %s' % is_a)
+
+
+def _pack(lst, props):
+    entries = []
+    for a in lst:
+        values = tuple([getattr(a, prop, None) for prop in props])
+        entries.append((a.is_a, getattr(a, 'is_snapshot', False), values))
+    # marshal only knows builtin types. ValueError if not the case,
+    # so the caller can use the old format
+    return MAGIC + zlib.compress(marshal.dumps(entries), 2)
+
+
+def _unpack(raw, props):
+    if not is_packed(raw):
+        raise ValueError('Not a packed actions batch')
+    entries = marshal.loads(zlib.decompress(raw[len(MAGIC):]))
+    res = []
+    for (is_a, is_snapshot, values) in entries:
+        a = _new_shell(is_a, values[0], is_snapshot)
+        for (prop, value) in zip(props, values):
+            # Not all actions got all properties, keep the defaults
+            if value is not None:
+                setattr(a, prop, value)
+        res.append(a)
+    return res
+
+
+# Is this raw data a packed batch of our version?
+def is_packed(raw):
+    return isinstance(raw, str) and raw.startswith(MAGIC)
+
+
+# Scheduler -> poller: the shells to launch
+def pack_actions(lst):
+    return _pack(lst, only_copy_prop)
+
+
+def unpack_actions(raw):
+    return _unpack(raw, only_copy_prop)
+
+
+# Poller -> scheduler: the results of the launched actions
+def pack_results(lst):
+    return _pack(lst, result_prop)
+
+
+def unpack_results(raw):
+    return _unpack(raw, result_prop)
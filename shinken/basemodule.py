@@ -36,6 +36,7 @@ from multiprocessing import Queue, Process
 import shinken.http_daemon
 from shinken.log import logger
 from shinken.misc.common import setproctitle
+from shinken.brokring import BrokRingQueue
 
 # TODO: use a class for defining the module "properties" instead of
 # plain dict??  Like:
@@ -128,20 +129,25 @@ class BaseModule(object):
         self.loaded_into = daemon_name
 
 
-    def create_queues(self, manager=None):
+    def create_queues(self, manager=None, brok_ring=None):
         """The manager is None on android, but a true Manager() elsewhere
         Create the shared queues that will be used by shinken daemon
         process and this module process.
         But clear queues if they were already set before recreating new one.
+        If the daemon got a broks ring, the module will read its broks in it.
         """
         self.clear_queues(manager)
+        if brok_ring is not None:
+            self.to_q = brok_ring.get_queue()
         # If no Manager() object, go with classic Queue()
         if not manager:
             self.from_q = Queue()
-            self.to_q = Queue()
+            if self.to_q is None:
+                self.to_q = Queue()
         else:
             self.from_q = manager.Queue()
-            self.to_q = manager.Queue()
+            if self.to_q is None:
+                self.to_q = manager.Queue()
 
 
     def clear_queues(self, manager):
@@ -149,8 +155,9 @@ class BaseModule(object):
         for q in (self.to_q, self.from_q):
             if q is None:
                 continue
-            # If we got no manager, we direct call the clean
-            if not manager:
+            # If we got no manager, or it's not one of its queues,
+            # we direct call the clean
+            if not manager or isinstance(q, BrokRingQueue):
                 q.close()
                 q.join_thread()
             # else:
@@ -184,7 +191,12 @@ class BaseModule(object):
         except KeyError:
             pass
 
-        p.start()
+        # Do not fork while the logs are written
+        paused = logger.pause_writer()
+        try:
+            p.start()
+        finally:
+            logger.resume_writer(paused)
         # We save the process data AFTER the fork()
         self.process = p
         self.properties['process'] = p  # TODO: temporary
@@ -23,8 +23,21 @@
 # along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
 
 import cPickle
+import marshal
+import struct
+import threading
+import types
+import zlib
 from shinken.safepickle import SafeUnpickler
 
+# Header of the broks batches streamed to the brokers, the version
+# is the last byte
+STREAM_MAGIC = 'SHKB\x01'
+
+# The broks can be created by several threads (the dispatcher ones, the
+# log writer), they must not get the same id
+_id_lock = threading.Lock()
+
 class Brok:
     """A Brok is a piece of information exported by Shinken to the Broker.
     Broker can do whatever he wants with it.
@@ -35,8 +48,9 @@ class Brok:
 
     def __init__(self, type, data):
         self.type = type
-        self.id = self.__class__.id
-        self.__class__.id += 1
+        with _id_lock:
+            self.id = self.__class__.id
+            self.__class__.id += 1
         self.data = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
         self.prepared = False
 
@@ -45,6 +59,14 @@ class Brok:
         return str(self.__dict__) + '\n'
 
 
+    # The wire frame is only a cache for the streamed batches, do not
+    # give it to the ones that pickle us
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('frame', None)
+        return state
+
+
     # We unserialize the data, and if some prop were
     # add after the serialize pass, we integer them in the data
     def prepare(self):
@@ -55,3 +77,76 @@ class Brok:
             if hasattr(self, 'instance_id'):
                 self.data['instance_id'] = self.instance_id
         self.prepared = True
+
+
+# The daemons give their log lines by batches, in one log brok with
+# all of them in 'log' and the list in 'lines', but the broker modules
+# want one brok by line: give the broks of its lines
+def split_log_brok(b):
+    b.prepare()
+    lines = b.data.get('lines')
+    if not lines:
+        return [b]
+    broks = []
+    for line in lines:
+        data = b.data.copy()
+        del data['lines']
+        data['log'] = line
+        broks.append(Brok('log', data))
+    return broks
+
+
+# Frame of a brok on the wire: its serialized data is given as is, so
+# it is not pickled again, and it is decoded only by the prepare() of
+# the broker that manage it. The frame is done once, and shared by all
+# the batches of all the brokers
+def _frame(b):
+    frame = b.__dict__.get('frame')
+    if frame is None:
+        data = b.data
+        if getattr(b, 'prepared', False):
+            data = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+        body = marshal.dumps((b.id, b.type, getattr(b, 'instance_id', 0), data))
+        frame = b.frame = struct.pack('!I', len(body)) + body
+    return frame
+
+
+# Get back a brok from its frame, without serializing its data again
+def _unframe(body):
+    b_id, b_type, instance_id, data = marshal.loads(body)
+    b = types.InstanceType(Brok)
+    b.id = b_id
+    b.type = b_type
+    b.instance_id = instance_id
+    b.data = data
+    b.prepared = False
+    return b
+
+
+# Pack a batch of broks for a broker that stream them. nb_left is the
+# number of broks still waiting for it after this batch
+def pack_broks(broks, nb_left):
+    frames = [struct.pack('!I', nb_left)]
+    frames.extend([_frame(b) for b in broks])
+    return STREAM_MAGIC + zlib.compress(''.join(frames), 2)
+
+
+def is_packed_broks(raw):
+    return isinstance(raw, str) and raw.startswith(STREAM_MAGIC)
+
+
+# Get back the (nb_left, broks) of a packed batch
+def unpack_broks(raw):
+    if not is_packed_broks(raw):
+        raise ValueError('Not a packed broks batch')
+    raw = zlib.decompress(raw[len(STREAM_MAGIC):])
+    size = len(raw)
+    nb_left = struct.unpack_from('!I', raw)[0]
+    pos = 4
+    broks = []
+    while pos < size:
+        length = struct.unpack_from('!I', raw, pos)[0]
+        pos += 4
+        broks.append(_unframe(raw[pos:pos + length]))
+        pos += length
+    return nb_left, broks
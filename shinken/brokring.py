@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#     Gabes Jean, naparuba@gmail.com
+#     Gerhard Lausser, Gerhard.Lausser@consol.de
+#     Gregory Starck, g.starck@gmail.com
+#     Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module shares the broks batches between the broker and its
+external modules processes. A batch is pickled and written only once in
+a shared memory ring, and each module only got in its queue where to
+read it. Each module has its own read cursor in the ring, so the broker
+knows what it can overwrite. If the ring is full, the batch is given in
+the queue like before.
+
+The ring is inherited by the modules processes when they fork, so it
+is not used where we cannot fork (Windows).
+"""
+
+import os
+import mmap
+import ctypes
+import cPickle
+from multiprocessing import Queue, RawArray
+
+from shinken.log import logger
+
+
+class BrokRing(object):
+    """A shared memory ring of pickled broks batches. Only the broker
+    writes in it, the readers are the external modules processes.
+    """
+
+    def __init__(self, size, nb_slots=32):
+        self.size = size
+        self.mm = mmap.mmap(-1, size)
+        # The position of each reader in the ring, -1 if the slot is free.
+        # Positions only grow, the place in the ring is modulo size
+        self.cursors = RawArray(ctypes.c_longlong, nb_slots)
+        for i in xrange(nb_slots):
+            self.cursors[i] = -1
+        self.write_pos = 0
+
+
+    # Get a queue for a new reader, None if we have no more free slot
+    def get_queue(self):
+        for i in xrange(len(self.cursors)):
+            if self.cursors[i] == -1:
+                # It will read only the next batches
+                self.cursors[i] = self.write_pos
+                return BrokRingQueue(self, i)
+        return None
+
+
+    def release(self, slot):
+        self.cursors[slot] = -1
+
+
+    # Pickle the batch, and write it in the ring if there is room for it.
+    # Returns the pickled batch and where it is in the ring (None if not)
+    def write(self, broks):
+        blob = cPickle.dumps(broks, cPickle.HIGHEST_PROTOCOL)
+        length = len(blob)
+        lowest = self.write_pos
+        for pos in self.cursors:
+            if pos != -1 and pos < lowest:
+                lowest = pos
+        # Do not overwrite what a reader did not read
+        if self.write_pos + length - lowest > self.size:
+            return blob, None
+
+        start = self.write_pos % self.size
+        first = min(length, self.size - start)
+        self.mm[start:start + first] = blob[:first]
+        if first < length:
+            self.mm[0:length - first] = blob[first:]
+        desc = (self.write_pos, length)
+        self.write_pos += length
+        return blob, desc
+
+
+    # Called by the readers: get back the batch, and say we are done with it
+    def read(self, slot, pos, length):
+        start = pos % self.size
+        first = min(length, self.size - start)
+        blob = self.mm[start:start + first]
+        if first < length:
+            blob += self.mm[0:length - first]
+        self.cursors[slot] = pos + length
+        return cPickle.loads(blob)
+
+
+class BrokRingQueue(object):
+    """The to_q of an external module that reads its broks in a ring. It
+    behaves like a Queue, so the modules get lists of broks like before.
+    """
+
+    def __init__(self, ring, slot):
+        self.ring = ring
+        self.slot = slot
+        # The queue only got where to read the batches, or the pickled
+        # batches that were not in the ring
+        self.q = Queue()
+
+
+    # Give a batch written (or not) by BrokRing.write
+    def put_batch(self, blob, desc):
+        if desc is not None:
+            self.q.put(('ring', desc))
+        else:
+            self.q.put(('raw', blob))
+
+
+    def put(self, obj, block=True, timeout=None):
+        self.q.put(('raw', cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)), block, timeout)
+
+
+    def get(self, block=True, timeout=None):
+        kind, value = self.q.get(block, timeout)
+        if kind == 'ring':
+            return self.ring.read(self.slot, *value)
+        return cPickle.loads(value)
+
+
+    def get_nowait(self):
+        return self.get(False)
+
+
+    def qsize(self):
+        return self.q.qsize()
+
+
+    def empty(self):
+        return self.q.empty()
+
+
+    # The reader is gone, it does not hold the ring anymore
+    def close(self):
+        self.ring.release(self.slot)
+        self.q.close()
+
+
+    def join_thread(self):
+        self.q.join_thread()
+
+
+# Create the ring of a broker, None if we cannot have it here
+def create_brok_ring(size):
+    if os.name == 'nt' or size <= 0:
+        return None
+    try:
+        return BrokRing(size)
+    except (EnvironmentError, ValueError), exp:
+        logger.warning("Cannot create the broks shared memory ring, "
+                       "I will use the queues: %s", exp)
+        return None
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#     Gabes Jean, naparuba@gmail.com
+#     Gerhard Lausser, Gerhard.Lausser@consol.de
+#     Gregory Starck, g.starck@gmail.com
+#     Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module runs an internal module of the broker in its own thread,
+so a slow module do not stall the others ones. The hooks of the module
+are called from this thread too, so a module is only used by one thread
+and does not have to be thread safe.
+"""
+
+import time
+import threading
+import traceback
+from collections import deque
+
+from shinken.log import logger
+
+
+class BrokWorker(object):
+    """Give the broks to one internal module, in their order, from a
+    thread. The broks are buffered, and the buffer is bounded so the
+    broker knows when it must wait before getting new broks.
+    """
+
+    def __init__(self, mod, max_size):
+        self.mod = mod
+        self.max_size = max_size
+        self.broks = deque()
+        self.cond = threading.Condition()
+        self.interrupted = False
+        self.thread = None
+        # The trace of the exception of the module, if it raised one
+        self.failure = None
+        # Stats: broks managed and time passed in the module
+        self.nb_managed = 0
+        self.busy_time = 0.0
+        self.last_stats = (time.time(), 0)
+
+
+    def get_name(self):
+        return self.mod.get_name()
+
+
+    def start(self):
+        self.thread = threading.Thread(None, self.work, 'brokworker-%s' % self.get_name())
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    # Stop the thread, the broks not managed are forgotten
+    def stop(self, timeout=0):
+        with self.cond:
+            self.interrupted = True
+            self.broks.clear()
+            self.cond.notify()
+        if timeout and self.thread is not None:
+            self.thread.join(timeout)
+
+
+    def put(self, broks):
+        with self.cond:
+            self.broks.extend(broks)
+            self.cond.notify()
+
+
+    # Number of broks the module did not manage yet
+    def get_lag(self):
+        return len(self.broks)
+
+
+    def is_full(self):
+        return len(self.broks) >= self.max_size
+
+
+    # Call the hook of the module from our thread, after the broks we
+    # already got
+    def put_hook(self, hook_name, daemon):
+        with self.cond:
+            self.broks.append((hook_name, daemon))
+            self.cond.notify()
+
+
+    # The broks the module did not manage yet, the older first
+    def get_pending(self):
+        with self.cond:
+            return [b for b in self.broks if not isinstance(b, tuple)]
+
+
+    # Broks managed by second since the last call
+    def get_throughput(self):
+        now = time.time()
+        last_time, last_nb = self.last_stats
+        self.last_stats = (now, self.nb_managed)
+        if now <= last_time:
+            return 0.0
+        return (self.nb_managed - last_nb) / (now - last_time)
+
+
+    def work(self):
+        while True:
+            with self.cond:
+                while not self.broks and not self.interrupted:
+                    self.cond.wait(1.0)
+                if self.interrupted:
+                    return
+                b = self.broks.popleft()
+
+            t0 = time.time()
+            try:
+                if isinstance(b, tuple):
+                    (hook_name, daemon) = b
+                    getattr(self.mod, 'hook_' + hook_name)(daemon)
+                    continue
+                self.mod.manage_brok(b)
+            except Exception, exp:
+                logger.warning("The mod %s raise an exception: %s, I'm tagging it to restart later",
+                               self.get_name(), str(exp))
+                logger.warning("Exception type: %s", type(exp))
+                logger.warning("Back trace of this kill: %s", traceback.format_exc())
+                # The broker will restart it, we just stop here
+                self.failure = traceback.format_exc()
+                return
+            self.busy_time += time.time() - t0
+            self.nb_managed += 1
@@ -70,6 +70,9 @@ class Check(Action):
                  timeout=10, poller_tag='None', reactionner_tag='None',
                  env={}, module_type='fork', from_trigger=False, dependency_check=False):
 
+        # The scheduler queue that index us by status and t_to_go, if any
+        self.queue = None
+        self._status = ''
         self.is_a = 'check'
         self.type = ''
         if id is None:  # id != None is for copy call only
@@ -111,6 +114,55 @@ class Check(Action):
         self.dependency_check = dependency_check
 
 
+    # When the t_to_go change, the scheduler queue must index the check
+    # at its new time (forced checks, time changes, ...)
+    def _get_t_to_go(self):
+        return self._t_to_go
+
+    def _set_t_to_go(self, t_to_go):
+        self._t_to_go = t_to_go
+        if self.queue is not None:
+            self.queue.push(self)
+
+    t_to_go = property(_get_t_to_go, _set_t_to_go)
+
+
+    # Same for the status: the scheduler queue keep the checks by status
+    # so it do not have to look at all checks to find the zombies & co
+    def _get_status(self):
+        return self._status
+
+    def _set_status(self, status):
+        old_status = self._status
+        self._status = status
+        if self.queue is not None and status != old_status:
+            self.queue.status_changed(self, old_status)
+
+    status = property(_get_status, _set_status)
+
+
+    # Call by pickle to dataify the check. We do not want the queue
+    # and we keep the same state than before the properties so
+    # satellites of others versions can still read us
+    def __getstate__(self):
+        res = self.__dict__.copy()
+        res['t_to_go'] = res.pop('_t_to_go', 0)
+        res['status'] = res.pop('_status', '')
+        res.pop('queue', None)
+        return res
+
+
+    # Inverted function of getstate
+    def __setstate__(self, state):
+        state = state.copy()
+        t_to_go = state.pop('t_to_go', 0)
+        status = state.pop('status', '')
+        self.__dict__.update(state)
+        self.queue = None
+        self._status = status
+        self.t_to_go = t_to_go
+
+
     def copy_shell(self):
         """return a copy of the check but just what is important for execution
         So we remove the ref and all
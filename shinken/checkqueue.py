@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#     Gabes Jean, naparuba@gmail.com
+#     Gerhard Lausser, Gerhard.Lausser@consol.de
+#     Gregory Starck, g.starck@gmail.com
+#     Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import threading
+
+
+class CheckQueue(object):
+    """Status and time index of the checks of a scheduler.
+
+    Checks ids are kept in one set by status, updated by the Check.status
+    setter, so the scheduler loop only looks at the zombies, the results to
+    consume and co instead of scanning all the checks each time.
+
+    The scheduled checks are also put in a heap keyed by their t_to_go, one
+    heap for each (poller_tag, module_type) couple, so a poller request only
+    looks at the checks it can run and that are due.
+
+    Entries are never removed from the heaps when a check changes: they are
+    just validated against the checks dict when they are popped, and a new
+    entry is pushed each time the t_to_go of a check changes or when it goes
+    back in the scheduled status.
+
+    Long polling satellites can wait for new checks with wait_new_checks.
+    """
+
+    def __init__(self, checks):
+        # The scheduler checks dict, that is the reference
+        self.checks = checks
+        self.by_status = {}
+        self.buckets = {}
+        self.nb_entries = 0
+        # Set when there is something new for the long polling satellites
+        self.new_checks = threading.Event()
+        self.waiters_lock = threading.Lock()
+        self.nb_waiters = 0
+
+
+    def clear(self):
+        self.by_status.clear()
+        self.buckets.clear()
+        self.nb_entries = 0
+
+
+    # A new check for the scheduler
+    def add(self, c):
+        c.queue = self
+        ids = self.by_status.get(c.status)
+        if ids is None:
+            ids = self.by_status[c.status] = set()
+        ids.add(c.id)
+        self.push(c)
+
+
+    # The check is removed from the scheduler, we forget about it
+    def remove(self, c):
+        c.queue = None
+        self.by_status.get(c.status, set()).discard(c.id)
+
+
+    # Called by the Check.status setter
+    def status_changed(self, c, old_status):
+        self.by_status.get(old_status, set()).discard(c.id)
+        ids = self.by_status.get(c.status)
+        if ids is None:
+            ids = self.by_status[c.status] = set()
+        ids.add(c.id)
+        # Its previous entry was consumed when it was given to a poller
+        if c.status == 'scheduled':
+            self.push(c)
+
+
+    # Number of checks in this status
+    def count(self, status):
+        return len(self.by_status.get(status, ()))
+
+
+    # Give the checks that are in this status, ordered by id, so
+    # in their creation order
+    def get_by_status(self, status):
+        checks = self.checks
+        res = []
+        for c_id in sorted(self.by_status.get(status, ())):
+            c = checks.get(c_id)
+            if c is not None:
+                res.append(c)
+        return res
+
+
+    # Index a check at its current t_to_go. Internal checks are never
+    # given to pollers, so we do not need them
+    def push(self, c):
+        if c.internal:
+            return
+        key = (c.poller_tag, c.module_type)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = []
+        heapq.heappush(bucket, (c.t_to_go, c.id))
+        self.nb_entries += 1
+        if self.nb_waiters:
+            self.new_checks.set()
+
+
+    # Wake up the waiting satellites, so they can look for new checks
+    # or actions
+    def wake_up_waiters(self):
+        if self.nb_waiters:
+            self.new_checks.set()
+
+
+    # Wait at most timeout for a push or a wake up. The caller should clear
+    # new_checks before it looks for checks, so it cannot miss one
+    def wait_new_checks(self, timeout):
+        with self.waiters_lock:
+            self.nb_waiters += 1
+        try:
+            self.new_checks.wait(timeout)
+        finally:
+            with self.waiters_lock:
+                self.nb_waiters -= 1
+
+
+    # Give all the scheduled checks that are launchable at now for
+    # theses poller_tags and module_types, the oldest first
+    def pop_launchable(self, now, poller_tags, module_types):
+        res = []
+        taken = set()
+        checks = self.checks
+        for (poller_tag, module_type), bucket in self.buckets.iteritems():
+            if poller_tag not in poller_tags or module_type not in module_types:
+                continue
+            while bucket and bucket[0][0] < now:
+                t_to_go, c_id = heapq.heappop(bucket)
+                self.nb_entries -= 1
+                c = checks.get(c_id)
+                # Maybe the check is gone, or is already in a poller. It
+                # can also have several valid entries (its t_to_go changed
+                # when it was in a poller, and then it was scheduled again)
+                if c is None or c.status != 'scheduled' or c_id in taken:
+                    continue
+                # The t_to_go changed since this entry was pushed, so another
+                # entry exists for the new value. We only take this one if
+                # the check is due anyway (and so the other one will be skipped)
+                if c.t_to_go != t_to_go and not c.is_launchable(now):
+                    continue
+                taken.add(c_id)
+                res.append(c)
+        return res
+
+
+    # The t_to_go of the next check for theses poller_tags and module_types
+    # (or None if there is none). It can be a bit in the past if the entry
+    # is an outdated one
+    def get_next_t_to_go(self, poller_tags, module_types):
+        res = None
+        for (poller_tag, module_type), bucket in self.buckets.iteritems():
+            if poller_tag not in poller_tags or module_type not in module_types:
+                continue
+            if bucket and (res is None or bucket[0][0] < res):
+                res = bucket[0][0]
+        return res
+
+
+    # Outdated entries are only dropped when they are popped, and some buckets
+    # are maybe never asked by a poller. So when we have too many entries
+    # we rebuild the heaps with only the valid ones
+    def compact(self):
+        if self.nb_entries <= 2 * len(self.checks) + 1024:
+            return
+        checks = self.checks
+        self.nb_entries = 0
+        for key, bucket in self.buckets.items():
+            new_bucket = []
+            for (t_to_go, c_id) in bucket:
+                c = checks.get(c_id)
+                if c is not None and c.status == 'scheduled' and c.t_to_go == t_to_go:
+                    new_bucket.append((t_to_go, c_id))
+            heapq.heapify(new_bucket)
+            self.buckets[key] = new_bucket
+            self.nb_entries += len(new_bucket)
@@ -129,6 +129,7 @@ class Interface(object):
     def put_conf(self, conf):
         self.app.new_conf = conf
     put_conf.method = 'post'
+    put_conf.need_lock = 'conf'
     put_conf.doc = doc
 
 
@@ -227,6 +228,7 @@ class Daemon(object):
         'server_cert':   StringProp(default='etc/certs/server.cert'),
         'use_local_log': BoolProp(default=True),
         'log_level':     LogLevelProp(default='WARNING'),
+        'async_log':     BoolProp(default=True),
         'hard_ssl_name_check':    BoolProp(default=False),
         'idontcareaboutsecurity': BoolProp(default=False),
         'daemon_enabled': BoolProp(default=True),
@@ -263,6 +265,8 @@ class Daemon(object):
 
         self.new_conf = None  # used by controller to push conf
         self.cur_conf = None
+        # The arbiter puts the new conf without the global lock
+        self.conf_lock = threading.RLock()
 
         # Flag to know if we need to dump memory or not
         self.need_dump_memory = False
@@ -626,10 +630,15 @@ class Daemon(object):
             # startargs[0] will be ['self'] if old multiprocessing lib
             # and ['self', 'initializer', 'initargs'] in newer ones
             # note: windows do not like pickle http_daemon...
-            if os.name != 'nt' and len(startargs[0]) > 1:
-                manager.start(close_http_daemon, initargs=(self.http_daemon,))
-            else:
-                manager.start()
+            # Do not fork while the logs are written
+            paused = logger.pause_writer()
+            try:
+                if os.name != 'nt' and len(startargs[0]) > 1:
+                    manager.start(close_http_daemon, initargs=(self.http_daemon,))
+                else:
+                    manager.start()
+            finally:
+                logger.resume_writer(paused)
             return manager
 
 
@@ -671,6 +680,9 @@ class Daemon(object):
         # a test launch (time.time() is hooked and will do BIG problems there)
         if not fake:
             statsmgr.launch_reaper_thread()
+            # Same for the log writer thread, our loop will only queue its logs
+            if self.async_log:
+                logger.set_async(True)
 
         # Now start the http_daemon thread
         self.http_thread = None
@@ -32,6 +32,7 @@ import cStringIO
 import cPickle
 import copy
 import json
+import threading
 
 from shinken.objects.config import Config
 from shinken.external_command import ExternalCommandManager
@@ -67,6 +68,7 @@ class IForArbiter(Interface):
         super(IForArbiter, self).put_conf(conf)
         self.app.must_run = False
     put_conf.method = 'POST'
+    put_conf.need_lock = 'conf'
     put_conf.doc = doc
 
 
@@ -183,6 +185,8 @@ class Arbiter(Daemon):
         self.arb_name = arb_name
 
         self.broks = {}
+        # The log writer thread adds broks too
+        self.broks_lock = threading.RLock()
         self.is_master = False
         self.me = None
 
@@ -204,7 +208,8 @@ class Arbiter(Daemon):
     # Use for adding things like broks
     def add(self, b):
         if isinstance(b, Brok):
-            self.broks[b.id] = b
+            with self.broks_lock:
+                self.broks[b.id] = b
         elif isinstance(b, ExternalCommand):
             self.external_commands.append(b)
         else:
@@ -217,13 +222,21 @@ class Arbiter(Daemon):
     # TODO: better find the broker, here it can be dead?
     # or not the good one?
     def push_broks_to_broker(self):
+        # Take them, so the new ones are not lost or pickled while we send
+        with self.broks_lock:
+            broks = self.broks
+            self.broks = {}
         for brk in self.conf.brokers:
             # Send only if alive of course
             if brk.manage_arbiters and brk.alive:
-                is_send = brk.push_broks(self.broks)
+                is_send = brk.push_broks(broks)
                 if is_send:
                     # They are gone, we keep none!
-                    self.broks.clear()
+                    broks = {}
+        # Not sent, we will try again later
+        if broks:
+            with self.broks_lock:
+                self.broks.update(broks)
 
     # We must take external_commands from all satellites
     # like brokers, pollers, reactionners or receivers
@@ -271,11 +284,21 @@ class Arbiter(Daemon):
         return daemon_type + 's'
 
 
+    # Log the time of the configuration phase that just finished
+    def log_phase_time(self, phase):
+        now = time.time()
+        logger.info("[config] %s phase done in %.2fs", phase, now - self.last_phase_time)
+        self.last_phase_time = now
+
+
     def load_config_file(self):
         logger.info("Loading configuration")
+        self.last_phase_time = time.time()
         # REF: doc/shinken-conf-dispatching.png (1)
         buf = self.conf.read_config(self.config_files)
+        self.log_phase_time('read')
         raw_objects = self.conf.read_config_buf(buf)
+        self.log_phase_time('parse')
 
         logger.debug("Opening local log file")
 
@@ -339,9 +362,11 @@ class Arbiter(Daemon):
         # Call modules get_objects() to load new objects from them
         # (example modules: glpi, mongodb, dummy_arbiter)
         self.load_modules_configuration_objects(raw_objects)
+        self.log_phase_time('modules')
 
         # Resume standard operations ###
         self.conf.create_objects(raw_objects)
+        self.log_phase_time('create_objects')
 
         # Maybe conf is already invalid
         if not self.conf.conf_is_correct:
@@ -365,8 +390,11 @@ class Arbiter(Daemon):
         # All inheritances
         self.conf.apply_inheritance()
 
+        self.log_phase_time('inheritance')
+
         # Explode between types
         self.conf.explode()
+        self.log_phase_time('explode')
 
         # Implicit inheritance for services
         self.conf.apply_implicit_inheritance()
@@ -385,6 +413,7 @@ class Arbiter(Daemon):
 
         # Linkify objects to each other
         self.conf.linkify()
+        self.log_phase_time('linkify')
 
         # applying dependencies
         self.conf.apply_dependencies()
@@ -416,8 +445,11 @@ class Arbiter(Daemon):
         # Manage all post-conf modules
         self.hook_point('late_configuration')
 
+        self.log_phase_time('business_rules')
+
         # Correct conf?
         self.conf.is_correct()
+        self.log_phase_time('is_correct')
 
         # Maybe some elements where not wrong, so we must clean if possible
         self.conf.clean()
@@ -429,6 +461,7 @@ class Arbiter(Daemon):
         # REF: doc/shinken-conf-dispatching.png (2)
         logger.info("Cutting the hosts and services into parts")
         self.confs = self.conf.cut_into_parts()
+        self.log_phase_time('cut_into_parts')
 
         # The conf can be incorrect here if the cut into parts see errors like
         # a realm with hosts and not schedulers for it
@@ -461,6 +494,7 @@ class Arbiter(Daemon):
         # TODO: check OK or not
         self.log_level = self.conf.log_level
         self.use_local_log = self.conf.use_local_log
+        self.async_log = self.conf.async_log
         self.local_log = self.conf.local_log
         self.pidfile = os.path.abspath(self.conf.lock_file)
         self.idontcareaboutsecurity = self.conf.idontcareaboutsecurity
@@ -635,11 +669,12 @@ class Arbiter(Daemon):
 
     def setup_new_conf(self):
         """ Setup a new conf received from a Master arbiter. """
-        conf = self.new_conf
+        with self.conf_lock:
+            conf = self.new_conf
+            self.new_conf = None
         if not conf:
             return
         conf = cPickle.loads(conf)
-        self.new_conf = None
         self.cur_conf = conf
         self.conf = conf
         for arb in self.conf.arbiters:
@@ -856,7 +891,8 @@ class Arbiter(Daemon):
     # So we give our broks and external commands
     def get_retention_data(self):
         r = {}
-        r['broks'] = self.broks
+        with self.broks_lock:
+            r['broks'] = self.broks.copy()
         r['external_commands'] = self.external_commands
         return r
 
@@ -865,7 +901,8 @@ class Arbiter(Daemon):
     def restore_retention_data(self, data):
         broks = data['broks']
         external_commands = data['external_commands']
-        self.broks.update(broks)
+        with self.broks_lock:
+            self.broks.update(broks)
         self.external_commands.extend(external_commands)
 
 
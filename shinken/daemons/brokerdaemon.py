@@ -34,11 +34,13 @@ from multiprocessing import active_children
 
 from shinken.satellite import BaseSatellite
 from shinken.property import PathProp, IntegerProp
-from shinken.util import sort_by_ids
 from shinken.log import logger
 from shinken.stats import statsmgr
 from shinken.external_command import ExternalCommand
 from shinken.http_client import HTTPClient, HTTPExceptions
+from shinken.brok import is_packed_broks, unpack_broks, split_log_brok
+from shinken.brokworker import BrokWorker
+from shinken.brokring import create_brok_ring
 from shinken.daemon import Daemon, Interface
 
 class IStats(Interface):
@@ -58,7 +60,15 @@ class IStats(Interface):
             except Exception, exp:
                 res.append({'module_name': inst.get_name(), 'queue_size': 0})
 
+        # Internal ones got their own buffer
+        for w in app.workers.values():
+            res.append({'module_name': w.get_name(), 'queue_size': w.get_lag(),
+                        'managed': w.nb_managed, 'busy_time': w.busy_time})
+
         return res
+    # The lists of the modules and of the workers are copies, and their
+    # queues are thread safe, so there is no need to wait for the loop
+    get_raw_stats.need_lock = False
     get_raw_stats.doc = doc
 
 
@@ -70,6 +80,9 @@ class Broker(BaseSatellite):
         'pidfile':   PathProp(default='brokerd.pid'),
         'port':      IntegerProp(default=7772),
         'local_log': PathProp(default='brokerd.log'),
+        'broks_batch_size': IntegerProp(default=10000),
+        'internal_queue_size': IntegerProp(default=100000),
+        'brok_ring_size': IntegerProp(default=67108864),
     })
 
     def __init__(self, config_file, is_daemon, do_replace, debug, debug_file, profile=''):
@@ -96,11 +109,19 @@ class Broker(BaseSatellite):
         self.broks = []  # broks to manage
         # broks raised this turn and that needs to be put in self.broks
         self.broks_internal_raised = []
+        # the log writer thread raises broks too
+        self.broks_internal_lock = threading.RLock()
         # broks raised by the arbiters, we need a lock so the push can be in parallel
         # to our current activities and won't lock the arbiter
         self.arbiter_broks = []
         self.arbiter_broks_lock = threading.RLock()
 
+        # Internal modules manage the broks in their own thread
+        # module instance -> its BrokWorker
+        self.workers = {}
+        # External ones read them in a shared memory ring, if we can
+        self.brok_ring = None
+
         self.timeout = 1.0
 
         self.istats = IStats(self)
@@ -116,7 +137,8 @@ class Broker(BaseSatellite):
         if cls_type == 'brok':
             # For brok, we TAG brok with our instance_id
             elt.instance_id = 0
-            self.broks_internal_raised.append(elt)
+            with self.broks_internal_lock:
+                self.broks_internal_raised.append(elt)
             return
         elif cls_type == 'externalcommand':
             logger.debug("Enqueuing an external command '%s'", str(ExternalCommand.__dict__))
@@ -248,6 +270,8 @@ class Broker(BaseSatellite):
                 # we must ask for a new full broks if
                 # it's a scheduler
                 if type == 'scheduler':
+                    # The brok ids of a new run are not the ones we got
+                    links[id]['brok_cursor'] = -1
                     logger.debug("[%s] I ask for a broks generation to the scheduler %s",
                                  self.name, links[id]['name'])
                     con.get('fill_initial_broks', {'bname': self.name}, wait='long')
@@ -266,37 +290,27 @@ class Broker(BaseSatellite):
         logger.info("Connection OK to the %s %s", type, links[id]['name'])
 
 
-    # Get a brok. Our role is to put it in the modules
-    # DO NOT CHANGE data of b!!!
-    # REF: doc/broker-modules.png (4-5)
-    def manage_brok(self, b):
-        # Call all modules if they catch the call
-        for mod in self.modules_manager.get_internal_instances():
-            try:
-                mod.manage_brok(b)
-            except Exception, exp:
-                logger.debug(str(exp.__dict__))
-                logger.warning("The mod %s raise an exception: %s, I'm tagging it to restart later",
-                               mod.get_name(), str(exp))
-                logger.warning("Exception type: %s", type(exp))
-                logger.warning("Back trace of this kill: %s", traceback.format_exc())
-                self.modules_manager.set_to_restart(mod)
-
-
     # Add broks (a tab) to different queues for
     # internal and external modules
     def add_broks_to_queue(self, broks):
         # Ok now put in queue broks to be managed by
-        # internal modules
-        self.broks.extend(broks)
+        # internal modules. The log broks may have several lines, the
+        # modules get one brok by line
+        for b in broks:
+            if b.type == 'log':
+                self.broks.extend(split_log_brok(b))
+            else:
+                self.broks.append(b)
 
 
     # Each turn we get all broks from
     # self.broks_internal_raised and we put them in
     # self.broks
     def interger_internal_broks(self):
-        self.add_broks_to_queue(self.broks_internal_raised)
-        self.broks_internal_raised = []
+        with self.broks_internal_lock:
+            broks = self.broks_internal_raised
+            self.broks_internal_raised = []
+        self.add_broks_to_queue(broks)
 
 
     # We will get in the broks list the broks from the arbiters,
@@ -308,6 +322,34 @@ class Broker(BaseSatellite):
             self.arbiter_broks = []
 
 
+    # Get the broks of a distant daemon. The schedulers stream them: we
+    # ask the ones after our cursor by batches, and giving the cursor
+    # ack the previous batch so the scheduler can free it. Other daemons
+    # (and old schedulers) give all their broks at once
+    # Arguments of the get_broks query to a link
+    def get_broks_args(self, link, type):
+        args = {'bname': self.name}
+        if type == 'scheduler':
+            args['max_broks'] = getattr(self, 'broks_batch_size', 10000)
+        if 'brok_cursor' in link:
+            args['after'] = link['brok_cursor']
+        return args
+
+
+    # Load the broks a link answered to get_broks. Returns them with the
+    # number of broks it still has for us
+    def load_broks(self, link, raw):
+        if not is_packed_broks(raw):
+            _t = base64.b64decode(raw)
+            _t = zlib.decompress(_t)
+            tmp_broks = cPickle.loads(_t)
+            return [tmp_broks[i] for i in sorted(tmp_broks)], 0
+        nb_left, broks = unpack_broks(raw)
+        if broks:
+            link['brok_cursor'] = broks[-1].id
+        return broks, nb_left
+
+
     # We get new broks from schedulers
     # REF: doc/broker-modules.png (2)
     def get_new_broks(self, type='scheduler'):
@@ -317,57 +359,146 @@ class Broker(BaseSatellite):
             logger.debug('Type unknown for connection! %s', type)
             return
 
-        # We check for new check in each schedulers and put
-        # the result in new_checks
+        sched_ids = []
         for sched_id in links:
-            try:
-                con = links[sched_id]['con']
-                if con is not None:  # None = not initialized
-                    t0 = time.time()
-                    # Before ask a call that can be long, do a simple ping to be sure it is alive
-                    con.get('ping')
-                    tmp_broks = con.get('get_broks', {'bname': self.name}, wait='long')
+            if links[sched_id].get('con') is None:  # None = not initialized
+                self.pynag_con_init(sched_id, type=type)
+            else:
+                sched_ids.append(sched_id)
+
+        # We ask all the links at the same time, and again the ones that still
+        # have broks for us. Do not loop too much, the broks must be managed too
+        start = time.time()
+        while sched_ids:
+            for sched_id in sched_ids:
+                link = links[sched_id]
+                self.http_multi.get(link['con'], 'get_broks', self.get_broks_args(link, type),
+                                    wait='long')
+            results = self.http_multi.perform()
+
+            again = []
+            for (sched_id, res) in zip(sched_ids, results):
+                link = links[sched_id]
+                try:
+                    if isinstance(res, Exception):
+                        raise res
                     try:
-                        _t = base64.b64decode(tmp_broks)
-                        _t = zlib.decompress(_t)
-                        tmp_broks = cPickle.loads(_t)
-                    except (TypeError, zlib.error, cPickle.PickleError), exp:
-                        logger.error('Cannot load broks data from %s : %s',
-                                     links[sched_id]['name'], exp)
-                        links[sched_id]['con'] = None
+                        tmp_broks, nb_left = self.load_broks(link, res)
+                    except (TypeError, ValueError, zlib.error, cPickle.PickleError), exp:
+                        logger.error('Cannot load broks data from %s : %s', link['name'], exp)
+                        link['con'] = None
                         continue
-                    logger.debug("%s Broks get in %s", len(tmp_broks), time.time() - t0)
-                    for b in tmp_broks.values():
-                        b.instance_id = links[sched_id]['instance_id']
+                    logger.debug("%s Broks get from %s in %s",
+                                 len(tmp_broks), link['name'], link['con'].latency)
+                    for b in tmp_broks:
+                        b.instance_id = link['instance_id']
                     # Ok, we can add theses broks to our queues
-                    self.add_broks_to_queue(tmp_broks.values())
-
-                else:  # no con? make the connection
+                    self.add_broks_to_queue(tmp_broks)
+                # Ok, con is not known, so we create it
+                except KeyError, exp:
+                    logger.debug("Key error for get_broks : %s", str(exp))
                     self.pynag_con_init(sched_id, type=type)
-            # Ok, con is not known, so we create it
-            except KeyError, exp:
-                logger.debug("Key error for get_broks : %s", str(exp))
-                self.pynag_con_init(sched_id, type=type)
-            except HTTPExceptions, exp:
-                logger.warning("Connection problem to the %s %s: %s",
-                               type, links[sched_id]['name'], str(exp))
-                links[sched_id]['con'] = None
-            # scheduler must not #be initialized
-            except AttributeError, exp:
-                logger.warning("The %s %s should not be initialized: %s",
-                               type, links[sched_id]['name'], str(exp))
-            # scheduler must not have checks
-            #  What the F**k? We do not know what happened,
-            # so.. bye bye :)
-            except Exception, x:
-                logger.error(str(x))
-                logger.error(traceback.format_exc())
-                sys.exit(1)
+                    continue
+                except HTTPExceptions, exp:
+                    logger.warning("Connection problem to the %s %s: %s",
+                                   type, link['name'], str(exp))
+                    link['con'] = None
+                    continue
+                # scheduler must not #be initialized
+                except AttributeError, exp:
+                    logger.warning("The %s %s should not be initialized: %s",
+                                   type, link['name'], str(exp))
+                    continue
+                # scheduler must not have checks
+                #  What the F**k? We do not know what happened,
+                # so.. bye bye :)
+                except Exception, x:
+                    logger.error(str(x))
+                    logger.error(traceback.format_exc())
+                    sys.exit(1)
+
+                if nb_left == 0 or time.time() - start > 1:
+                    link['broks_lag'] = nb_left
+                else:
+                    again.append(sched_id)
+            sched_ids = again
+
+
+    # Look at our internal modules workers: start the ones of new modules,
+    # and stop the ones of removed, or dead, modules
+    def update_workers(self):
+        for (inst, w) in self.workers.items():
+            if w.failure is not None:
+                self.modules_manager.set_to_restart(inst)
+        insts = self.modules_manager.get_internal_instances()
+        for (inst, w) in self.workers.items():
+            if inst not in insts:
+                w.stop()
+                del self.workers[inst]
+        for inst in insts:
+            if inst not in self.workers:
+                w = BrokWorker(inst, getattr(self, 'internal_queue_size', 100000))
+                w.start()
+                self.workers[inst] = w
+
+
+    # The internal modules are used by their worker thread, so their hooks
+    # are called from it too, in order with the broks. The other ones
+    # (external, or without worker yet) are called here
+    def hook_point(self, hook_name):
+        _t = time.time()
+        full_hook_name = 'hook_' + hook_name
+        for inst in self.modules_manager.instances:
+            if not hasattr(inst, full_hook_name):
+                continue
+            w = self.workers.get(inst)
+            if w is not None:
+                w.put_hook(hook_name, self)
+                continue
+            try:
+                getattr(inst, full_hook_name)(self)
+            except Exception as exp:
+                logger.warning('The instance %s raised an exception %s. I disabled it,'
+                               'and set it to restart later', inst.get_name(), str(exp))
+                self.modules_manager.set_to_restart(inst)
+        statsmgr.incr('core.hook.%s' % hook_name, time.time() - _t)
+
+
+    def stop_workers(self):
+        for w in self.workers.values():
+            w.stop(timeout=1)
+        self.workers.clear()
+
+
+    # If one of our internal modules is too late, we should wait
+    # before getting more broks
+    def workers_are_full(self):
+        for w in self.workers.values():
+            if w.is_full():
+                return True
+        return False
+
+
+    # The schedulers told us they still have broks for us
+    def have_broks_to_get(self):
+        if self.workers_are_full():
+            return False
+        for sched in self.schedulers.values():
+            if sched.get('broks_lag', 0) > 0:
+                return True
+        return False
 
 
     # Helper function for module, will give our broks
     def get_retention_data(self):
-        return self.broks
+        # All workers got the same broks, so the more late one got
+        # all the broks the others did not manage
+        pending = []
+        for w in self.workers.values():
+            w_pending = w.get_pending()
+            if len(w_pending) > len(pending):
+                pending = w_pending
+        return pending + self.broks
 
 
     # Get back our broks from a retention module
@@ -376,6 +507,7 @@ class Broker(BaseSatellite):
 
 
     def do_stop(self):
+        self.stop_workers()
         act = active_children()
         for a in act:
             a.terminate()
@@ -384,8 +516,9 @@ class Broker(BaseSatellite):
 
 
     def setup_new_conf(self):
-        conf = self.new_conf
-        self.new_conf = None
+        with self.conf_lock:
+            conf = self.new_conf
+            self.new_conf = None
         self.cur_conf = conf
         # Got our name from the globals
         g_conf = conf['global']
@@ -430,9 +563,11 @@ class Broker(BaseSatellite):
             if already_got:
                 broks = self.schedulers[sched_id]['broks']
                 running_id = self.schedulers[sched_id]['running_id']
+                brok_cursor = self.schedulers[sched_id].get('brok_cursor', -1)
             else:
                 broks = {}
                 running_id = 0
+                brok_cursor = -1
             s = conf['schedulers'][sched_id]
             self.schedulers[sched_id] = s
 
@@ -449,6 +584,7 @@ class Broker(BaseSatellite):
             self.schedulers[sched_id]['broks'] = broks
             self.schedulers[sched_id]['instance_id'] = s['instance_id']
             self.schedulers[sched_id]['running_id'] = running_id
+            self.schedulers[sched_id]['brok_cursor'] = brok_cursor
             self.schedulers[sched_id]['active'] = s['active']
             self.schedulers[sched_id]['last_connection'] = 0
             self.schedulers[sched_id]['timeout'] = s['timeout']
@@ -595,6 +731,9 @@ class Broker(BaseSatellite):
             # Ok now start, or restart them!
             # Set modules, init them and start external ones
             self.modules_manager.set_modules(self.modules)
+            if self.brok_ring is None:
+                self.brok_ring = create_brok_ring(getattr(self, 'brok_ring_size', 0))
+            self.modules_manager.set_brok_ring(self.brok_ring)
             self.do_load_modules()
             self.modules_manager.start_external_instances()
 
@@ -626,13 +765,15 @@ class Broker(BaseSatellite):
         self.pollers.clear()
         self.reactionners.clear()
         self.broks = self.broks[:]
-        self.broks_internal_raised = self.broks_internal_raised[:]
+        with self.broks_internal_lock:
+            self.broks_internal_raised = self.broks_internal_raised[:]
         with self.arbiter_broks_lock:
             self.arbiter_broks = self.arbiter_broks[:]
         self.external_commands = self.external_commands[:]
 
         # And now modules
         self.have_modules = False
+        self.stop_workers()
         self.modules_manager.clear_instances()
 
 
@@ -648,6 +789,17 @@ class Broker(BaseSatellite):
         metrics.append('broker.%s.external-commands.queue %d %d' % (
             self.name, len(self.external_commands), now))
         metrics.append('broker.%s.broks.queue %d %d' % (self.name, len(self.broks), now))
+        # lag and broks by second of the internal modules
+        for w in self.workers.values():
+            metrics.append('broker.%s.module.%s.lag %d %d' % (
+                self.name, w.get_name(), w.get_lag(), now))
+            metrics.append('broker.%s.module.%s.throughput %f %d' % (
+                self.name, w.get_name(), w.get_throughput(), now))
+        # broks the schedulers still have for us
+        for sched in self.schedulers.values():
+            metrics.append('broker.%s.broks.lag.%s %d %d' % (
+                self.name, sched['name'], sched.get('broks_lag', 0), now))
+        metrics.extend(self.get_latency_metrics('broker', now))
 
         return res
 
@@ -693,16 +845,22 @@ class Broker(BaseSatellite):
         # Also reap broks sent from the arbiters
         self.interger_arbiter_broks()
 
-        # Main job, go get broks in our distants daemons
-        types = ['scheduler', 'poller', 'reactionner', 'receiver']
-        for _type in types:
-            _t = time.time()
-            # And from schedulers
-            self.get_new_broks(type=_type)
-            statsmgr.incr('get-new-broks.%s' % _type, time.time() - _t)
+        # Our internal modules manage the broks in their own threads
+        self.update_workers()
+
+        # Main job, go get broks in our distants daemons. If one of our
+        # internal modules is too late, the broks will wait in the distant
+        # daemons instead of in our memory
+        if not self.workers_are_full():
+            types = ['scheduler', 'poller', 'reactionner', 'receiver']
+            for _type in types:
+                _t = time.time()
+                # And from schedulers
+                self.get_new_broks(type=_type)
+                statsmgr.incr('get-new-broks.%s' % _type, time.time() - _t)
 
-        # Sort the brok list by id
-        self.broks.sort(sort_by_ids)
+        # The broks of each distant daemon are in their order, and the ones of
+        # different daemons do not share their ids, so we keep them as they come
 
         # and for external queues
         # REF: doc/broker-modules.png (3)
@@ -712,12 +870,20 @@ class Broker(BaseSatellite):
         ext_modules = self.modules_manager.get_external_instances()
         to_send = [b for b in self.broks if getattr(b, 'need_send_to_ext', True)]
 
+        # The modules that read the ring got the batch pickled and written only once
+        blob = desc = None
+        if self.brok_ring is not None and to_send:
+            blob, desc = self.brok_ring.write(to_send)
+
         # Send our pack to all external modules to_q queue so they can get the wole packet
         # beware, the sub-process/queue can be die/close, so we put to restart the whole module
         # instead of killing ourself :)
         for mod in ext_modules:
             try:
-                mod.to_q.put(to_send)
+                if blob is not None and hasattr(mod.to_q, 'put_batch'):
+                    mod.to_q.put_batch(blob, desc)
+                else:
+                    mod.to_q.put(to_send)
             except Exception, exp:
                 # first we must find the modules
                 logger.debug(str(exp.__dict__))
@@ -735,44 +901,26 @@ class Broker(BaseSatellite):
         statsmgr.incr('core.put-to-external-queue', time.time() - t0)
         logger.debug("Time to send %s broks (%d secs)", len(to_send), time.time() - t0)
 
-        # We must had new broks at the end of the list, so we reverse the list
-        self.broks.reverse()
-
-        start = time.time()
-        while len(self.broks) != 0:
-            now = time.time()
-            # Do not 'manage' more than 1s, we must get new broks
-            # every 1s
-            if now - start > 1:
-                break
-
-            b = self.broks.pop()
-            # Ok, we can get the brok, and doing something with it
-            # REF: doc/broker-modules.png (4-5)
-            # We un serialize the brok before consume it
+        # Now give them to the internal modules. We un serialize the broks
+        # here, so the modules threads only read them
+        # REF: doc/broker-modules.png (4-5)
+        t0 = time.time()
+        for b in self.broks:
             b.prepare()
-            _t = time.time()
-            self.manage_brok(b)
-            statsmgr.incr('core.manage-brok', time.time() - _t)
-
-            nb_broks = len(self.broks)
-
-            # Ok we manage brok, but we still want to listen to arbiter
-            self.watch_for_new_conf(0.0)
-
-            # if we got new broks here from arbiter, we should break the loop
-            # because such broks will not be managed by the
-            # external modules before this loop (we pop them!)
-            if len(self.broks) != nb_broks:
-                break
+        for w in self.workers.values():
+            w.put(self.broks)
+        self.broks = []
+        statsmgr.incr('core.put-to-internal-queue', time.time() - t0)
 
         # Maybe external modules raised 'objects'
         # we should get them
         self.get_objects_from_from_queues()
 
-        # Maybe we do not have something to do, so we wait a little
-        # TODO: redone the diff management....
-        if len(self.broks) == 0:
+        # If the schedulers still have broks for us, and our modules can
+        # take them, we go get them now. If not we wait a little
+        if self.have_broks_to_get():
+            self.watch_for_new_conf(0.0)
+        else:
             while self.timeout > 0:
                 begin = time.time()
                 self.watch_for_new_conf(1.0)
@@ -780,8 +928,6 @@ class Broker(BaseSatellite):
                 self.timeout = self.timeout - (end - begin)
             self.timeout = 1.0
 
-            # print "get new broks watch new conf 1: end", len(self.broks)
-
         # Say to modules it's a new tick :)
         self.hook_point('tick')
 
@@ -54,6 +54,7 @@ class IStats(Interface):
         app = self.app
         res = {'command_buffer_size': len(app.external_commands)}
         return res
+    get_raw_stats.need_lock = False
     get_raw_stats.doc = doc
 
 class IBroks(Interface):
@@ -66,6 +67,7 @@ They connect here and get all broks (data for brokers). Data must be ORDERED!
         res = self.app.get_broks()
         return base64.b64encode(zlib.compress(cPickle.dumps(res), 2))
     get_broks.encode = 'raw'
+    get_broks.need_lock = 'broks'
 
 # Our main APP class
 class Receiver(Satellite):
@@ -122,7 +124,8 @@ class Receiver(Satellite):
         if cls_type == 'brok':
             # For brok, we TAG brok with our instance_id
             elt.instance_id = 0
-            self.broks[elt.id] = elt
+            with self.broks_lock:
+                self.broks[elt.id] = elt
             return
         elif cls_type == 'externalcommand':
             logger.debug("Enqueuing an external command: %s", str(ExternalCommand.__dict__))
@@ -168,8 +171,9 @@ class Receiver(Satellite):
 
 
     def setup_new_conf(self):
-        conf = self.new_conf
-        self.new_conf = None
+        with self.conf_lock:
+            conf = self.new_conf
+            self.new_conf = None
         self.cur_conf = conf
         # Got our name from the globals
         if 'receiver_name' in conf['global']:
@@ -286,13 +290,12 @@ class Receiver(Satellite):
         for ext_cmd in commands_to_process:
             self.external_command.resolve_command(ext_cmd)
 
-        # Now for all alive schedulers, send the commands
+        # Now for all alive schedulers, send the commands, to all of them at once
+        sched_ids = []
         for sched_id in self.schedulers:
             sched = self.schedulers[sched_id]
-            extcmds = sched['external_commands']
-            cmds = [extcmd.cmd_line for extcmd in extcmds]
+            cmds = [extcmd.cmd_line for extcmd in sched['external_commands']]
             con = sched.get('con', None)
-            sent = False
             if not con:
                 logger.warning("The scheduler is not connected %s", sched)
                 self.pynag_con_init(sched_id)
@@ -301,20 +304,27 @@ class Receiver(Satellite):
             # If there are commands and the scheduler is alive
             if len(cmds) > 0 and con:
                 logger.debug("Sending %d commands to scheduler %s", len(cmds), sched)
-                try:
-                    # con.run_external_commands(cmds)
-                    con.post('run_external_commands', {'cmds': cmds})
-                    sent = True
-                # Not connected or sched is gone
-                except (HTTPExceptions, KeyError), exp:
-                    logger.debug('manage_returns exception:: %s,%s ', type(exp), str(exp))
+                self.http_multi.post(con, 'run_external_commands', {'cmds': cmds})
+                sched_ids.append(sched_id)
+        results = dict(zip(sched_ids, self.http_multi.perform()))
+
+        for sched_id in self.schedulers:
+            sched = self.schedulers[sched_id]
+            extcmds = sched['external_commands']
+            sent = False
+            if sched_id in results:
+                res = results[sched_id]
+                # Not connected or sched is gone, its commands wait for the next turn
+                if isinstance(res, HTTPExceptions):
+                    logger.debug('manage_returns exception:: %s,%s ', type(res), str(res))
                     self.pynag_con_init(sched_id)
-                    return
-                except AttributeError, exp:  # the scheduler must  not be initialized
-                    logger.debug('manage_returns exception:: %s,%s ', type(exp), str(exp))
-                except Exception, exp:
-                    logger.error("A satellite raised an unknown exception: %s (%s)", exp, type(exp))
-                    raise
+                    continue
+                elif isinstance(res, Exception):
+                    logger.error("A satellite raised an unknown exception: %s (%s)",
+                                 res, type(res))
+                    raise res
+                else:
+                    sent = True
 
             # Wether we sent the commands or not, clean the scheduler list
             self.schedulers[sched_id]['external_commands'] = []
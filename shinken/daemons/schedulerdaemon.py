@@ -37,8 +37,11 @@ from shinken.daemon import Daemon
 from shinken.property import PathProp, IntegerProp
 from shinken.log import logger
 from shinken.satellite import BaseSatellite, IForArbiter as IArb, Interface
-from shinken.util import nighty_five_percent
+from shinken.util import compressed_loads
 from shinken.stats import statsmgr
+from shinken.http_daemon import RawResponse
+from shinken.brok import pack_broks
+from shinken.action_packer import FORMAT, pack_actions, unpack_results
 
 # Interface for Workers
 
@@ -51,21 +54,83 @@ if not, they must drop their checks """
     # def get_running_id(self):
     #    return self.running_id
 
+    # Max time a satellite can wait in wait_checks
+    max_wait = 5.0
+
     # poller or reactionner ask us actions
     def get_checks(self, do_checks=False, do_actions=False, poller_tags=['None'],
                    reactionner_tags=['None'], worker_name='none',
-                   module_types=['fork']):
+                   module_types=['fork'], wire_format=''):
         # print "We ask us checks"
+        res = self._get_checks(do_checks, do_actions, poller_tags, reactionner_tags,
+                               worker_name, module_types)
+        return self._encode_checks(res, wire_format)
+    get_checks.encode = 'raw'
+
+
+    # Same than get_checks, but if there is nothing to do now, wait at most
+    # timeout seconds for the next due check (or any new action) before
+    # answering. So the satellite got its checks as soon as they are due
+    # without polling us (and without a ping before)
+    def wait_checks(self, do_checks=False, do_actions=False, poller_tags=['None'],
+                    reactionner_tags=['None'], worker_name='none',
+                    module_types=['fork'], wire_format='', timeout='1.0'):
+        queue = self.app.checks_queue
+        http_daemon = self.app.sched_daemon.http_daemon
+        end = time.time() + min(float(timeout), self.max_wait)
+        # Waiting satellites keep an http thread, so do not take them all
+        pool_size = getattr(self.app.sched_daemon, 'daemon_thread_pool_size', 8)
+        max_waiters = max(1, pool_size / 2)
+        while True:
+            # Cleared before we look, so a push during our search will
+            # not be missed
+            queue.new_checks.clear()
+            # We are not under the global lock, the scheduler loop can be
+            # running, so take it only for the search
+            if http_daemon:
+                http_daemon.lock.acquire()
+            try:
+                res = self._get_checks(do_checks, do_actions, poller_tags, reactionner_tags,
+                                       worker_name, module_types)
+                next_t_to_go = None
+                if do_checks == 'True':
+                    next_t_to_go = queue.get_next_t_to_go(poller_tags, module_types)
+            finally:
+                if http_daemon:
+                    http_daemon.lock.release()
+            now = time.time()
+            if res or now >= end or queue.nb_waiters >= max_waiters:
+                return self._encode_checks(res, wire_format)
+            # Wait for the next due check, a new one or the next scheduler loop
+            wait = end - now
+            if next_t_to_go is not None:
+                wait = min(wait, max(0.01, next_t_to_go - now))
+            queue.wait_new_checks(wait)
+    wait_checks.encode = 'raw'
+    wait_checks.need_lock = False
+
+
+    def _get_checks(self, do_checks, do_actions, poller_tags, reactionner_tags,
+                    worker_name, module_types):
         do_checks = (do_checks == 'True')
         do_actions = (do_actions == 'True')
         res = self.app.get_to_run_checks(do_checks, do_actions, poller_tags, reactionner_tags,
                                          worker_name, module_types)
         # print "Sending %d checks" % len(res)
         self.app.nb_checks_send += len(res)
+        return res
+
 
+    # If the satellite knows our packed format, we send the checks as a raw
+    # binary body, if not (older satellites) as a base64 of the pickled shells
+    def _encode_checks(self, res, wire_format):
+        if wire_format == FORMAT:
+            try:
+                return RawResponse(pack_actions(res))
+            except ValueError, exp:  # something marshal cannot manage
+                logger.warning("Cannot pack the checks, using the old format: %s", exp)
         return base64.b64encode(zlib.compress(cPickle.dumps(res), 2))
         # return zlib.compress(cPickle.dumps(res), 2)
-    get_checks.encode = 'raw'
 
 
     # poller or reactionner are putting us results
@@ -76,14 +141,20 @@ if not, they must drop their checks """
             logger.debug("Received %d results", nb_received)
         for result in results:
             result.set_type_active()
-        with self.app.waiting_results_lock:
-            self.app.waiting_results.extend(results)
+        self.app.waiting_results.extend(results)
 
         # for c in results:
         # self.sched.put_results(c)
         return True
     put_results.method = 'post'
-    put_results.need_lock = False
+    put_results.need_lock = 'waiting_results'
+
+
+    # Same but with the results in the packed format
+    def put_packed_results(self, results):
+        return self.put_results(unpack_results(results))
+    put_packed_results.method = 'put'
+    put_packed_results.need_lock = 'waiting_results'
 
 
 class IBroks(Interface):
@@ -91,35 +162,62 @@ class IBroks(Interface):
 They connect here and get all broks (data for brokers). Data must be ORDERED!
 (initial status BEFORE update...) """
 
-    # A broker ask us broks
-    def get_broks(self, bname):
+    # A broker ask us broks. Old brokers get all of them at once, the
+    # ones that give the after cursor stream them: they get at most
+    # max_broks broks with an id higher than after, and by giving
+    # after they ack the previous batch.
+    # Only the broks queues are locked, so the brokers do not wait for
+    # the scheduler loop, nor for the pollers
+    def get_broks(self, bname, after='', max_broks='0'):
         # Maybe it was not registered as it should, if so,
-        # do it for it
+        # do it for it. The initial broks are made from all our
+        # objects, so only this case takes the global lock, and before
+        # the broks one
         if bname not in self.app.brokers:
-            self.fill_initial_broks(bname)
-
-        # Now get the broks for this specific broker
-        res = self.app.get_broks(bname)
-        # got only one global counter for broks
-        self.app.nb_broks_send += len(res)
-        # we do not more have a full broks in queue
-        self.app.brokers[bname]['has_full_broks'] = False
+            http_daemon = self.app.sched_daemon.http_daemon
+            if http_daemon:
+                http_daemon.lock.acquire()
+            try:
+                self.fill_initial_broks(bname)
+            finally:
+                if http_daemon:
+                    http_daemon.lock.release()
+
+        with self.app.broks_lock:
+            if after != '':
+                # Now get the next broks for this specific broker
+                res, nb_left = self.app.get_broks_after(bname, int(after), int(max_broks))
+                self.app.nb_broks_send += len(res)
+                if nb_left == 0:
+                    self.app.brokers[bname]['has_full_broks'] = False
+                return RawResponse(pack_broks(res, nb_left))
+
+            # Now get the broks for this specific broker
+            res = self.app.get_broks(bname)
+            # got only one global counter for broks
+            self.app.nb_broks_send += len(res)
+            # we do not more have a full broks in queue
+            self.app.brokers[bname]['has_full_broks'] = False
         return base64.b64encode(zlib.compress(cPickle.dumps(res), 2))
         # return zlib.compress(cPickle.dumps(res), 2)
     get_broks.encode = 'raw'
+    get_broks.need_lock = False
 
 
     # A broker is a new one, if we do not have
     # a full broks, we clean our broks, and
     # fill it with all new values
     def fill_initial_broks(self, bname):
-        if bname not in self.app.brokers:
-            logger.info("A new broker just connected : %s", bname)
-            self.app.brokers[bname] = {'broks': {}, 'has_full_broks': False}
-        e = self.app.brokers[bname]
-        if not e['has_full_broks']:
-            e['broks'].clear()
-            self.app.fill_initial_broks(bname, with_logs=True)
+        with self.app.broks_lock:
+            if bname not in self.app.brokers:
+                logger.info("A new broker just connected : %s", bname)
+                self.app.brokers[bname] = {'broks': {}, 'has_full_broks': False,
+                                           'sent': [], 'last_ack': 0}
+            e = self.app.brokers[bname]
+            if not e['has_full_broks']:
+                e['broks'].clear()
+                e['sent'] = []
+                self.app.fill_initial_broks(bname, with_logs=True)
 
 
 class IStats(Interface):
@@ -133,25 +231,13 @@ class IStats(Interface):
   * nb_zombies: number of zombie checks (should be close to zero)
   * nb_notifications: number of notifications+event handlers
   * latency: avg,min,max latency for the services (should be <10s)
+  * broks_lag: number of broks waiting for each broker
 '''
+    # The scheduler loop computes them at each turn, we only give the
+    # last ones, so there is no need to lock anything
     def get_raw_stats(self):
-        sched = self.app.sched
-        res = {}
-        res['nb_scheduled'] = len([c for c in sched.checks.values() if c.status == 'scheduled'])
-        res['nb_inpoller'] = len([c for c in sched.checks.values() if c.status == 'inpoller'])
-        res['nb_zombies'] = len([c for c in sched.checks.values() if c.status == 'zombie'])
-        res['nb_notifications'] = len(sched.actions)
-
-        # Spare scehdulers do not have such properties
-        if hasattr(sched, 'services'):
-            # Get a overview of the latencies with just
-            # a 95 percentile view, but lso min/max values
-            latencies = [s.latency for s in sched.services]
-            lat_avg, lat_min, lat_max = nighty_five_percent(latencies)
-            res['latency'] = (0.0, 0.0, 0.0)
-            if lat_avg:
-                res['latency'] = (lat_avg, lat_min, lat_max)
-        return res
+        return self.app.sched.raw_stats.copy()
+    get_raw_stats.need_lock = False
     get_raw_stats.doc = doc
 
 
@@ -172,6 +258,7 @@ class IForArbiter(IArb):
         self.app.sched.die()
         super(IForArbiter, self).put_conf(conf)
     put_conf.method = 'POST'
+    put_conf.need_lock = 'conf'
 
 
     # Call by arbiter if it thinks we are running but we must not (like
@@ -270,9 +357,9 @@ class Shinken(BaseSatellite):
             s.compensate_system_time_change(difference)
 
         # Now all checks and actions
-        for c in self.sched.checks.values():
+        for c in self.sched.checks_queue.get_by_status('scheduled'):
             # Already launch checks should not be touch
-            if c.status == 'scheduled' and c.t_to_go is not None:
+            if c.t_to_go is not None:
                 t_to_go = c.t_to_go
                 ref = c.ref
                 new_t = max(0, t_to_go + difference)
@@ -345,7 +432,9 @@ class Shinken(BaseSatellite):
 
 
     def setup_new_conf(self):
-        pk = self.new_conf
+        with self.conf_lock:
+            pk = self.new_conf
+            self.new_conf = None
         conf_raw = pk['conf']
         override_conf = pk['override_conf']
         modules = pk['modules']
@@ -369,9 +458,11 @@ class Shinken(BaseSatellite):
                           statsd_prefix=statsd_prefix, statsd_enabled=statsd_enabled)
 
         t0 = time.time()
-        conf = cPickle.loads(conf_raw)
+        conf = compressed_loads(conf_raw)
         logger.debug("Conf received at %d. Unserialized in %d secs", t0, time.time() - t0)
-        self.new_conf = None
+        # The raw conf can be big, do not keep it while we load the new one
+        del conf_raw
+        pk['conf'] = None
 
         # Tag the conf with our data
         self.conf = conf
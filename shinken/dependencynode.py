@@ -568,7 +568,7 @@ class DependencyNodeFactory(object):
     # Generates filter list on a hosts host_name
     def get_host_filters(self, expr):
         if expr == "*":
-            return [filter_any]
+            return [filter_any(expr)]
         match = re.search(r"^([%s]+):(.*)" % self.host_flags, expr)
 
         if match is None:
@@ -583,13 +583,13 @@ class DependencyNodeFactory(object):
         elif "t" in flags:
             return [filter_host_by_tag(expr)]
         else:
-            return [filter_none]
+            return [filter_none(expr)]
 
 
     # Generates filter list on services host_name
     def get_srv_host_filters(self, expr):
         if expr == "*":
-            return [filter_any]
+            return [filter_any(expr)]
         match = re.search(r"^([%s]+):(.*)" % self.host_flags, expr)
         if match is None:
             return [filter_service_by_host_name(expr)]
@@ -604,13 +604,13 @@ class DependencyNodeFactory(object):
         elif "t" in flags:
             return [filter_service_by_host_tag_name(expr)]
         else:
-            return [filter_none]
+            return [filter_none(expr)]
 
 
     # Generates filter list on services service_description
     def get_srv_service_filters(self, expr):
         if expr == "*":
-            return [filter_any]
+            return [filter_any(expr)]
         match = re.search(r"^([%s]+):(.*)" % self.service_flags, expr)
         if match is None:
             return [filter_service_by_name(expr)]
@@ -623,4 +623,4 @@ class DependencyNodeFactory(object):
         elif "l" in flags:
             return [filter_service_by_bp_rule_label(expr)]
         else:
-            return [filter_none]
+            return [filter_none(expr)]
@@ -30,18 +30,21 @@
  dead one to the spare
 """
 
+import sys
 import time
-import random
+import cPickle
+import hashlib
+import threading
+from collections import deque
 
 from shinken.util import alive_then_spare_then_deads
 from shinken.log import logger
 
-# Always initialize random :)
-random.seed()
-
 
 # Dispatcher Class
 class Dispatcher:
+    # Max number of satellites we talk to at the same time
+    max_concurrent_calls = 16
 
     # Load all elements, set them as not assigned
     # and add them to elements, so loop will be easier :)
@@ -115,24 +118,61 @@ class Dispatcher:
             rec.need_conf = True
 
 
+    # Call f on each element, from at most max_concurrent_calls threads, so
+    # a satellite in timeout does not delay the others. Wait for all the
+    # calls of this round and return their results, in the elts order
+    def run_concurrently(self, f, elts):
+        elts = list(elts)
+        if len(elts) <= 1:
+            return [f(elt) for elt in elts]
+
+        results = [None] * len(elts)
+        todo = deque(enumerate(elts))
+        failures = []
+
+        def work():
+            while True:
+                try:
+                    i, elt = todo.popleft()
+                except IndexError:
+                    return
+                try:
+                    results[i] = f(elt)
+                except Exception:
+                    failures.append(sys.exc_info())
+
+        threads = []
+        for i in xrange(min(self.max_concurrent_calls, len(elts))):
+            t = threading.Thread(None, work, 'dispatcher-%d' % i)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+
+        # Raise like a serial call would have done
+        if failures:
+            exc_type, exc_value, exc_tb = failures[0]
+            raise exc_type, exc_value, exc_tb
+        return results
+
+
     # checks alive elements
     def check_alive(self):
-        for elt in self.elements:
-            # print "Updating elements", elt.get_name(), elt.__dict__
-            elt.update_infos()
+        now = time.time()
+        to_check = [elt for elt in self.elements if elt.need_update_infos(now)]
+        # And the spares arbiters, if not me, but not the master too
+        to_check.extend([arb for arb in self.arbiters
+                         if arb != self.arbiter and arb.spare and arb.need_update_infos(now)])
+        self.run_concurrently(lambda elt: elt.update_infos(), to_check)
 
+        for elt in self.elements:
             # Not alive needs new need_conf
             # and spare too if they do not have already a conf
             # REF: doc/shinken-scheduler-lost.png (1)
             if not elt.alive or hasattr(elt, 'conf') and elt.conf is None:
                 elt.need_conf = True
 
-        for arb in self.arbiters:
-            # If not me, but not the master too
-            if arb != self.arbiter and arb.spare:
-                arb.update_infos()
-                # print "Arb", arb.get_name(), "alive?", arb.alive, arb.__dict__
-
 
     # Check if all active items are still alive
     # the result goes into self.dispatch_ok
@@ -239,12 +279,13 @@ class Dispatcher:
 
         # Look for receivers. If they got conf, it's ok, if not, need a simple
         # conf
-        for r in self.realms:
-            for rec in r.receivers:
-                # If the receiver does not have a conf, must got one :)
-                if rec.reachable and not rec.got_conf():
-                    self.dispatch_ok = False  # so we will redispatch all
-                    rec.need_conf = True
+        receivers = [rec for r in self.realms for rec in r.receivers if rec.reachable]
+        got_confs = self.run_concurrently(lambda rec: rec.got_conf(), receivers)
+        for rec, got_conf in zip(receivers, got_confs):
+            # If the receiver does not have a conf, must got one :)
+            if not got_conf:
+                self.dispatch_ok = False  # so we will redispatch all
+                rec.need_conf = True
 
 
     # Imagine a world where... oh no, wait...
@@ -255,22 +296,20 @@ class Dispatcher:
     # Bad dispatch: a link that has a conf but I do not allow this
     # so I ask it to wait a new conf and stop kidding.
     def check_bad_dispatch(self):
-        for elt in self.elements:
-            if hasattr(elt, 'conf'):
-                # If element has a conf, I do not care, it's a good dispatch
-                # If dead: I do not ask it something, it won't respond..
-                if elt.conf is None and elt.reachable:
-                    # print "Ask", elt.get_name() , 'if it got conf'
-                    if elt.have_conf():
-                        logger.warning("The element %s have a conf and should "
-                                       "not have one! I ask it to idle now",
-                                       elt.get_name())
-                        elt.active = False
-                        elt.wait_new_conf()
-                        # I do not care about order not send or not. If not,
-                        # The next loop will resent it
-                    # else:
-                    #    print "No conf"
+        # If element has a conf, I do not care, it's a good dispatch
+        # If dead: I do not ask it something, it won't respond..
+        to_ask = [elt for elt in self.elements
+                  if hasattr(elt, 'conf') and elt.conf is None and elt.reachable]
+        have_confs = self.run_concurrently(lambda elt: elt.have_conf(), to_ask)
+        for elt, have_conf in zip(to_ask, have_confs):
+            if have_conf:
+                logger.warning("The element %s have a conf and should "
+                               "not have one! I ask it to idle now",
+                               elt.get_name())
+                elt.active = False
+                elt.wait_new_conf()
+                # I do not care about order not send or not. If not,
+                # The next loop will resent it
 
         # I ask satellites which sched_id they manage. If I do not agree, I ask
         # them to remove it
@@ -333,6 +372,96 @@ class Dispatcher:
         return scheds
 
 
+    # Prepare the package of the conf for the scheduler sched. Its push
+    # flavor comes from its content: the same conf sent to the same
+    # scheduler always gets the same flavor
+    def get_conf_package(self, r, conf, sched):
+        override_conf = sched.get_override_configuration()
+        satellites_for_sched = r.get_satellites_links_for_scheduler()
+        s_conf = r.serialized_confs[conf.id]
+        # Prepare the conf before sending it
+        conf_package = {
+            'conf': s_conf, 'override_conf': override_conf,
+            'modules': sched.modules, 'satellites': satellites_for_sched,
+            # We tag conf with the instance_name = scheduler_name
+            'instance_name': sched.scheduler_name,
+            'skip_initial_broks': sched.skip_initial_broks,
+            'accept_passive_unknown_check_results':
+                sched.accept_passive_unknown_check_results,
+            # shiken.io part
+            'api_key': self.conf.api_key,
+            'secret': self.conf.secret,
+            'http_proxy': self.conf.http_proxy,
+            # statsd one too because OlivierHA love statsd
+            # and after some years of effort he manages to make me
+            # understand the powerfullness of metrics :)
+            'statsd_host': self.conf.statsd_host,
+            'statsd_port': self.conf.statsd_port,
+            'statsd_prefix': self.conf.statsd_prefix,
+            'statsd_enabled': self.conf.statsd_enabled,
+        }
+
+        h = hashlib.md5(conf.conf_hash)
+        for k in sorted(conf_package):
+            if k != 'conf':
+                h.update(k)
+                h.update(cPickle.dumps(conf_package[k], 0))
+        # The 0 flavor is for unmanaged confs
+        conf_package['push_flavor'] = int(h.hexdigest()[:7], 16) + 1
+        return conf_package
+
+
+    # The conf is now managed by sched, update all our data
+    def assign_conf(self, r, conf, sched):
+        sched.conf = conf
+        sched.push_flavor = conf.push_flavor
+        sched.need_conf = False
+        conf.is_assigned = True
+        conf.assigned_to = sched
+
+        # We update all data for this scheduler
+        sched.managed_confs = {conf.id: conf.push_flavor}
+
+        # Now we generate the conf for satellites:
+        cfg_id = conf.id
+        for kind in ('reactionner', 'poller', 'broker', 'receiver'):
+            r.to_satellites[kind][cfg_id] = sched.give_satellite_cfg()
+            r.to_satellites_need_dispatch[kind][cfg_id] = True
+            r.to_satellites_managed_by[kind][cfg_id] = []
+
+
+    # If one of the scheds already runs this very conf package (same flavor),
+    # assign the conf to it without sending anything. The satellites
+    # that already got it are skipped the same way by the dispatch
+    def keep_conf(self, r, conf, scheds):
+        for sched in scheds:
+            push_flavor = self.get_conf_package(r, conf, sched)['push_flavor']
+            if not sched.do_i_manage(conf.id, push_flavor):
+                continue
+            logger.info('[%s] The scheduler %s already got the configuration %d, '
+                        'I keep it', r.get_name(), sched.get_name(), conf.id)
+            conf.push_flavor = push_flavor
+            self.assign_conf(r, conf, sched)
+            scheds.remove(sched)
+            return True
+        return False
+
+
+    # Pop the next scheduler of scheds that needs a conf, None if there
+    # are no more
+    def pop_scheduler(self, r, conf, scheds):
+        while scheds:
+            sched = scheds.pop()
+            logger.info('[%s] Trying to send conf %d to scheduler %s',
+                        r.get_name(), conf.id, sched.get_name())
+            if not sched.need_conf:
+                logger.info('[%s] The scheduler %s do not need conf, sorry',
+                            r.get_name(), sched.get_name())
+                continue
+            return sched
+        return None
+
+
     # Manage the dispatch
     # REF: doc/shinken-conf-dispatching.png (3)
     def dispatch(self):
@@ -361,98 +490,66 @@ class Dispatcher:
                 # Try to send only for alive members
                 scheds = [s for s in scheds if s.alive]
 
+                # Maybe some alive schedulers already run some of these confs,
+                # like when the arbiter restarts with unchanged parts: keep
+                # them, so they (and their satellites) do not reload anything
+                for conf in conf_to_dispatch[:]:
+                    if self.keep_conf(r, conf, scheds):
+                        conf_to_dispatch.remove(conf)
+
                 # Now we do the real job
-                # every_one_need_conf = False
                 for conf in conf_to_dispatch:
                     logger.info('[%s] Dispatching configuration %s', r.get_name(), conf.id)
 
-                    # If there is no alive schedulers, not good...
-                    if len(scheds) == 0:
-                        logger.info('[%s] but there a no alive schedulers in this realm!',
-                                    r.get_name())
-
-                    # we need to loop until the conf is assigned
-                    # or when there are no more schedulers available
-                    while True:
-                        try:
-                            sched = scheds.pop()
-                        except IndexError:  # No more schedulers.. not good, no loop
-                            # need_loop = False
+                # If there is no alive schedulers, not good...
+                if conf_to_dispatch and len(scheds) == 0:
+                    logger.info('[%s] but there a no alive schedulers in this realm!',
+                                r.get_name())
+
+                # We loop until the confs are assigned or when there are no
+                # more schedulers available. On each round, every conf is sent
+                # to its next scheduler, all at once
+                while conf_to_dispatch:
+                    sendings = []
+                    for conf in conf_to_dispatch:
+                        sched = self.pop_scheduler(r, conf, scheds)
+                        if sched is None:  # No more schedulers.. not good
                             # The conf does not need to be dispatch
                             cfg_id = conf.id
                             for kind in ('reactionner', 'poller', 'broker', 'receiver'):
                                 r.to_satellites[kind][cfg_id] = None
                                 r.to_satellites_need_dispatch[kind][cfg_id] = False
                                 r.to_satellites_managed_by[kind][cfg_id] = []
-                            break
-
-                        logger.info('[%s] Trying to send conf %d to scheduler %s',
-                                    r.get_name(), conf.id, sched.get_name())
-                        if not sched.need_conf:
-                            logger.info('[%s] The scheduler %s do not need conf, sorry',
-                                        r.get_name(), sched.get_name())
                             continue
 
-                        # We tag conf with the instance_name = scheduler_name
-                        instance_name = sched.scheduler_name
-                        # We give this configuration a new 'flavor'
-                        conf.push_flavor = random.randint(1, 1000000)
                         # REF: doc/shinken-conf-dispatching.png (3)
                         # REF: doc/shinken-scheduler-lost.png (2)
-                        override_conf = sched.get_override_configuration()
-                        satellites_for_sched = r.get_satellites_links_for_scheduler()
-                        s_conf = r.serialized_confs[conf.id]
-                        # Prepare the conf before sending it
-                        conf_package = {
-                            'conf': s_conf, 'override_conf': override_conf,
-                            'modules': sched.modules, 'satellites': satellites_for_sched,
-                            'instance_name': sched.scheduler_name, 'push_flavor': conf.push_flavor,
-                            'skip_initial_broks': sched.skip_initial_broks,
-                            'accept_passive_unknown_check_results':
-                                sched.accept_passive_unknown_check_results,
-                            # shiken.io part
-                            'api_key': self.conf.api_key,
-                            'secret': self.conf.secret,
-                            'http_proxy': self.conf.http_proxy,
-                            # statsd one too because OlivierHA love statsd
-                            # and after some years of effort he manages to make me
-                            # understand the powerfullness of metrics :)
-                            'statsd_host': self.conf.statsd_host,
-                            'statsd_port': self.conf.statsd_port,
-                            'statsd_prefix': self.conf.statsd_prefix,
-                            'statsd_enabled': self.conf.statsd_enabled,
-                        }
+                        conf_package = self.get_conf_package(r, conf, sched)
+                        # We give this configuration its 'flavor'
+                        conf.push_flavor = conf_package['push_flavor']
+                        sendings.append((conf, sched, conf_package))
 
+                    def send(sending):
+                        conf, sched, conf_package = sending
                         t1 = time.time()
                         is_sent = sched.put_conf(conf_package)
                         logger.debug("Conf is sent in %d", time.time() - t1)
+                        return is_sent
+
+                    conf_to_dispatch = []
+                    is_sents = self.run_concurrently(send, sendings)
+                    for (conf, sched, conf_package), is_sent in zip(sendings, is_sents):
                         if not is_sent:
                             logger.warning('[%s] configuration dispatching error for scheduler %s',
                                            r.get_name(), sched.get_name())
+                            # Try the next scheduler on the next round
+                            conf_to_dispatch.append(conf)
                             continue
 
                         logger.info('[%s] Dispatch OK of conf in scheduler %s',
                                     r.get_name(), sched.get_name())
 
-                        sched.conf = conf
-                        sched.push_flavor = conf.push_flavor
-                        sched.need_conf = False
-                        conf.is_assigned = True
-                        conf.assigned_to = sched
-
-                        # We update all data for this scheduler
-                        sched.managed_confs = {conf.id: conf.push_flavor}
-
-                        # Now we generate the conf for satellites:
-                        cfg_id = conf.id
-                        for kind in ('reactionner', 'poller', 'broker', 'receiver'):
-                            r.to_satellites[kind][cfg_id] = sched.give_satellite_cfg()
-                            r.to_satellites_need_dispatch[kind][cfg_id] = True
-                            r.to_satellites_managed_by[kind][cfg_id] = []
-
-                        # Ok, the conf is dispatched, no more loop for this
-                        # configuration
-                        break
+                        self.assign_conf(r, conf, sched)
 
             # We pop conf to dispatch, so it must be no more conf...
             conf_to_dispatch = [cfg for cfg in self.conf.confs.values() if not cfg.is_assigned]
@@ -583,21 +680,22 @@ class Dispatcher:
             # And now we dispatch receivers. It's easier, they need ONE conf
             # in all their life :)
             for r in self.realms:
-                for rec in r.receivers:
-                    if rec.need_conf:
-                        logger.info('[%s] Trying to send configuration to receiver %s',
+                recs = [rec for rec in r.receivers if rec.need_conf]
+                reachables = [rec for rec in recs if rec.reachable]
+                is_sents = self.run_concurrently(lambda rec: rec.put_conf(rec.cfg), reachables)
+                sents = dict((rec.id, is_sent) for (rec, is_sent) in zip(reachables, is_sents))
+                for rec in recs:
+                    logger.info('[%s] Trying to send configuration to receiver %s',
+                                r.get_name(), rec.get_name())
+                    is_sent = sents.get(rec.id, False)
+                    if not rec.reachable:
+                        logger.info('[%s] Skyping configuration sent to offline receiver %s',
+                                    r.get_name(), rec.get_name())
+                    if is_sent:
+                        rec.active = True
+                        rec.need_conf = False
+                        logger.info('[%s] Dispatch OK of configuration to receiver %s',
                                     r.get_name(), rec.get_name())
-                        is_sent = False
-                        if rec.reachable:
-                            is_sent = rec.put_conf(rec.cfg)
-                        else:
-                            logger.info('[%s] Skyping configuration sent to offline receiver %s',
-                                        r.get_name(), rec.get_name())
-                        if is_sent:
-                            rec.active = True
-                            rec.need_conf = False
-                            logger.info('[%s] Dispatch OK of configuration to receiver %s',
-                                        r.get_name(), rec.get_name())
-                        else:
-                            logger.error('[%s] Dispatching failed for receiver %s',
-                                         r.get_name(), rec.get_name())
+                    else:
+                        logger.error('[%s] Dispatching failed for receiver %s',
+                                     r.get_name(), rec.get_name())
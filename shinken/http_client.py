@@ -66,6 +66,9 @@ class HTTPClient(object):
         else:
             self.uri = uri
 
+        # Time of the last query, from the connection to the end of the answer
+        self.latency = 0.0
+
         self.get_con  = self.__create_con(proxy, strong_ssl)
         self.post_con = self.__create_con(proxy, strong_ssl)
         self.put_con  = self.__create_con(proxy, strong_ssl)
@@ -75,12 +78,15 @@ class HTTPClient(object):
         con = pycurl.Curl()
         con.setopt(con.VERBOSE, 0)
         # Remove the Expect: 100-Continue default behavior of pycurl, because swsgiref do not
-        # manage it
-        con.setopt(pycurl.HTTPHEADER, ['Expect:', 'Keep-Alive: 300', 'Connection: Keep-Alive'])
+        # manage it. We can read the raw binary responses, so no need of json for them
+        con.setopt(pycurl.HTTPHEADER, ['Expect:', 'Keep-Alive: 300', 'Connection: Keep-Alive',
+                                       'Accept: application/octet-stream, application/json'])
         con.setopt(pycurl.USERAGENT, 'shinken:%s pycurl:%s' % (VERSION, PYCURL_VERSION))
         con.setopt(pycurl.FOLLOWLOCATION, 1)
         con.setopt(pycurl.FAILONERROR, True)
         con.setopt(pycurl.CONNECTTIMEOUT, self.timeout)
+        # No signals for the timeouts, the arbiter calls its satellites from threads
+        con.setopt(pycurl.NOSIGNAL, 1)
         con.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_1_1)
 
         if proxy:
@@ -106,64 +112,80 @@ class HTTPClient(object):
             self.put_con.setopt(pycurl.PROXY, proxy)            
 
 
-    # Try to get an URI path
-    def get(self, path, args={}, wait='short'):
-        c = self.get_con
-        c.setopt(c.POST, 0)
-        c.setopt(pycurl.HTTPGET, 1)
-
-        # For the TIMEOUT, it will depends if we are waiting for a long query or not
-        # long:data_timeout, like for huge broks receptions
-        # short:timeout, like for just "ok" connection
+    # For the TIMEOUT, it will depends if we are waiting for a long query or not
+    # long:data_timeout, like for huge broks receptions
+    # short:timeout, like for just "ok" connection
+    def __set_timeout(self, c, wait):
         if wait == 'short':
             c.setopt(c.TIMEOUT, self.timeout)
         else:
             c.setopt(c.TIMEOUT, self.data_timeout)
 
-        c.setopt(c.URL, str(self.uri + path + '?' + urllib.urlencode(args)))
-        # Ok now manage the response
-        response = StringIO()
-        c.setopt(pycurl.WRITEFUNCTION, response.write)
-        c.setopt(c.VERBOSE, 0)
+
+    # Run the query of a prepared connection, alone
+    def perform(self, c):
         try:
             c.perform()
         except pycurl.error, error:
             errno, errstr = error
             raise HTTPException('Connection error to %s : %s' % (self.uri, errstr))
-        r = c.getinfo(pycurl.HTTP_CODE)
-        # Do NOT close the connection, we want a keep alive
 
-        if r != 200:
-            err = response.getvalue()
-            logger.error("There was a critical error : %s", err)
-            raise Exception('Connection error to %s : %s' % (self.uri, r))
-        else:
-            # Manage special return of pycurl
-            ret = json.loads(response.getvalue().replace('\\/', '/'))
-            # print "GOT RAW RESULT", ret, type(ret)
-            return ret
+
+    # Prepare a get query. Returns the connection to perform, and the
+    # function to call after to get the result
+    def prepare_get(self, path, args={}, wait='short'):
+        c = self.get_con
+        c.setopt(c.POST, 0)
+        c.setopt(pycurl.HTTPGET, 1)
+        self.__set_timeout(c, wait)
+
+        c.setopt(c.URL, str(self.uri + path + '?' + urllib.urlencode(args)))
+        # Ok now manage the response
+        response = StringIO()
+        c.setopt(pycurl.WRITEFUNCTION, response.write)
+        c.setopt(c.VERBOSE, 0)
+
+        def get_result():
+            r = c.getinfo(pycurl.HTTP_CODE)
+            self.latency = c.getinfo(pycurl.TOTAL_TIME)
+            # Do NOT close the connection, we want a keep alive
+
+            if r != 200:
+                err = response.getvalue()
+                logger.error("There was a critical error : %s", err)
+                raise Exception('Connection error to %s : %s' % (self.uri, r))
+            # Binary responses are not json encoded, give them as is
+            elif (c.getinfo(pycurl.CONTENT_TYPE) or '').startswith('application/octet-stream'):
+                return response.getvalue()
+            else:
+                # Manage special return of pycurl
+                ret = json.loads(response.getvalue().replace('\\/', '/'))
+                # print "GOT RAW RESULT", ret, type(ret)
+                return ret
+
+        return c, get_result
 
 
     # Try to get an URI path
-    def post(self, path, args, wait='short'):
+    def get(self, path, args={}, wait='short'):
+        c, get_result = self.prepare_get(path, args, wait)
+        self.perform(c)
+        return get_result()
+
+
+    # Prepare a post query, like prepare_get
+    def prepare_post(self, path, args, wait='short'):
         size = 0
         # Take args, pickle them and then compress the result
         for (k, v) in args.iteritems():
-            args[k] = zlib.compress(cPickle.dumps(v), 2)
+            args[k] = zlib.compress(cPickle.dumps(v, cPickle.HIGHEST_PROTOCOL), 2)
             size += len(args[k])
         # Ok go for it!
 
         c = self.post_con
         c.setopt(pycurl.HTTPGET, 0)
         c.setopt(c.POST, 1)
-
-        # For the TIMEOUT, it will depends if we are waiting for a long query or not
-        # long:data_timeout, like for huge broks receptions
-        # short:timeout, like for just "ok" connection
-        if wait == 'short':
-            c.setopt(c.TIMEOUT, self.timeout)
-        else:
-            c.setopt(c.TIMEOUT, self.data_timeout)
+        self.__set_timeout(c, wait)
         # if proxy:
         #    c.setopt(c.PROXY, proxy)
         # Pycurl want a list of tuple as args
@@ -174,31 +196,34 @@ class HTTPClient(object):
         response = StringIO()
         c.setopt(pycurl.WRITEFUNCTION, response.write)
         c.setopt(c.VERBOSE, 0)
-        try:
-            c.perform()
-        except pycurl.error as error:
-            errno, errstr = error
-            raise HTTPException('Connection error to %s : %s' % (self.uri, errstr))
 
-        r = c.getinfo(pycurl.HTTP_CODE)
-        # Do NOT close the connection
-        # c.close()
-        if r != 200:
-            err = response.getvalue()
-            logger.error("There was a critical error : %s", err)
-            raise Exception('Connection error to %s : %s' % (self.uri, r))
-        else:
-            # Manage special return of pycurl
-            # ret  = json.loads(response.getvalue().replace('\\/', '/'))
-            ret = response.getvalue()
-            return ret
+        def get_result():
+            r = c.getinfo(pycurl.HTTP_CODE)
+            self.latency = c.getinfo(pycurl.TOTAL_TIME)
+            # Do NOT close the connection
+            # c.close()
+            if r != 200:
+                err = response.getvalue()
+                logger.error("There was a critical error : %s", err)
+                raise Exception('Connection error to %s : %s' % (self.uri, r))
+            else:
+                # Manage special return of pycurl
+                # ret  = json.loads(response.getvalue().replace('\\/', '/'))
+                ret = response.getvalue()
+                return ret
 
-        # Should return us pong string
-        return ret
+        return c, get_result
 
 
     # Try to get an URI path
-    def put(self, path, v, wait='short'):
+    def post(self, path, args, wait='short'):
+        c, get_result = self.prepare_post(path, args, wait)
+        self.perform(c)
+        return get_result()
+
+
+    # Prepare a put query, like prepare_get
+    def prepare_put(self, path, v, wait='short'):
 
         c = self.put_con
         filesize = len(v)
@@ -207,14 +232,7 @@ class HTTPClient(object):
         c.setopt(pycurl.INFILESIZE, filesize)
         c.setopt(pycurl.PUT, 1)
         c.setopt(pycurl.READFUNCTION, FileReader(f).read_callback)
-
-        # For the TIMEOUT, it will depends if we are waiting for a long query or not
-        # long:data_timeout, like for huge broks receptions
-        # short:timeout, like for just "ok" connection
-        if wait == 'short':
-            c.setopt(c.TIMEOUT, self.timeout)
-        else:
-            c.setopt(c.TIMEOUT, self.data_timeout)
+        self.__set_timeout(c, wait)
         # if proxy:
         #    c.setopt(c.PROXY, proxy)
         # Pycurl want a list of tuple as args
@@ -224,21 +242,101 @@ class HTTPClient(object):
         response = StringIO()
         c.setopt(pycurl.WRITEFUNCTION, response.write)
         # c.setopt(c.VERBOSE, 1)
-        try:
-            c.perform()
-        except pycurl.error, error:
-            errno, errstr = error
+
+        def get_result():
             f.close()
-            raise HTTPException('Connection error to %s : %s' % (self.uri, errstr))
+            r = c.getinfo(pycurl.HTTP_CODE)
+            self.latency = c.getinfo(pycurl.TOTAL_TIME)
+            # Do NOT close the connection
+            # c.close()
+            if r != 200:
+                err = response.getvalue()
+                logger.error("There was a critical error : %s", err)
+                return ''
+            else:
+                ret = response.getvalue()
+                return ret
 
-        f.close()
-        r = c.getinfo(pycurl.HTTP_CODE)
-        # Do NOT close the connection
-        # c.close()
-        if r != 200:
-            err = response.getvalue()
-            logger.error("There was a critical error : %s", err)
-            return ''
-        else:
-            ret = response.getvalue()
-            return ret
+        return c, get_result
+
+
+    # Try to get an URI path
+    def put(self, path, v, wait='short'):
+        c, get_result = self.prepare_put(path, v, wait)
+        self.perform(c)
+        return get_result()
+
+
+
+class HTTPMultiClient(object):
+    """Run queries on several HTTPClient at the same time, with a
+    pycurl CurlMulti. Each client keeps its own keep-alive connections,
+    so a client can only have one get, one post and one put by round.
+    """
+
+    def __init__(self):
+        self.multi = pycurl.CurlMulti()
+        # (client, connection, get_result, callback) of the next round
+        self.queries = []
+
+
+    # The callback is called with the result, or the exception, as soon
+    # as the query is done, without waiting for the others
+    def get(self, client, path, args={}, wait='short', callback=None):
+        c, get_result = client.prepare_get(path, args, wait)
+        self.queries.append((client, c, get_result, callback))
+
+
+    def post(self, client, path, args, wait='short', callback=None):
+        c, get_result = client.prepare_post(path, args, wait)
+        self.queries.append((client, c, get_result, callback))
+
+
+    def put(self, client, path, v, wait='short', callback=None):
+        c, get_result = client.prepare_put(path, v, wait)
+        self.queries.append((client, c, get_result, callback))
+
+
+    # Run all the queries at once, and wait for them. Returns the result
+    # of each query, or the exception it raised, in the queries order
+    def perform(self):
+        queries, self.queries = self.queries, []
+        results = [None] * len(queries)
+        running = {}
+        for (i, (client, c, get_result, callback)) in enumerate(queries):
+            self.multi.add_handle(c)
+            running[c] = i
+        try:
+            while running:
+                ret, nb_active = self.multi.perform()
+                if ret == pycurl.E_CALL_MULTI_PERFORM:
+                    continue
+                while True:
+                    nb_queued, ok_list, err_list = self.multi.info_read()
+                    for c in ok_list:
+                        self.__query_done(queries, results, running.pop(c), None)
+                    for (c, errno, errstr) in err_list:
+                        self.__query_done(queries, results, running.pop(c), errstr)
+                    if nb_queued == 0:
+                        break
+                if running:
+                    self.multi.select(1.0)
+        finally:
+            for c in running:
+                self.multi.remove_handle(c)
+        return results
+
+
+    def __query_done(self, queries, results, i, errstr):
+        client, c, get_result, callback = queries[i]
+        # The connection can be used again by the callback
+        self.multi.remove_handle(c)
+        try:
+            if errstr is not None:
+                raise HTTPException('Connection error to %s : %s' % (client.uri, errstr))
+            res = get_result()
+        except Exception, exp:
+            res = exp
+        results[i] = res
+        if callback is not None:
+            callback(res)
@@ -57,6 +57,8 @@ except ImportError:
 
 from wsgiref import simple_server
 
+from shinken.http_epoll import EpollWSGIServer, has_epoll
+
 
 # load global helper objects for logs and stats computation
 from log import logger
@@ -77,6 +79,12 @@ class PortNotFree(Exception):
     pass
 
 
+# A method can return this to send its result as a raw binary body,
+# without the json encoding (and so without the need of a base64 pass)
+class RawResponse(str):
+    pass
+
+
 
 
 
@@ -269,6 +277,44 @@ class WSGIREFBackend(object):
 
 
 
+# The epoll backend reads and writes all the connections from one loop,
+# without blocking, and calls the interfaces from a pool of threads. So
+# big transfers do not take a thread, nor stall the small queries, and the
+# connections are kept alive. Only available on Linux, and without SSL
+class EpollServer(bottle.ServerAdapter):
+    def run(self, handler):
+        return EpollWSGIServer(self.host, self.port, handler,
+                               self.options['daemon_thread_pool_size'])
+
+
+
+class EpollBackend(object):
+    def __init__(self, host, port, use_ssl, ca_cert, ssl_key,
+                 ssl_cert, hard_ssl_name_check, daemon_thread_pool_size):
+        try:
+            self.srv = bottle.run(host=host, port=port,
+                                  server=EpollServer, quiet=True,
+                                  daemon_thread_pool_size=daemon_thread_pool_size)
+        except socket.error, exp:
+            msg = "Error: Sorry, the port %d is not free: %s" % (port, str(exp))
+            raise PortNotFree(msg)
+
+
+    # The listening socket is opened now, so the daemon must keep it
+    def get_sockets(self):
+        return self.srv.get_sockets()
+
+
+    def stop(self):
+        self.srv.stop()
+
+
+    # Will run and LOCK
+    def run(self):
+        self.srv.serve_forever()
+
+
+
 class HTTPDaemon(object):
         def __init__(self, host, port, http_backend, use_ssl, ca_cert,
                      ssl_key, ssl_cert, hard_ssl_name_check, daemon_thread_pool_size):
@@ -295,7 +341,15 @@ class HTTPDaemon(object):
             __import__('BaseHTTPServer').BaseHTTPRequestHandler.address_string = \
                 lambda x: x.client_address[0]
 
-            if http_backend == 'cherrypy' or http_backend == 'auto' and cheery_wsgiserver:
+            if http_backend == 'epoll' and (use_ssl or not has_epoll):
+                logger.warning("The epoll http backend is not available %s, using the "
+                               "default one", 'with SSL' if use_ssl else 'on this system')
+                http_backend = 'auto'
+
+            if http_backend == 'epoll':
+                self.srv = EpollBackend(host, port, use_ssl, ca_cert, ssl_key,
+                                        ssl_cert, hard_ssl_name_check, daemon_thread_pool_size)
+            elif http_backend == 'cherrypy' or http_backend == 'auto' and cheery_wsgiserver:
                 self.srv = CherryPyBackend(host, port, use_ssl, ca_cert, ssl_key,
                                            ssl_cert, hard_ssl_name_check, daemon_thread_pool_size)
             else:
@@ -316,6 +370,24 @@ class HTTPDaemon(object):
             self.srv.run()
 
 
+        # Get the locks to take before calling f, from its need_lock:
+        # True means the global lock, False means none, and else it is
+        # the name (or a list of names) of the resources f touches, so it
+        # only waits for the calls and the main loop that touch them too.
+        # The lock of a resource is the <name>_lock of the interface app.
+        # The resource locks are always taken after the global one, so a
+        # method that declares resources must never take the global lock
+        def get_locks(self, obj, need_lock):
+            if need_lock is True:
+                return [self.lock]
+            if not need_lock:
+                return []
+            if isinstance(need_lock, basestring):
+                need_lock = [need_lock]
+            # Always in the same order, so two calls cannot deadlock
+            return [getattr(obj.app, '%s_lock' % name) for name in sorted(need_lock)]
+
+
         def register(self, obj):
             methods = inspect.getmembers(obj, predicate=inspect.ismethod)
             merge = [fname for (fname, f) in methods if fname in self.registered_fun_names]
@@ -351,7 +423,7 @@ class HTTPDaemon(object):
                 # WARNING : we MUST do a 2 levels function here, or the f_wrapper
                 # will be uniq and so will link to the last function again
                 # and again
-                def register_callback(fname, args, f, obj, lock):
+                def register_callback(fname, args, f, obj):
                     def f_wrapper():
                         t0 = time.time()
                         args_time = aqu_lock_time = calling_time = json_time = 0
@@ -372,6 +444,9 @@ class HTTPDaemon(object):
                                     v = SafeUnpickler.loads(v)
                             elif method == 'get':
                                 v = bottle.request.GET.get(aname, None)
+                            # Put methods got the raw body as their only argument
+                            elif method == 'put':
+                                v = bottle.request.body.read()
                             if v is None:
                                 # Maybe we got a default value?
                                 default_args = self.registered_fun_defaults.get(fname, {})
@@ -383,9 +458,11 @@ class HTTPDaemon(object):
                         t1 = time.time()
                         args_time = t1 - t0
 
-                        if need_lock:
-                            logger.debug("HTTP: calling lock for %s", fname)
-                            lock.acquire()
+                        locks = self.get_locks(obj, need_lock)
+                        if locks:
+                            logger.debug("HTTP: calling lock for %s (%s)", fname, need_lock)
+                        for l in locks:
+                            l.acquire()
 
                         t2 = time.time()
                         aqu_lock_time = t2 - t1
@@ -394,15 +471,24 @@ class HTTPDaemon(object):
                             ret = f(**d)
                         # Always call the lock release if need
                         finally:
-                            # Ok now we can release the lock
-                            if need_lock:
-                                lock.release()
+                            # Ok now we can release the locks
+                            for l in reversed(locks):
+                                l.release()
 
                         t3 = time.time()
                         calling_time = t3 - t2
 
                         encode = getattr(f, 'encode', 'json').lower()
-                        j = json.dumps(ret)
+                        # The raw methods give their string as is to the
+                        # clients that accept it, without the json pass
+                        if isinstance(ret, RawResponse) or \
+                                (encode == 'raw' and isinstance(ret, str) and
+                                 'application/octet-stream' in
+                                 bottle.request.headers.get('Accept', '')):
+                            bottle.response.content_type = 'application/octet-stream'
+                            j = ret
+                        else:
+                            j = json.dumps(ret)
                         t4 = time.time()
                         json_time = t4 - t3
 
@@ -427,7 +513,7 @@ class HTTPDaemon(object):
                     if fname_dash != fname:
                         bottle.route('/' + fname_dash, callback=f_wrapper,
                                      method=getattr(f, 'method', 'get').upper())
-                register_callback(fname, args, f, obj, self.lock)
+                register_callback(fname, args, f, obj)
 
             # Add a simple / page
             def slash():
@@ -0,0 +1,511 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#     Gabes Jean, naparuba@gmail.com
+#     Gerhard Lausser, Gerhard.Lausser@consol.de
+#     Gregory Starck, g.starck@gmail.com
+#     Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A WSGI server on an epoll event loop, for the daemons interfaces.
+
+The sockets are only read and written by the loop, without blocking, so
+a big transfer (broks, configuration) is done by pieces between the other
+ones, and does not stall the small queries like the pings. The application
+is called by a pool of threads, as it can wait for a lock or a long poll.
+The connections are kept alive (HTTP/1.1). The response of the application
+is fully read in memory before it is sent, it is not streamed.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import socket
+import threading
+import traceback
+import urllib
+import urlparse
+import Queue
+from collections import deque
+from tempfile import SpooledTemporaryFile
+
+from shinken.log import logger
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# epoll is only available on Linux
+has_epoll = hasattr(select, 'epoll') and fcntl is not None
+
+# Max size of the request line and headers
+MAX_HEAD_SIZE = 65536
+# Bigger request bodies are put on the disk
+MAX_MEMORY_BODY = 1024 * 1024
+# Size of the reads, and max size of a send
+CHUNK_SIZE = 65536
+# We send at most this to a connection before looking at the other ones
+MAX_SEND_BY_TURN = 16 * CHUNK_SIZE
+
+EPOLLIN = getattr(select, 'EPOLLIN', 1)
+EPOLLOUT = getattr(select, 'EPOLLOUT', 4)
+EPOLLERR = getattr(select, 'EPOLLERR', 8)
+EPOLLHUP = getattr(select, 'EPOLLHUP', 16)
+
+# A socket operation that would block, we will retry when epoll says so
+_retry_errnos = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+def set_non_blocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Connection(object):
+    """A client connection, and the request it is sending us"""
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.fd = sock.fileno()
+        self.closed = False
+        # What we read but did not parse yet
+        self.inbuf = ''
+        # The environ of the request once its head is parsed, and its body
+        self.environ = None
+        self.body = None
+        self.body_left = 0
+        self.keep_alive = False
+        # The request is in the hands of a worker thread
+        self.processing = False
+        # The response to send, and how much of its first chunk is sent
+        self.outbuf = deque()
+        self.out_offset = 0
+        self.last_activity = time.time()
+
+
+class EpollWSGIServer(object):
+    """Serve a WSGI application with an epoll loop for the sockets and
+    nb_threads threads for the application calls.
+    """
+
+    # The idle keep alive connections are closed after this
+    keepalive_timeout = 300
+
+    def __init__(self, host, port, app, nb_threads=8):
+        self.host = host
+        self.app = app
+        self.nb_threads = max(1, nb_threads)
+        family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen(128)
+        self.port = self.socket.getsockname()[1]
+        self.interrupted = False
+        self.conns = {}
+        # Requests for the workers, and their responses for the loop
+        self.jobs = Queue.Queue()
+        self.done = deque()
+        self.threads = []
+        self.epoll = None
+        self.wake_r = self.wake_w = None
+
+
+    # Get the listening socket, so the daemon does not close it
+    def get_sockets(self):
+        if self.socket:
+            return [self.socket]
+        return []
+
+
+    # Stop the loop, it will close all the sockets
+    def stop(self):
+        self.interrupted = True
+        self.wake_up()
+
+
+    # Make the loop look at the done responses, or at the stop
+    def wake_up(self):
+        if self.wake_w is None:
+            return
+        try:
+            os.write(self.wake_w, 'x')
+        except OSError, exp:
+            # The pipe is full, so the loop will wake up anyway. Or it
+            # was closed by a stop
+            if exp.errno not in _retry_errnos and not self.interrupted:
+                raise
+
+
+    # The epoll is created here, and not in __init__, because a daemon
+    # forks (and close its fds) after the socket creation
+    def serve_forever(self):
+        self.epoll = select.epoll()
+        self.wake_r, self.wake_w = os.pipe()
+        set_non_blocking(self.wake_r)
+        set_non_blocking(self.wake_w)
+        self.socket.setblocking(0)
+        self.epoll.register(self.socket.fileno(), EPOLLIN)
+        self.epoll.register(self.wake_r, EPOLLIN)
+        for i in xrange(self.nb_threads):
+            t = threading.Thread(None, self.work, 'http-worker-%d' % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+        logger.info('Initializing an epoll backend with %d threads', self.nb_threads)
+
+        last_idle_check = time.time()
+        try:
+            while not self.interrupted:
+                try:
+                    events = self.epoll.poll(1.0)
+                except IOError, exp:
+                    if exp.errno == errno.EINTR:
+                        continue
+                    raise
+                for (fd, ev) in events:
+                    if fd == self.wake_r:
+                        self.read_wake_up()
+                    elif self.socket and fd == self.socket.fileno():
+                        self.accept()
+                    else:
+                        self.manage_event(fd, ev)
+                self.send_done_responses()
+                now = time.time()
+                if now - last_idle_check > 1.0:
+                    self.close_idle_connections(now)
+                    last_idle_check = now
+        finally:
+            self.close_all()
+
+
+    def read_wake_up(self):
+        try:
+            while os.read(self.wake_r, 4096):
+                pass
+        except OSError, exp:
+            if exp.errno not in _retry_errnos:
+                raise
+
+
+    def accept(self):
+        while True:
+            try:
+                sock, addr = self.socket.accept()
+            except socket.error, exp:
+                if exp.errno in _retry_errnos:
+                    return
+                # Too many open files or so, we will retry at the next turn
+                logger.warning("[epoll] Cannot accept a connection: %s", exp)
+                return
+            sock.setblocking(0)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = Connection(sock, addr)
+            self.conns[conn.fd] = conn
+            self.epoll.register(conn.fd, EPOLLIN)
+
+
+    def manage_event(self, fd, ev):
+        conn = self.conns.get(fd)
+        if conn is None:
+            return
+        if ev & EPOLLIN:
+            self.read(conn)
+        if ev & EPOLLOUT and not conn.closed:
+            self.write(conn)
+        if ev & (EPOLLERR | EPOLLHUP) and not conn.closed and not ev & EPOLLIN:
+            self.close(conn)
+
+
+    def read(self, conn):
+        try:
+            data = conn.sock.recv(CHUNK_SIZE)
+        except socket.error, exp:
+            if exp.errno not in _retry_errnos:
+                self.close(conn)
+            return
+        # The client closed the connection
+        if not data:
+            self.close(conn)
+            return
+        conn.last_activity = time.time()
+        conn.inbuf += data
+        self.parse(conn)
+
+
+    # Look if we got a full request in inbuf. The body is put in its
+    # file as it comes
+    def parse(self, conn):
+        if conn.environ is None:
+            end = conn.inbuf.find('\r\n\r\n')
+            if end < 0:
+                if len(conn.inbuf) > MAX_HEAD_SIZE:
+                    self.send_error(conn, '431 Request Header Fields Too Large')
+                return
+            head, conn.inbuf = conn.inbuf[:end], conn.inbuf[end + 4:]
+            try:
+                self.parse_head(conn, head)
+            except BadRequest, exp:
+                self.send_error(conn, str(exp))
+                return
+
+        if conn.body_left:
+            data = conn.inbuf[:conn.body_left]
+            conn.inbuf = conn.inbuf[conn.body_left:]
+            conn.body.write(data)
+            conn.body_left -= len(data)
+            if conn.body_left:
+                return
+
+        # We got it all, it is for a worker now. We do not look at the
+        # socket until the response is sent (the next request waits)
+        environ = conn.environ
+        conn.body.seek(0)
+        environ['wsgi.input'] = conn.body
+        conn.environ = conn.body = None
+        conn.processing = True
+        self.epoll.modify(conn.fd, 0)
+        self.jobs.put((conn, environ))
+
+
+    def parse_head(self, conn, head):
+        lines = head.split('\r\n')
+        # Some clients send empty lines between the requests
+        while lines and not lines[0]:
+            lines.pop(0)
+        if not lines:
+            raise BadRequest('400 Bad Request')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise BadRequest('400 Bad Request')
+        if not version.startswith('HTTP/1.'):
+            raise BadRequest('505 HTTP Version Not Supported')
+        # Maybe a full uri, like for proxies
+        if '://' in target:
+            parts = urlparse.urlsplit(target)
+            target = parts.path
+            if parts.query:
+                target += '?' + parts.query
+        path, _, query = target.partition('?')
+
+        environ = {'REQUEST_METHOD': method.upper(),
+                   'SCRIPT_NAME': '',
+                   'PATH_INFO': urllib.unquote(path),
+                   'QUERY_STRING': query,
+                   'SERVER_NAME': self.host,
+                   'SERVER_PORT': str(self.port),
+                   'SERVER_PROTOCOL': version,
+                   'REMOTE_ADDR': conn.addr[0],
+                   'REMOTE_PORT': str(conn.addr[1]),
+                   'wsgi.version': (1, 0),
+                   'wsgi.url_scheme': 'http',
+                   'wsgi.errors': sys.stderr,
+                   'wsgi.multithread': True,
+                   'wsgi.multiprocess': False,
+                   'wsgi.run_once': False,
+                   }
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise BadRequest('400 Bad Request')
+            key = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            if key in environ:
+                value = environ[key] + ',' + value
+            environ[key] = value
+
+        # We want the size of the bodies, the daemons clients always give it
+        if 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+            raise BadRequest('411 Length Required')
+        try:
+            length = int(environ.get('CONTENT_LENGTH', 0) or 0)
+        except ValueError:
+            raise BadRequest('400 Bad Request')
+        if length < 0:
+            raise BadRequest('400 Bad Request')
+
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if version == 'HTTP/1.0':
+            conn.keep_alive = 'keep-alive' in connection
+        else:
+            conn.keep_alive = 'close' not in connection
+        conn.environ = environ
+        conn.body = SpooledTemporaryFile(MAX_MEMORY_BODY)
+        conn.body_left = length
+
+
+    # The workers call the application and prepare the response, the loop
+    # will send it
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            conn, environ = job
+            chunks = self.call_app(environ, conn.keep_alive)
+            environ['wsgi.input'].close()
+            self.done.append((conn, chunks))
+            self.wake_up()
+
+
+    def call_app(self, environ, keep_alive):
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            response[:] = [status, headers]
+            return body.append
+
+        body = []
+        try:
+            res = self.app(environ, start_response)
+            try:
+                for chunk in res:
+                    if chunk:
+                        body.append(chunk)
+            finally:
+                if hasattr(res, 'close'):
+                    res.close()
+            if not response:
+                raise Exception('The application did not start the response')
+        except Exception:
+            logger.error("[epoll] Error in the application for %s: %s",
+                          environ['PATH_INFO'], traceback.format_exc())
+            response = ['500 Internal Server Error', [('Content-Type', 'text/plain')]]
+            body = ['Internal Server Error']
+
+        status, headers = response
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            body = []
+        if 'content-length' not in [name.lower() for (name, value) in headers]:
+            headers = headers + [('Content-Length', str(sum(len(c) for c in body)))]
+        head = ['HTTP/1.1 %s\r\n' % status]
+        head.extend(['%s: %s\r\n' % (name, value) for (name, value) in headers])
+        head.append('Connection: %s\r\n\r\n' % ('keep-alive' if keep_alive else 'close'))
+        return [''.join(head)] + [str(c) for c in body]
+
+
+    def send_done_responses(self):
+        while self.done:
+            conn, chunks = self.done.popleft()
+            # The client went away during the call
+            if conn.closed:
+                continue
+            conn.outbuf.extend(chunks)
+            conn.out_offset = 0
+            self.write(conn)
+
+
+    # We cannot parse the request, so we answer and close the connection
+    def send_error(self, conn, status):
+        conn.keep_alive = False
+        conn.processing = True
+        conn.inbuf = ''
+        conn.outbuf.append('HTTP/1.1 %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+                           % status)
+        conn.out_offset = 0
+        self.write(conn)
+
+
+    def write(self, conn):
+        sent = 0
+        while conn.outbuf and sent < MAX_SEND_BY_TURN:
+            data = conn.outbuf[0]
+            try:
+                n = conn.sock.send(buffer(data, conn.out_offset, CHUNK_SIZE))
+            except socket.error, exp:
+                if exp.errno not in _retry_errnos:
+                    self.close(conn)
+                    return
+                break
+            sent += n
+            conn.out_offset += n
+            if conn.out_offset >= len(data):
+                conn.outbuf.popleft()
+                conn.out_offset = 0
+        conn.last_activity = time.time()
+
+        # Wait for the socket to be writable again
+        if conn.outbuf:
+            self.epoll.modify(conn.fd, EPOLLOUT)
+            return
+
+        # The response is sent, wait for the next request
+        if not conn.keep_alive:
+            self.close(conn)
+            return
+        conn.processing = False
+        self.epoll.modify(conn.fd, EPOLLIN)
+        # Maybe the client already sent it
+        if conn.inbuf:
+            self.parse(conn)
+
+
+    def close_idle_connections(self, now):
+        for conn in self.conns.values():
+            if conn.processing or conn.outbuf:
+                continue
+            if now - conn.last_activity > self.keepalive_timeout:
+                self.close(conn)
+
+
+    def close(self, conn):
+        if conn.closed:
+            return
+        conn.closed = True
+        self.conns.pop(conn.fd, None)
+        try:
+            self.epoll.unregister(conn.fd)
+        except (IOError, ValueError):
+            pass
+        try:
+            conn.sock.close()
+        except socket.error:
+            pass
+        if conn.body is not None:
+            conn.body.close()
+
+
+    def close_all(self):
+        for conn in self.conns.values():
+            self.close(conn)
+        for t in self.threads:
+            self.jobs.put(None)
+        self.threads = []
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+        self.socket = None
+        self.epoll.close()
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+        self.wake_r = self.wake_w = None
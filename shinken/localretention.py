@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#     Gabes Jean, naparuba@gmail.com
+#     Gerhard Lausser, Gerhard.Lausser@consol.de
+#     Gregory Starck, g.starck@gmail.com
+#     Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module saves the scheduler retention in local files, and only
+what changed at each save: the hosts and services that changed since the
+last save are appended to a log, and from time to time the whole
+retention is compacted in a snapshot, so the log stays small.
+
+The snapshot is written aside and renamed, and it got a generation
+number that the log repeats in its header: a log that is not of the
+snapshot generation (we died while compacting) is an old one, and is
+not read. A record that was not fully written (we died while saving)
+ends the log.
+"""
+
+import os
+import mmap
+import zlib
+import struct
+import cPickle
+
+from shinken.log import logger
+
+__all__ = ('LocalRetention', )
+
+SNAPSHOT_MAGIC = 'SHINKEN-RETENTION-SNAPSHOT-1\n'
+LOG_MAGIC = 'SHINKEN-RETENTION-LOG-1\n'
+# The generation of the snapshot and of the log
+GENERATION = struct.Struct('!Q')
+# Before each log record: its length and its crc32
+RECORD_HEADER = struct.Struct('!II')
+
+
+class LocalRetention(object):
+    """The snapshot and the log of a scheduler retention, in path and
+    path.log.
+    """
+
+    def __init__(self, path, max_log_ratio=1.0):
+        self.path = path
+        self.log_path = path + '.log'
+        # We compact when the log is bigger than this part of the snapshot
+        self.max_log_ratio = max_log_ratio
+        self.generation = 0
+        self.snapshot_size = 0
+        self.log = None
+
+
+    # Save the retention data of the scheduler: only what changed in the
+    # log, or all of it in a new snapshot when the log got too big. The
+    # first save always makes a snapshot: the items that were not in the
+    # retention (a new configuration) are saved, and the removed ones
+    # are forgotten.
+    def save(self, sched):
+        if self.log is None or self.log.tell() > self.snapshot_size * self.max_log_ratio:
+            self.compact(sched.get_changed_retention_data(full=True))
+            return
+        data = sched.get_changed_retention_data()
+        if not data['hosts'] and not data['services']:
+            return
+        payload = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+        self.log.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff))
+        self.log.write(payload)
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        logger.debug("[Local Retention] %d hosts and %d services saved in the log",
+                     len(data['hosts']), len(data['services']))
+
+
+    # Write all the data in a new snapshot, and start a new log for it
+    def compact(self, data):
+        generation = self.generation + 1
+        self.write_file(self.path, SNAPSHOT_MAGIC + GENERATION.pack(generation),
+                        cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL))
+        self.write_file(self.log_path, LOG_MAGIC + GENERATION.pack(generation), '')
+        self.generation = generation
+        self.snapshot_size = os.path.getsize(self.path)
+        if self.log is not None:
+            self.log.close()
+        self.log = open(self.log_path, 'ab')
+        logger.info("[Local Retention] %d hosts and %d services saved in the snapshot %s",
+                    len(data['hosts']), len(data['services']), self.path)
+
+
+    # Write a file aside and rename it, so we never got half of it
+    def write_file(self, path, header, payload):
+        tmp = path + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            f.write(header)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, path)
+
+
+    # Give the retention data of the snapshot with the log applied on it,
+    # or None if we do not have a snapshot
+    def load(self):
+        data = self.load_snapshot()
+        if data is None:
+            return None
+        nb_records = 0
+        for record in self.read_log():
+            data['hosts'].update(record['hosts'])
+            data['services'].update(record['services'])
+            nb_records += 1
+        logger.info("[Local Retention] %d hosts and %d services loaded from %s "
+                    "and %d log records", len(data['hosts']), len(data['services']),
+                    self.path, nb_records)
+        return data
+
+
+    # The snapshot is mapped in memory, so the unpickler reads it
+    # without a copy of the whole file
+    def load_snapshot(self):
+        if not os.path.exists(self.path):
+            return None
+        f = open(self.path, 'rb')
+        try:
+            size = os.fstat(f.fileno()).st_size
+            header_size = len(SNAPSHOT_MAGIC) + GENERATION.size
+            if size < header_size:
+                logger.error("[Local Retention] The snapshot %s is truncated", self.path)
+                return None
+            m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                if m.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                    logger.error("[Local Retention] %s is not a retention snapshot", self.path)
+                    return None
+                self.generation = GENERATION.unpack(m.read(GENERATION.size))[0]
+                data = cPickle.load(m)
+            finally:
+                m.close()
+        finally:
+            f.close()
+        self.snapshot_size = size
+        return data
+
+
+    # Give the records of the log of our snapshot, until the first
+    # one that is not complete
+    def read_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        f = open(self.log_path, 'rb')
+        try:
+            header = f.read(len(LOG_MAGIC) + GENERATION.size)
+            if not header.startswith(LOG_MAGIC) or len(header) != len(LOG_MAGIC) + GENERATION.size:
+                logger.warning("[Local Retention] %s is not a retention log, "
+                               "I do not read it", self.log_path)
+                return
+            generation = GENERATION.unpack(header[len(LOG_MAGIC):])[0]
+            if generation != self.generation:
+                logger.warning("[Local Retention] %s is an old log, I do not read it",
+                               self.log_path)
+                return
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    return
+                if len(header) == RECORD_HEADER.size:
+                    length, crc = RECORD_HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) == length and zlib.crc32(payload) & 0xffffffff == crc:
+                        yield cPickle.loads(payload)
+                        continue
+                logger.warning("[Local Retention] The end of %s is not complete, "
+                               "I skip it", self.log_path)
+                return
+        finally:
+            f.close()
@@ -27,6 +27,10 @@ import logging
 import sys
 import os
 import stat
+import atexit
+import traceback
+import threading
+import Queue
 from logging import Handler, Formatter, StreamHandler, NOTSET, FileHandler
 from logging.handlers import TimedRotatingFileHandler
 
@@ -47,13 +51,28 @@ human_timestamp_log = False
 _brokhandler_ = None
 
 
-defaultFormatter = Formatter('[%(created)i] %(levelname)s: %(message)s')
-defaultFormatter_named = Formatter('[%(created)i] %(levelname)s: [%(name)s] %(message)s')
-humanFormatter = Formatter('[%(asctime)s] %(levelname)s: %(message)s', '%a %b %d %H:%M:%S %Y')
-humanFormatter_named = Formatter('[%(asctime)s] %(levelname)s: [%(name)s] %(message)s',
-                                 '%a %b %d %H:%M:%S %Y')
 nagFormatter = Formatter('[%(created)i] %(message)s')
 
+
+class ShinkenFormatter(Formatter):
+    """
+    The monitoring log lines (the ones of naglog_result) keep the Nagios
+    format, whatever the format of the handler is.
+    """
+
+    def format(self, record):
+        if getattr(record, 'monitoring', False):
+            return nagFormatter.format(record)
+        return Formatter.format(self, record)
+
+
+defaultFormatter = ShinkenFormatter('[%(created)i] %(levelname)s: %(message)s')
+defaultFormatter_named = ShinkenFormatter('[%(created)i] %(levelname)s: [%(name)s] %(message)s')
+humanFormatter = ShinkenFormatter('[%(asctime)s] %(levelname)s: %(message)s',
+                                  '%a %b %d %H:%M:%S %Y')
+humanFormatter_named = ShinkenFormatter('[%(asctime)s] %(levelname)s: [%(name)s] %(message)s',
+                                        '%a %b %d %H:%M:%S %Y')
+
 class BrokHandler(Handler):
     """
     This log handler is forwarding log messages as broks to the broker.
@@ -76,6 +95,25 @@ class BrokHandler(Handler):
         except Exception:
             self.handleError(record)
 
+    # The log writer gives us its records by batches: all their lines
+    # go in one brok, the broker splits them back for its modules
+    def emit_batch(self, records):
+        lines = []
+        for record in records:
+            if record.levelno >= self.level and self.filter(record):
+                try:
+                    lines.append(self.format(record) + '\n')
+                except Exception:
+                    self.handleError(record)
+        if lines:
+            data = {'log': ''.join(lines)}
+            if len(lines) > 1:
+                data['lines'] = lines
+            try:
+                self._broker.add(Brok('log', data))
+            except Exception:
+                self.handleError(records[-1])
+
 
 class ColorStreamHandler(StreamHandler):
     def emit(self, record):
@@ -90,6 +128,119 @@ class ColorStreamHandler(StreamHandler):
             self.handleError(record)
 
 
+# The stream handlers flush after each record. When the log writer
+# gives them a batch, their flush does nothing, and it flushes them once
+# at the end
+def _no_flush():
+    pass
+
+
+def handle_batch(handler, records):
+    if isinstance(handler, BrokHandler):
+        handler.emit_batch(records)
+        return
+    records = [r for r in records if r.levelno >= handler.level]
+    if not records:
+        return
+    if not isinstance(handler, StreamHandler):
+        for record in records:
+            handler.handle(record)
+        return
+    handler.flush = _no_flush
+    try:
+        for record in records:
+            handler.handle(record)
+    finally:
+        del handler.flush
+        handler.flush()
+
+
+class LogWriter(threading.Thread):
+    """
+    Thread that formats and writes the records of a logger, so the ones
+    that log only put them in a queue, and do not wait for the disk or
+    for the broks creation. It takes all the records that are waiting
+    at once, and gives them by batches to the handlers.
+
+    Only the process that started it uses it: the forked workers log
+    by themselves. It holds write_lock while it writes, so a fork can
+    wait for it to be between two batches (see Log.pause_writer).
+    """
+
+    def __init__(self, logger, max_batch=1000):
+        threading.Thread.__init__(self, name='log-writer')
+        self.daemon = True
+        self.logger = logger
+        self.max_batch = max_batch
+        self.queue = Queue.Queue()
+        self.pid = os.getpid()
+        self.write_lock = threading.Lock()
+
+
+    # Called by the ones that log: the message is done now, because
+    # its arguments may change before we write it
+    def put(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = defaultFormatter.formatException(record.exc_info)
+                record.exc_info = None
+        except Exception:
+            # The handlers will say what is wrong with this record
+            pass
+        self.queue.put(record)
+
+
+    # Give the records to the handlers of the logger and of its
+    # parents, like logging.Logger.callHandlers
+    def write(self, records):
+        c = self.logger
+        while c:
+            for handler in c.handlers[:]:
+                handle_batch(handler, records)
+            if not c.propagate:
+                break
+            c = c.parent
+
+
+    def run(self):
+        stop = False
+        while not stop:
+            records = [self.queue.get()]
+            try:
+                while len(records) < self.max_batch:
+                    records.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            # None is the stop order
+            if None in records:
+                stop = True
+                records = [r for r in records if r is not None]
+            if records:
+                # A broken handler must not stop the writer, we would
+                # not write anything anymore
+                try:
+                    with self.write_lock:
+                        self.write(records)
+                except Exception:
+                    traceback.print_exc(file=sys.stderr)
+
+
+    # Write what is waiting, and stop
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+        # Some may have put records after the stop order
+        try:
+            while True:
+                record = self.queue.get_nowait()
+                if record is not None:
+                    self.write([record])
+        except Queue.Empty:
+            pass
+
+
 class Log(logging.Logger):
     """
     Shinken logger class, wrapping access to Python logging standard library.
@@ -100,6 +251,76 @@ class Log(logging.Logger):
         logging.Logger.__init__(self, name, level)
         self.pre_log_buffer = []
         self.log_set = log_set
+        # The LogWriter thread, when the logs are written asynchronously
+        self.writer = None
+        self.writer_atexit = False
+
+
+    def handle(self, record):
+        writer = self.writer
+        if writer is not None and writer.pid == os.getpid():
+            if not self.disabled and self.filter(record):
+                writer.put(record)
+            return
+        if writer is not None:
+            # We are a forked process: the writer of our father may have
+            # held some handlers locks at the fork, and nobody would ever
+            # release them here
+            self.writer = None
+            self.reset_locks()
+        logging.Logger.handle(self, record)
+
+
+    # Give new locks to the handlers of the logger and of its parents
+    def reset_locks(self):
+        c = self
+        while c:
+            for handler in c.handlers:
+                handler.createLock()
+            if not c.propagate:
+                break
+            c = c.parent
+
+
+    def pause_writer(self):
+        """ Wait for the writer to be between two batches, and keep it
+        there until resume_writer. It must be called before a fork: the
+        writer holds the handlers locks, and the ones of what they use
+        (like the broks of the daemon), when it writes, and the forked
+        process would get them locked forever. Return what must be
+        given to resume_writer.
+        """
+        writer = self.writer
+        if writer is None or writer.pid != os.getpid():
+            return None
+        writer.write_lock.acquire()
+        return writer
+
+
+    def resume_writer(self, writer):
+        if writer is not None:
+            writer.write_lock.release()
+
+
+    def set_async(self, on=True):
+        """ Write the logs in a LogWriter thread, or stop it
+        and write them again synchronously
+        """
+        if on:
+            if self.writer is not None and self.writer.pid == os.getpid():
+                return
+            writer = LogWriter(self)
+            writer.start()
+            self.writer = writer
+            # Do not lose what is waiting when we exit
+            if not self.writer_atexit:
+                atexit.register(self.set_async, False)
+                self.writer_atexit = True
+        else:
+            writer = self.writer
+            self.writer = None
+            if writer is not None and writer.pid == os.getpid():
+                writer.stop()
 
 
     def setLevel(self, level):
@@ -250,20 +471,10 @@ if hasattr(sys.stdout, 'isatty'):
 
 def naglog_result(level, result, *args):
     """
-    Function use for old Nag compatibility. We to set format properly for this call only.
-
-    Dirty Hack to keep the old format, we should have another logger and
-    use one for Shinken logs and another for monitoring data
+    Function use for old Nag compatibility. The record is tagged as a
+    monitoring one, so the formatters keep the Nagios format for it.
     """
-    prev_formatters = []
-    for handler in logger.handlers:
-        prev_formatters.append(handler.formatter)
-        handler.setFormatter(nagFormatter)
-
     log_fun = getattr(logger, level)
 
     if log_fun:
-        log_fun(result)
-
-    for index, handler in enumerate(logger.handlers):
-        handler.setFormatter(prev_formatters[index])
+        log_fun(result, extra={'monitoring': True})
@@ -32,6 +32,7 @@
 
 import re
 import time
+from collections import OrderedDict
 
 from shinken.borg import Borg
 
@@ -40,6 +41,8 @@ class MacroResolver(Borg):
     """Please Add a Docstring to describe the class here"""
 
     my_type = 'macroresolver'
+    # Max number of compiled lines we keep for the not command ones
+    templates_max_size = 10000
     # Global macros
     macros = {
         'TOTALHOSTSUP':         '_get_total_hosts_up',
@@ -101,8 +104,9 @@ class MacroResolver(Borg):
         self.lists_on_demand.append(self.contactgroups)
         self.illegal_macro_output_chars = conf.illegal_macro_output_chars
 
-        # Try cache :)
-        # self.cache = {}
+        # The compiled lines that are not from a command call, by
+        # (line, args), the last used at the end
+        self.templates = OrderedDict()
 
 
     # Return all macros of a string, so cut the $
@@ -179,11 +183,28 @@ class MacroResolver(Borg):
 
     # This function will look at elements in data (and args if it filled)
     # to replace the macros in c_line with real value.
-    def resolve_simple_macros_in_string(self, c_line, data, args=None):
+    def resolve_simple_macros_in_string(self, c_line, data, args=None, com=None):
         # Now we prepare the classes for looking at the class.macros
         data.append(self)  # For getting global MACROS
         if hasattr(self, 'conf'):
             data.append(self.conf)  # For USERN macros
+
+        # Most of the time the command line is already compiled, we
+        # just have to get the values of its macros
+        if com is not None:
+            template = self._get_command_template(com, c_line)
+        else:
+            template = self._get_template(c_line, args)
+        if template is not None:
+            res = self._render(template, data)
+            if res is not None:
+                return res
+        return self._resolve_in_loops(c_line, data, args)
+
+
+    # The old way, when we cannot use a template: we look for the macros
+    # in the whole line until there is no more
+    def _resolve_in_loops(self, c_line, data, args):
         clss = [d.__class__ for d in data]
 
         # we should do some loops for nested macros
@@ -226,22 +247,8 @@ class MacroResolver(Borg):
                     cls_type = macros[macro]['class']
                     # Beware : only cut the first _HOST value, so the macro name can have it on it..
                     macro_name = re.split('_' + cls_type, macro, 1)[1].upper()
-                    # Ok, we've got the macro like MAC_ADDRESS for _HOSTMAC_ADDRESS
-                    # Now we get the element in data that have the type HOST
-                    # and we check if it got the custom value
-                    for elt in data:
-                        if elt is not None and elt.__class__.my_type.upper() == cls_type:
-                            if '_' + macro_name in elt.customs:
-                                macros[macro]['val'] = elt.customs['_' + macro_name]
-                            # Then look on the macromodulations, in reserver order, so
-                            # the last to set, will be the firt to have. (yes, don't want to play
-                            # with break and such things sorry...)
-                            mms = getattr(elt, 'macromodulations', [])
-                            for mm in mms[::-1]:
-                                # Look if the modulation got the value,
-                                # but also if it's currently active
-                                if '_' + macro_name in mm.customs and mm.is_active():
-                                    macros[macro]['val'] = mm.customs['_' + macro_name]
+                    macros[macro]['val'] = self._resolve_custom(cls_type, macro_name, data,
+                                                                macros[macro]['val'])
                 if macros[macro]['type'] == 'ONDEMAND':
                     macros[macro]['val'] = self._resolve_ondemand(macro, data)
 
@@ -262,11 +269,150 @@ class MacroResolver(Borg):
         # print "Retuning c_line", c_line.strip()
         return c_line.strip()
 
+
+    # The args of a command call do not change, so it keeps its compiled
+    # line. None if it cannot be compiled
+    def _get_command_template(self, com, c_line):
+        compiled = getattr(com, 'compiled_line', None)
+        if compiled is not None and compiled[0] == c_line:
+            return compiled[1]
+        template = self._compile(c_line, com.args)
+        com.compiled_line = (c_line, template)
+        return template
+
+
+    # Get the compiled c_line, from our cache if we already did it. None
+    # if it cannot be compiled
+    def _get_template(self, c_line, args):
+        templates = getattr(self, 'templates', None)
+        if templates is None:
+            templates = self.templates = OrderedDict()
+        key = (c_line, args is not None and tuple(args) or None)
+        try:
+            template = templates.pop(key)
+        except KeyError:
+            template = self._compile(c_line, args)
+            # Be sure we cannot grow forever, forget the least used
+            if len(templates) >= self.templates_max_size:
+                templates.popitem(last=False)
+        templates[key] = template
+        return template
+
+
+    # Parse a c_line once in a template: a list of literal strings and
+    # macros slots (tuples) to get from the elements at each call. ARGn
+    # macros are replaced by the args, they do not change for a command
+    # call, and so are the macros of the configuration (like USERn). If
+    # they got macros, they are compiled too. Returns None if the line
+    # is not something we can compile, like a $ without its ending one
+    def _compile(self, c_line, args, depth=0):
+        parts = c_line.split('$')
+        if len(parts) % 2 == 0 or depth > 8:
+            return None
+        conf_macros = {}
+        if hasattr(self, 'conf'):
+            conf_macros = self.conf.__class__.macros
+
+        template = []
+        for (i, macro) in enumerate(parts):
+            if i % 2 == 0:
+                template.append(macro)
+                continue
+            # A $$ means we want a $, it's not a macro!
+            if macro == '':
+                template.append('$')
+                continue
+            # Static values, they can have macros too
+            if re.match('ARG\d', macro):
+                if args is None:
+                    continue
+                # ARGn that got ARGn, the loops will manage it
+                if depth > 0:
+                    return None
+                value = self._resolve_argn(macro, args)
+            elif re.match('_(HOST|SERVICE|CONTACT)\w', macro):
+                cls_type = re.match('_(HOST|SERVICE|CONTACT)', macro).group(1)
+                # Beware : only cut the first _HOST value, so the macro name can have it on it..
+                macro_name = re.split('_' + cls_type, macro, 1)[1].upper()
+                template.append(('CUSTOM', cls_type, macro_name))
+                continue
+            elif len(macro.split(':')) > 1:
+                template.append(('ONDEMAND', macro))
+                continue
+            elif macro in conf_macros:
+                value = self._get_value_from_element(self.conf, conf_macros[macro])
+            else:
+                template.append(('class', macro))
+                continue
+
+            if '$' in value:
+                sub = self._compile(value, args, depth + 1)
+                if sub is None:
+                    return None
+                template.extend(sub)
+            else:
+                template.append(value)
+        return template
+
+
+    # Get the values of the macros of the template, and join the
+    # whole. Returns None if a value got a $, so it can have other
+    # macros to resolve
+    def _render(self, template, data):
+        res = []
+        for elt in template:
+            if elt.__class__ is not tuple:
+                res.append(elt)
+                continue
+            kind = elt[0]
+            value = ''
+            if kind == 'class':
+                macro = elt[1]
+                # The last element that know this macro give it
+                for o in reversed(data):
+                    if o is not None and macro in o.__class__.macros:
+                        value = self._get_value_from_element(o, o.__class__.macros[macro])
+                        # Now check if we do not have a 'output' macro. If so, we must
+                        # delete all special characters that can be dangerous
+                        if macro in self.output_macros:
+                            value = self._delete_unwanted_caracters(value)
+                        break
+            elif kind == 'CUSTOM':
+                value = self._resolve_custom(elt[1], elt[2], data, '')
+            elif kind == 'ONDEMAND':
+                value = self._resolve_ondemand(elt[1], data)
+            if '$' in value:
+                return None
+            res.append(value)
+        return u''.join(res).strip()
+
+
+    # Get the value of the custom macro macro_name (like MAC_ADDRESS for
+    # _HOSTMAC_ADDRESS) in the element of data of the type cls_type
+    def _resolve_custom(self, cls_type, macro_name, data, value):
+        # Ok, we've got the macro like MAC_ADDRESS for _HOSTMAC_ADDRESS
+        # Now we get the element in data that have the type HOST
+        # and we check if it got the custom value
+        for elt in data:
+            if elt is not None and elt.__class__.my_type.upper() == cls_type:
+                if '_' + macro_name in elt.customs:
+                    value = elt.customs['_' + macro_name]
+                # Then look on the macromodulations, in reserver order, so
+                # the last to set, will be the firt to have. (yes, don't want to play
+                # with break and such things sorry...)
+                mms = getattr(elt, 'macromodulations', [])
+                for mm in mms[::-1]:
+                    # Look if the modulation got the value,
+                    # but also if it's currently active
+                    if '_' + macro_name in mm.customs and mm.is_active():
+                        value = mm.customs['_' + macro_name]
+        return value
+
     # Resolve a command with macro by looking at data classes.macros
     # And get macro from item properties.
     def resolve_command(self, com, data):
         c_line = com.command.command_line
-        return self.resolve_simple_macros_in_string(c_line, data, args=com.args)
+        return self.resolve_simple_macros_in_string(c_line, data, args=com.args, com=com)
 
     # For all Macros in macros, set the type by looking at the
     # MACRO name (ARGN? -> argn_type,
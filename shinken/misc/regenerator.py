@@ -855,14 +855,17 @@ class Regenerator(object):
                       'maintenance_period', 'realm', 'customs', 'escalations']
 
         # some are only use when a topology change happened
-        toplogy_change = b.data['topology_change']
+        toplogy_change = b.data.get('topology_change', False)
         if not toplogy_change:
             other_to_clean = ['childs', 'parents', 'child_dependencies', 'parent_dependencies']
             clean_prop.extend(other_to_clean)
 
-        data = b.data
+        # The brok can only got the properties that changed since the last
+        # one, so we only update and link the ones we got. The other modules
+        # can read the brok at the same time, so we clean a copy
+        data = b.data.copy()
         for prop in clean_prop:
-            del data[prop]
+            data.pop(prop, None)
 
         hname = data['host_name']
         h = self.hosts.find_by_name(hname)
@@ -872,16 +875,19 @@ class Regenerator(object):
             self.update_element(h, data)
 
             # We can have some change in our impacts and source problems.
-            self.linkify_dict_srv_and_hosts(h, 'impacts')
-            self.linkify_dict_srv_and_hosts(h, 'source_problems')
+            for prop in ('impacts', 'source_problems'):
+                if prop in data:
+                    self.linkify_dict_srv_and_hosts(h, prop)
 
             # If the topology change, update it
             if toplogy_change:
                 print "Topology change for", h.get_name(), h.parent_dependencies
-                self.linkify_host_and_hosts(h, 'parents')
-                self.linkify_host_and_hosts(h, 'childs')
-                self.linkify_dict_srv_and_hosts(h, 'parent_dependencies')
-                self.linkify_dict_srv_and_hosts(h, 'child_dependencies')
+                for prop in ('parents', 'childs'):
+                    if prop in data:
+                        self.linkify_host_and_hosts(h, prop)
+                for prop in ('parent_dependencies', 'child_dependencies'):
+                    if prop in data:
+                        self.linkify_dict_srv_and_hosts(h, prop)
 
             # Relink downtimes and comments
             for dtc in h.downtimes + h.comments:
@@ -898,14 +904,15 @@ class Regenerator(object):
                       'maintenance_period', 'customs', 'escalations']
 
         # some are only use when a topology change happened
-        toplogy_change = b.data['topology_change']
+        toplogy_change = b.data.get('topology_change', False)
         if not toplogy_change:
             other_to_clean = ['child_dependencies', 'parent_dependencies']
             clean_prop.extend(other_to_clean)
 
-        data = b.data
+        # Like for hosts, we can only got the changed properties
+        data = b.data.copy()
         for prop in clean_prop:
-            del data[prop]
+            data.pop(prop, None)
 
         hname = data['host_name']
         sdesc = data['service_description']
@@ -915,13 +922,15 @@ class Regenerator(object):
             self.update_element(s, data)
 
             # We can have some change in our impacts and source problems.
-            self.linkify_dict_srv_and_hosts(s, 'impacts')
-            self.linkify_dict_srv_and_hosts(s, 'source_problems')
+            for prop in ('impacts', 'source_problems'):
+                if prop in data:
+                    self.linkify_dict_srv_and_hosts(s, prop)
 
             # If the topology change, update it
             if toplogy_change:
-                self.linkify_dict_srv_and_hosts(s, 'parent_dependencies')
-                self.linkify_dict_srv_and_hosts(s, 'child_dependencies')
+                for prop in ('parent_dependencies', 'child_dependencies'):
+                    if prop in data:
+                        self.linkify_dict_srv_and_hosts(s, prop)
 
             # Relink downtimes and comments with the service
             for dtc in s.downtimes + s.comments:
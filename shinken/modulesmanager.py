@@ -57,12 +57,18 @@ class ModulesManager(object):
         self.to_restart = []
         self.max_queue_size = 0
         self.manager = None
+        # The shared memory ring for the broks of the external modules
+        self.brok_ring = None
 
 
     def load_manager(self, manager):
         self.manager = manager
 
 
+    def set_brok_ring(self, brok_ring):
+        self.brok_ring = brok_ring
+
+
     # Set the modules requested for this manager
     def set_modules(self, modules):
         self.modules = modules
@@ -195,7 +201,7 @@ class ModulesManager(object):
 
             # If it's an external, create/update Queues()
             if inst.is_external:
-                inst.create_queues(self.manager)
+                inst.create_queues(self.manager, self.brok_ring)
 
             inst.init()
         except Exception, e:
@@ -37,6 +37,8 @@ import itertools
 import time
 import random
 import cPickle
+import marshal
+import hashlib
 import tempfile
 from StringIO import StringIO
 from multiprocessing import Process, Manager
@@ -69,7 +71,7 @@ from hostextinfo import HostExtInfo, HostsExtInfo
 from serviceextinfo import ServiceExtInfo, ServicesExtInfo
 from trigger import Triggers
 from pack import Packs
-from shinken.util import split_semicolon
+from shinken.util import split_semicolon, compressed_dumps
 from shinken.objects.arbiterlink import ArbiterLink, ArbiterLinks
 from shinken.objects.schedulerlink import SchedulerLink, SchedulerLinks
 from shinken.objects.reactionnerlink import ReactionnerLink, ReactionnerLinks
@@ -118,12 +120,20 @@ class Config(Item):
         'modules_dir':
             StringProp(default='/var/lib/shinken/modules'),
 
+        # Where the arbiter keeps the parsed configuration files, so it only
+        # parses again the changed ones. Void means no cache
+        'config_cache_file':
+            StringProp(default=''),
+
         'use_local_log':
             BoolProp(default=True),
 
         'log_level':
             LogLevelProp(default='WARNING'),
 
+        'async_log':
+            BoolProp(default=True),
+
 
         'local_log':
             StringProp(default='/var/log/shinken/arbiterd.log'),
@@ -559,6 +569,11 @@ class Config(Item):
         'enable_problem_impacts_states_change':
             BoolProp(default=False, class_inherit=[(Host, None), (Service, None)]),
 
+        # Give the whole status in each update status brok. Unset it only if
+        # all the broker modules can manage only the changed properties
+        'full_status_broks':
+            BoolProp(default=True, class_inherit=[(Host, None), (Service, None)]),
+
         # More a running value in fact
         'resource_macros_names':
             ListProp(default=[]),
@@ -950,10 +965,64 @@ class Config(Item):
 
     def read_config_buf(self, buf):
         params = []
-        objectscfg = {}
+        objects = {}
         types = self.__class__.configuration_types
         for t in types:
-            objectscfg[t] = []
+            objects[t] = []
+
+        # Each file is parsed alone, so we can take the unchanged ones
+        # from the cache
+        cache_file = self._get_config_cache_file(buf)
+        cache = self._load_config_cache(cache_file)
+        new_cache = {}
+        nb_parsed = 0
+        for (filefrom, lines) in self._split_config_buf(buf):
+            key = u'%s:%s' % (filefrom, hashlib.sha1(u'\n'.join(lines).encode('utf8')).hexdigest())
+            part = cache.get(key)
+            if part is None:
+                part = self._parse_config_part(filefrom, lines)
+                nb_parsed += 1
+            new_cache[key] = part
+            (part_params, part_objects) = part
+            params.extend(part_params)
+            for (type, tmp) in part_objects:
+                if type not in objects:
+                    objects[type] = []
+                objects[type].append(tmp)
+
+        if cache_file:
+            logger.info("[config] %d configuration files parsed, %d taken from the cache",
+                        nb_parsed, len(new_cache) - nb_parsed)
+            if nb_parsed or len(new_cache) != len(cache):
+                self._save_config_cache(cache_file, new_cache)
+
+        # print "Params", params
+        self.load_params(params)
+        # And then update our MACRO dict
+        self.fill_resource_macros_names_macros()
+
+        return objects
+
+    # Cut the buf in the (file, lines) parts of each file
+    def _split_config_buf(self, buf):
+        filefrom = None
+        lines = []
+        for line in buf.split('\n'):
+            if line.startswith("# IMPORTEDFROM="):
+                if lines:
+                    yield (filefrom, lines)
+                filefrom = line.split('=')[1]
+                lines = []
+                continue
+            lines.append(line)
+        if lines:
+            yield (filefrom, lines)
+
+    # Parse the lines of a file: give its parameters lines and its
+    # objects, as (type, {prop: [values]})
+    def _parse_config_part(self, filefrom, lines):
+        params = []
+        objectscfg = []
 
         tmp = []
         tmp_type = 'void'
@@ -961,14 +1030,8 @@ class Config(Item):
         almost_in_define = False
         continuation_line = False
         tmp_line = ''
-        lines = buf.split('\n')
         line_nb = 0  # Keep the line number for the file path
         for line in lines:
-            if line.startswith("# IMPORTEDFROM="):
-                filefrom = line.split('=')[1]
-                line_nb = 0  # reset the line number too
-                continue
-
             line_nb += 1
             # Remove comments
             line = split_semicolon(line)[0].strip()
@@ -1006,9 +1069,7 @@ class Config(Item):
                 else:
                     almost_in_define = True
 
-                if tmp_type not in objectscfg:
-                    objectscfg[tmp_type] = []
-                objectscfg[tmp_type].append(tmp)
+                objectscfg.append((tmp_type, tmp))
                 tmp = []
                 tmp.append("imported_from " + filefrom + ':%d' % line_nb)
                 # Get new type
@@ -1023,36 +1084,57 @@ class Config(Item):
                 else:
                     params.append(line)
 
-        # Maybe the type of the last element is unknown, declare it
-        if tmp_type not in objectscfg:
-            objectscfg[tmp_type] = []
-
-
-        objectscfg[tmp_type].append(tmp)
-        objects = {}
-
-        # print "Params", params
-        self.load_params(params)
-        # And then update our MACRO dict
-        self.fill_resource_macros_names_macros()
-
-        for type in objectscfg:
-            objects[type] = []
-            for items in objectscfg[type]:
-                tmp = {}
-                for line in items:
-                    elts = self._cut_line(line)
-                    if elts == []:
-                        continue
-                    prop = elts[0]
-                    if prop not in tmp:
-                        tmp[prop] = []
-                    value = ' '.join(elts[1:])
-                    tmp[prop].append(value)
-                if tmp != {}:
-                    objects[type].append(tmp)
-
-        return objects
+        objectscfg.append((tmp_type, tmp))
+
+        objects = []
+        for (type, items) in objectscfg:
+            tmp = {}
+            for line in items:
+                elts = self._cut_line(line)
+                if elts == []:
+                    continue
+                prop = elts[0]
+                if prop not in tmp:
+                    tmp[prop] = []
+                value = ' '.join(elts[1:])
+                tmp[prop].append(value)
+            if tmp != {}:
+                objects.append((type, tmp))
+        return (params, objects)
+
+    # The cache file can be set in any of the files, we need it before
+    # parsing them. The last one wins, like for all parameters
+    def _get_config_cache_file(self, buf):
+        values = re.findall(r'^[ \t]*config_cache_file=(.*)$', buf, re.M)
+        if not values:
+            return ''
+        return split_semicolon(values[-1])[0].strip()
+
+    # The cache is {'file:content hash': (params, objects)}, saved with marshal
+    # as it's fast to load and only got basic types
+    def _load_config_cache(self, cache_file):
+        if not cache_file or not os.path.exists(cache_file):
+            return {}
+        try:
+            with open(cache_file, 'rb') as f:
+                (version, cache) = marshal.load(f)
+            if version == 1 and isinstance(cache, dict):
+                return cache
+        except Exception, exp:
+            logger.warning("[config] Cannot load the configuration cache %s: %s",
+                           cache_file, exp)
+        return {}
+
+    def _save_config_cache(self, cache_file, cache):
+        # Write it aside, so a crash do not let a bad file
+        tmp_file = cache_file + '.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                marshal.dump((1, cache), f)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError, ValueError), exp:
+            logger.warning("[config] Cannot save the configuration cache %s: %s",
+                           cache_file, exp)
 
     # We need to have some ghost objects like
     # the check_command bp_rule for business
@@ -1300,7 +1382,7 @@ class Config(Item):
                     conf.hostgroups.prepare_for_sending()
                     logger.debug('[%s] Serializing the configuration %d', r.get_name(), i)
                     t0 = time.time()
-                    r.serialized_confs[i] = cPickle.dumps(conf, 0)  # cPickle.HIGHEST_PROTOCOL)
+                    r.serialized_confs[i] = compressed_dumps(conf)
                     logger.debug("[config] time to serialize the conf %s:%s is %s (size:%s)",
                                  r.get_name(), i, time.time() - t0, len(r.serialized_confs[i]))
                     logger.debug("PICKLE LEN : %d", len(r.serialized_confs[i]))
@@ -1330,7 +1412,7 @@ class Config(Item):
                         conf.hostgroups.prepare_for_sending()
                         logger.debug('[%s] Serializing the configuration %d', rname, i)
                         t0 = time.time()
-                        res = cPickle.dumps(conf, cPickle.HIGHEST_PROTOCOL)
+                        res = compressed_dumps(conf)
                         logger.debug("[config] time to serialize the conf %s:%s is %s (size:%s)",
                                      rname, i, time.time() - t0, len(res))
                         q.append((i, res))
@@ -1666,6 +1748,10 @@ class Config(Item):
     def create_business_rules(self):
         self.hosts.create_business_rules(self.hosts, self.services)
         self.services.create_business_rules(self.hosts, self.services)
+        # The lookup indexes are not useful anymore here, and
+        # should not be sent to the schedulers
+        self.hosts.clean_filter_indexes()
+        self.services.clean_filter_indexes()
 
 
     # Will fill dep list for business rules
@@ -2017,8 +2103,36 @@ class Config(Item):
 
     # We will compute simple element md5hash, so we can know
     # if they changed or not between the restart
+    # We compute the hash of all items, and the global one of the
+    # configuration, from them and the parameters. Everything
+    # else than the hosts and the services is in all the parts
     def compute_hash(self):
-        self.hosts.compute_hash()
+        m = hashlib.md5()
+        types_creations = self.__class__.types_creations
+        props = [types_creations[t][2] for t in sorted(types_creations)]
+        props.append('triggers')
+        for prop in props:
+            items = getattr(self, prop, None)
+            if items is None:
+                continue
+            items.compute_hash()
+            if prop not in ('hosts', 'services'):
+                for h in sorted(i.hash for i in items):
+                    m.update(h)
+        params = [(k, v) for (k, v) in self.__dict__.iteritems()
+                  if k in self.properties or k.startswith('$')]
+        m.update(cPickle.dumps(sorted(params), 0))
+        self.hash = m.digest()
+
+
+    # The hash of a configuration part: it changes only if the global
+    # hash or one of its hosts or services changes
+    def get_part_hash(self, cfg):
+        m = hashlib.md5(self.hash)
+        for h in sorted(e.hash for e in itertools.chain(cfg.hosts, cfg.services)):
+            m.update(h)
+        m.update(cPickle.dumps(sorted(cfg.other_elements.iteritems()), 0))
+        return m.hexdigest()
 
 
     # Add an error in the configuration error list so we can print them
@@ -2105,6 +2219,9 @@ class Config(Item):
         # Access_list from a node il all nodes that are connected
         # with it: it's a list of ours mini_packs
         tmp_packs = g.get_accessibility_packs()
+        # The graph gives them in a random order, sort them so the same
+        # hosts go in the same parts at each run
+        tmp_packs.sort(key=lambda pack: min(h.get_name() for h in pack))
 
         # Now We find the default realm
         default_realm = None
@@ -2391,6 +2508,9 @@ class Config(Item):
         # We tag conf with instance_id
         for i in self.confs:
             self.confs[i].instance_id = i
+            # The dispatcher knows if a scheduler already runs this part
+            # from this hash
+            self.confs[i].conf_hash = self.get_part_hash(self.confs[i])
             random.seed(time.time())
 
 
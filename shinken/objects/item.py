@@ -253,16 +253,15 @@ Like temporary attributes such as "imported_from", etc.. """
     # Compute a hash of this element values. Should be launched
     # When we got all our values, but not linked with other objects
     def compute_hash(self):
-        # ID will always changed between runs, so we remove it
-        # for hash compute
-        i = self.id
-        del self.id
+        # ID and running properties will always changed between runs,
+        # so we only take the properties and the custom variables
+        cls = self.__class__
+        values = [(prop, getattr(self, prop)) for prop in sorted(cls.properties)
+                  if hasattr(self, prop)]
         m = md5()
-        tmp = cPickle.dumps(self, cPickle.HIGHEST_PROTOCOL)
-        m.update(tmp)
+        customs = sorted(getattr(self, 'customs', {}).iteritems())
+        m.update(cPickle.dumps((values, customs), 0))
         self.hash = m.digest()
-        # and put again our id
-        self.id = i
 
     def get_templates(self):
         use = getattr(self, 'use', '')
@@ -273,7 +272,9 @@ Like temporary attributes such as "imported_from", etc.. """
 
 
     # We fillfull properties with template ones if need
-    def get_property_by_inheritance(self, prop, deep_level):
+    # resolved is the {template id: value} of the templates already
+    # resolved for this prop, they are not walked again
+    def get_property_by_inheritance(self, prop, deep_level, resolved=None):
         if prop == 'register':
             return None  # We do not inherit from register
 
@@ -301,7 +302,10 @@ Like temporary attributes such as "imported_from", etc.. """
         # We reverse list, so that when looking for properties by inheritance,
         # the least defined template wins (if property is set).
         for i in self.templates:
-            value = i.get_property_by_inheritance(prop, deep_level + 1)
+            if resolved is not None and i.id in resolved:
+                value = resolved[i.id]
+            else:
+                value = i.get_property_by_inheritance(prop, deep_level + 1, resolved)
 
             if value is not None and value != []:
                 # If our template give us a '+' value, we should continue to loop
@@ -373,7 +377,9 @@ Like temporary attributes such as "imported_from", etc.. """
 
 
     # We fillfull properties with template ones if need
-    def get_customs_properties_by_inheritance(self, deep_level):
+    # resolved is the set of the templates ids with already resolved
+    # customs, they are not walked again
+    def get_customs_properties_by_inheritance(self, deep_level, resolved=None):
         # protect against infinite recursive loop
         if deep_level > INHERITANCE_DEEP_LIMIT:
             return self.customs
@@ -381,7 +387,10 @@ Like temporary attributes such as "imported_from", etc.. """
         # We reverse list, so that when looking for properties by inheritance,
         # the least defined template wins (if property is set).
         for i in self.templates:
-            tpl_cv = i.get_customs_properties_by_inheritance(deep_level + 1)
+            if resolved is not None and i.id in resolved:
+                tpl_cv = i.customs
+            else:
+                tpl_cv = i.get_customs_properties_by_inheritance(deep_level + 1, resolved)
             if tpl_cv is not {}:
                 for prop in tpl_cv:
                     if prop not in self.customs:
@@ -407,11 +416,7 @@ Like temporary attributes such as "imported_from", etc.. """
 
 
     def has_plus(self, prop):
-        try:
-            self.plus[prop]
-        except KeyError:
-            return False
-        return True
+        return prop in self.plus
 
 
     def get_all_plus_and_delete(self):
@@ -481,6 +486,7 @@ Like temporary attributes such as "imported_from", etc.. """
 
     def add_downtime(self, downtime):
         self.downtimes.append(downtime)
+        self.retention_dirty = True
 
     def del_downtime(self, downtime_id):
         d_to_del = None
@@ -490,9 +496,11 @@ Like temporary attributes such as "imported_from", etc.. """
                 dt.can_be_deleted = True
         if d_to_del is not None:
             self.downtimes.remove(d_to_del)
+            self.retention_dirty = True
 
     def add_comment(self, comment):
         self.comments.append(comment)
+        self.retention_dirty = True
 
     def del_comment(self, comment_id):
         c_to_del = None
@@ -502,6 +510,7 @@ Like temporary attributes such as "imported_from", etc.. """
                 c.can_be_deleted = True
         if c_to_del is not None:
             self.comments.remove(c_to_del)
+            self.retention_dirty = True
 
     def acknowledge_problem(self, sticky, notify, persistent, author, comment, end_time=0):
         if self.state != self.ok_up:
@@ -730,6 +739,9 @@ class Items(object):
         self.name_to_template = {}
         self.configuration_warnings = []
         self.configuration_errors = []
+        # Secondary indexes for find_by_filter, built on first use
+        self.filter_indexes = None
+        self.filter_ranks = None
         self.add_items(items, index_items)
 
     def get_source(self, item):
@@ -872,6 +884,7 @@ class Items(object):
         if index is True and name_property:
             item = self.index_item(item)
         self.items[item.id] = item
+        self.clean_filter_indexes()
 
 
     def remove_item(self, item):
@@ -882,6 +895,7 @@ class Items(object):
         """
         self.unindex_item(item)
         self.items.pop(item.id, None)
+        self.clean_filter_indexes()
 
 
     def index_item(self, item):
@@ -940,12 +954,14 @@ class Items(object):
         try:
             self.unindex_item(self.items[key])
             del self.items[key]
+            self.clean_filter_indexes()
         except KeyError:  # we don't want it, we do not have it. All is perfect
             pass
 
 
     def __setitem__(self, key, value):
         self.items[key] = value
+        self.clean_filter_indexes()
         name_property = getattr(self.__class__, "name_property", None)
         if name_property:
             self.index_item(value)
@@ -972,9 +988,26 @@ class Items(object):
     # the item instances and should return a boolean value indicating if it
     # matched the filter.
     # Returns a list of items matching all filters.
+    # The filters with an index attribute are first resolved with the
+    # secondary indexes, so only the candidates are checked.
     def find_by_filter(self, filters):
+        candidates = None
+        for f in filters:
+            ids = self.get_filter_candidates(f)
+            if ids is None:
+                continue
+            if candidates is None:
+                candidates = ids
+            else:
+                candidates &= ids
+        if candidates is None:
+            elts = self
+        else:
+            # Keep the same order than a full scan
+            ranks = self.filter_ranks
+            elts = [self.items[iid] for iid in sorted(candidates, key=ranks.__getitem__)]
         items = []
-        for i in self:
+        for i in elts:
             failed = False
             for f in filters:
                 if not f(i):
@@ -985,6 +1018,45 @@ class Items(object):
         return items
 
 
+    # Ids of the items that may match the filter, or None if the
+    # filter cannot be resolved by an index
+    def get_filter_candidates(self, f):
+        index = getattr(f, 'index', None)
+        if index is not None:
+            index_fn, key = index
+            return set(self.get_filter_index(index_fn).get(key, ()))
+        index = getattr(f, 'index_regex', None)
+        if index is not None:
+            index_fn, regex = index
+            ids = set()
+            for key, iids in self.get_filter_index(index_fn).iteritems():
+                if regex.match(key) is not None:
+                    ids.update(iids)
+            return ids
+        return None
+
+
+    # Get the {key: [item ids]} index of index_fn, and build it if need
+    def get_filter_index(self, index_fn):
+        indexes = getattr(self, 'filter_indexes', None)
+        if indexes is None:
+            indexes = self.filter_indexes = {}
+            self.filter_ranks = dict((i.id, rank) for (rank, i) in enumerate(self))
+        index = indexes.get(index_fn)
+        if index is None:
+            index = indexes[index_fn] = {}
+            for i in self:
+                for key in index_fn(i):
+                    index.setdefault(key, []).append(i.id)
+        return index
+
+
+    # The indexes are built again on the next find_by_filter
+    def clean_filter_indexes(self):
+        self.filter_indexes = None
+        self.filter_ranks = None
+
+
     # prepare_for_conf_sending to flatten some properties
     def prepare_for_sending(self):
         for i in self:
@@ -1130,17 +1202,98 @@ class Items(object):
         return s
 
 
+    # Give the templates ordered parents first, so each template can be
+    # resolved once from the already resolved values of its own templates.
+    # None if the templates graph got a loop or is too deep, the recursive
+    # inheritance will manage (and report) it
+    def get_templates_linearization(self):
+        heights = {}
+        order = []
+        for tpl in self.templates.itervalues():
+            if self.linearize_template(tpl, heights, order, set()) is None:
+                return None
+        return order
+
+
+    # Add tpl after its templates in order and give its height, so the
+    # length of the longest chain of templates above it
+    def linearize_template(self, tpl, heights, order, path):
+        if tpl.id in heights:
+            return heights[tpl.id]
+        if tpl.id in path:
+            return None
+        path.add(tpl.id)
+        height = 0
+        for t in getattr(tpl, 'templates', []):
+            h = self.linearize_template(t, heights, order, path)
+            if h is None:
+                return None
+            height = max(height, h + 1)
+        path.discard(tpl.id)
+        # Beyond this, the recursive inheritance stops looking, keep it
+        # for the same result
+        if height >= INHERITANCE_DEEP_LIMIT:
+            return None
+        heights[tpl.id] = height
+        order.append(tpl)
+        return height
+
+
+    # If a "null" attribute was inherited, delete it
+    def remove_null_property(self, i, prop):
+        try:
+            if getattr(i, prop) == 'null':
+                delattr(i, prop)
+        except AttributeError:
+            pass
+
+
+    # Inherit prop in items. The templates are resolved before, parents
+    # first, so each template is resolved only once and its sons just
+    # read its value. tpls is the templates linearization, if already
+    # computed
+    def inherit_property(self, items, prop, tpls=None):
+        if tpls is None:
+            tpls = self.get_templates_linearization()
+        resolved = None
+        if tpls is not None:
+            resolved = {}
+            for t in tpls:
+                t.get_property_by_inheritance(prop, 0, resolved)
+                resolved[t.id] = getattr(t, prop, None)
+
+        for i in items:
+            i.get_property_by_inheritance(prop, 0, resolved)
+            self.remove_null_property(i, prop)
+        # The sons must see the "null" values of the templates, so they
+        # are removed only now
+        for t in self.templates.itervalues():
+            if resolved is None:
+                t.get_property_by_inheritance(prop, 0)
+            self.remove_null_property(t, prop)
+
+
+    # Same for the custom variables
+    def inherit_customs(self, items, tpls=None):
+        if tpls is None:
+            tpls = self.get_templates_linearization()
+        resolved = None
+        if tpls is not None:
+            resolved = set()
+            for t in tpls:
+                t.get_customs_properties_by_inheritance(0, resolved)
+                resolved.add(t.id)
+
+        for i in items:
+            i.get_customs_properties_by_inheritance(0, resolved)
+        if resolved is None:
+            for t in self.templates.itervalues():
+                t.get_customs_properties_by_inheritance(0)
+
+
     # Inheritance for just a property
-    def apply_partial_inheritance(self, prop):
-        for i in itertools.chain(self.items.itervalues(),
-                                 self.templates.itervalues()):
-            i.get_property_by_inheritance(prop, 0)
-            # If a "null" attribute was inherited, delete it
-            try:
-                if getattr(i, prop) == 'null':
-                    delattr(i, prop)
-            except AttributeError:
-                pass
+    def apply_partial_inheritance(self, prop, tpls=None):
+        self.inherit_property(self.items.itervalues(), prop, tpls)
 
 
     def apply_inheritance(self):
@@ -1149,12 +1302,12 @@ class Items(object):
         """
         # We check for all Class properties if the host has it
         # if not, it check all host templates for a value
+        # The templates graph is linearized only once for all of them
         cls = self.inner_class
+        tpls = self.get_templates_linearization()
         for prop in cls.properties:
-            self.apply_partial_inheritance(prop)
-        for i in itertools.chain(self.items.itervalues(),
-                                 self.templates.itervalues()):
-            i.get_customs_properties_by_inheritance(0)
+            self.apply_partial_inheritance(prop, tpls)
+        self.inherit_customs(self.items.itervalues(), tpls)
 
 
     # We've got a contacts property with , separated contacts names
@@ -42,6 +42,7 @@ class PollerLink(SatelliteLink):
         'min_workers':  IntegerProp(default=0, fill_brok=['full_status'], to_send=True),
         'max_workers':  IntegerProp(default=30, fill_brok=['full_status'], to_send=True),
         'processes_by_worker': IntegerProp(default=256, fill_brok=['full_status'], to_send=True),
+        'spawn_method': StringProp(default='popen', fill_brok=['full_status'], to_send=True),
         'poller_tags':  ListProp(default=['None'], to_send=True),
     })
 
@@ -190,8 +190,7 @@ class SatelliteLink(Item):
     def update_infos(self):
         # First look if it's not too early to ping
         now = time.time()
-        since_last_check = now - self.last_check
-        if since_last_check < self.check_interval:
+        if not self.need_update_infos(now):
             return
 
         self.last_check = now
@@ -205,6 +204,11 @@ class SatelliteLink(Item):
         self.broks.append(b)
 
 
+    # Is it time to ping the satellite again?
+    def need_update_infos(self, now):
+        return now - self.last_check >= self.check_interval
+
+
     # The elements just got a new conf_id, we put it in our list
     # because maybe the satellite is too busy to answer now
     def known_conf_managed_push(self, cfg_id, push_flavor):
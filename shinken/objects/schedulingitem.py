@@ -43,10 +43,16 @@ from shinken.macroresolver import MacroResolver
 from shinken.eventhandler import EventHandler
 from shinken.dependencynode import DependencyNodeFactory
 from shinken.log import logger
+from shinken.brok import Brok
 
 # on system time change just reevaluate the following attributes:
 on_time_change_update = ('last_notification', 'last_state_change', 'last_hard_state_change')
 
+# Values that can be compared with the ones of the last status brok. Other
+# ones can be changed in place, so they are compared only if they are new
+# objects (like the lists of names done by the brok_transformation)
+immutable_brok_values = (str, unicode, int, long, float, bool, type(None))
+
 
 class SchedulingItem(Item):
 
@@ -54,6 +60,13 @@ class SchedulingItem(Item):
     current_event_id = 0
     current_problem_id = 0
 
+    # Give the whole status in update status broks, and not only the
+    # properties changed since the last one (global full_status_broks value)
+    full_status_broks = True
+    # The properties that are always in the update status broks so the
+    # brokers can find the element
+    status_brok_keys = ('id', 'host_name', 'service_description', 'topology_change')
+
     # Call by pickle to data-ify the host
     # we do a dict because list are too dangerous for
     # retention save and co :( even if it's more
@@ -82,6 +95,39 @@ class SchedulingItem(Item):
             if prop in state:
                 setattr(self, prop, state[prop])
 
+    # Get a brok with update item status. If the full_status_broks
+    # is unset, the brok only got the properties that changed since the
+    # last one we raised, the brokers patch their element with it.
+    # Our status changed, so the retention must save us again too
+    def get_update_status_brok(self):
+        self.retention_dirty = True
+        data = {'id': self.id}
+        self.fill_data_brok_from(data, 'full_status')
+        if self.__class__.full_status_broks:
+            return Brok('update_' + self.my_type + '_status', data)
+        last = getattr(self, 'last_status_brok_data', None)
+        self.last_status_brok_data = data
+        if last is None:
+            return Brok('update_' + self.my_type + '_status', data)
+
+        delta = {}
+        for prop, value in data.iteritems():
+            if prop in last:
+                old = last[prop]
+                if old == value and (old is not value or type(value) in immutable_brok_values):
+                    continue
+            delta[prop] = value
+        for prop in self.status_brok_keys:
+            if prop in data:
+                delta[prop] = data[prop]
+        return Brok('update_' + self.my_type + '_status', delta)
+
+
+    # The brokers may not have our last status brok (a new broker, or
+    # dropped broks), so the next one will give the whole status
+    def reset_status_brok_data(self):
+        self.last_status_brok_data = None
+
     # Register the son in my child_dependencies, and
     # myself in its parent_dependencies
     def register_son_in_parent_child_dependencies(self, son):
@@ -507,6 +553,9 @@ class SchedulingItem(Item):
         if (not self.active_checks_enabled or not cls.execute_checks) and not force:
             return None
 
+        # Our next_chk will change, the retention must save it
+        self.retention_dirty = True
+
         now = time.time()
 
         # If check_interval is 0, we should not add it for a service
@@ -624,6 +673,7 @@ class SchedulingItem(Item):
         if n.id in self.notifications_in_progress:
             n.status = 'zombie'
             del self.notifications_in_progress[n.id]
+            self.retention_dirty = True
 
 
     # We do not need ours currents pending notifications,
@@ -767,6 +817,8 @@ class SchedulingItem(Item):
     # is_volatile: notif immediately (service only)
     def consume_result(self, c):
         OK_UP = self.__class__.ok_up  # OK for service, UP for host
+        # Our state will change, the retention must save us again
+        self.retention_dirty = True
 
         # Protect against bad type output
         # if str, go in unicode
@@ -1278,6 +1330,7 @@ class SchedulingItem(Item):
 
         # Keep a trace in our notifications queue
         self.notifications_in_progress[n.id] = n
+        self.retention_dirty = True
         # and put it in the temp queue for scheduler
         self.actions.append(n)
 
@@ -1315,6 +1315,7 @@ class Services(Items):
         if index is True:
             item = self.index_item(item)
         self.items[item.id] = item
+        self.clean_filter_indexes()
 
     def add_partial_service(self, item, index=True, var_tuple=None):
         if var_tuple is None:
@@ -1346,17 +1347,10 @@ class Services(Items):
         self.partial_services[item.id] = item
 
     # Inheritance for just a property
-    def apply_partial_inheritance(self, prop):
-        for i in itertools.chain(self.items.itervalues(),
-                                 self.partial_services.itervalues(),
-                                 self.templates.itervalues()):
-            i.get_property_by_inheritance(prop, 0)
-            # If a "null" attribute was inherited, delete it
-            try:
-                if getattr(i, prop) == 'null':
-                    delattr(i, prop)
-            except AttributeError:
-                pass
+    def apply_partial_inheritance(self, prop, tpls=None):
+        self.inherit_property(itertools.chain(self.items.itervalues(),
+                                              self.partial_services.itervalues()),
+                              prop, tpls)
 
     def apply_inheritance(self):
         """ For all items and templates inherite properties and custom
@@ -1365,12 +1359,12 @@ class Services(Items):
         # We check for all Class properties if the host has it
         # if not, it check all host templates for a value
         cls = self.inner_class
+        tpls = self.get_templates_linearization()
         for prop in cls.properties:
-            self.apply_partial_inheritance(prop)
-        for i in itertools.chain(self.items.itervalues(),
-                                 self.partial_services.itervalues(),
-                                 self.templates.itervalues()):
-            i.get_customs_properties_by_inheritance(0)
+            self.apply_partial_inheritance(prop, tpls)
+        self.inherit_customs(itertools.chain(self.items.itervalues(),
+                                             self.partial_services.itervalues()),
+                             tpls)
 
         for i in self.partial_services.itervalues():
             self.add_item(i, True, True)
@@ -1562,6 +1556,7 @@ class Services(Items):
                 to_del.append(s.id)
         for sid in to_del:
             del self.items[sid]
+        self.clean_filter_indexes()
 
 
     def explode_services_from_hosts(self, hosts, s, hnames):
@@ -87,6 +87,7 @@
 
 import time
 import re
+from bisect import bisect_right
 
 from item import Item, Items
 
@@ -117,6 +118,11 @@ class Timeperiod(Item):
     })
     running_properties = Item.running_properties.copy()
 
+    # The valid intervals are computed for this time after the asked one
+    intervals_horizon = 86400
+    # and kept for this time in the past, for the queries a bit late
+    intervals_behind = 3600
+
     def __init__(self, params={}):
         self.id = Timeperiod.id
         Timeperiod.id = Timeperiod.id + 1
@@ -144,8 +150,10 @@ class Timeperiod(Item):
             else:
                 self.unresolved.append(key + ' ' + params[key])
 
-        self.cache = {}  # For tunning purpose only
-        self.invalid_cache = {}  # same but for invalid search
+        # The valid [start, end) intervals, sorted, from the time
+        # intervals_from to intervals_until, and the next valid time after
+        # the last one
+        self.reset_intervals()
         self.configuration_errors = []
         self.configuration_warnings = []
         # By default the tp is None so we know we just start
@@ -181,6 +189,11 @@ class Timeperiod(Item):
 
 
     def is_time_valid(self, t):
+        # Maybe we already know it
+        if self.intervals_from is not None and self.intervals_from <= t < self.intervals_until:
+            i = bisect_right(self.intervals_starts, t) - 1
+            return i >= 0 and t < self.intervals_ends[i]
+
         if self.has('exclude'):
             for dr in self.exclude:
                 if dr.is_time_valid(t):
@@ -201,17 +214,66 @@ class Timeperiod(Item):
     def get_not_in_min_from_t(self, f):
         pass
 
-    def find_next_valid_time_from_cache(self, t):
-        try:
-            return self.cache[t]
-        except KeyError:
-            return None
-
-    def find_next_invalid_time_from_cache(self, t):
-        try:
-            return self.invalid_cache[t]
-        except KeyError:
+    # Forget the computed intervals
+    def reset_intervals(self):
+        self.intervals_from = None
+        self.intervals_until = None
+        self.intervals_starts = []
+        self.intervals_ends = []
+        self.valid_after = None
+        self.intervals_clipped = False
+        self.clipped_end = None
+
+    # Compute the valid intervals from t - intervals_behind to
+    # t + intervals_horizon. Then we only have to look in them with a bisect
+    # for the times in this window, instead of looking at all the dateranges
+    # and excludes each time. An interval that is still valid at the end of
+    # the window is clipped there: we look for its real end (a year away
+    # for a 24x7) only if we are asked for it
+    def compute_intervals(self, t):
+        t = int(t)
+        until = t + self.intervals_horizon
+        t -= self.intervals_behind
+        starts = []
+        ends = []
+        valid_after = None
+        clipped = False
+        start = t
+        while True:
+            valid = self.find_next_valid_time_from_t(start)
+            if valid is None or valid >= until:
+                valid_after = valid
+                break
+            invalid = self.find_next_invalid_time_from_t(valid, until)
+            # Should not happen, but we do not want to loop forever
+            if invalid is None or invalid <= valid:
+                start = valid + 1
+                continue
+            starts.append(valid)
+            if invalid >= until:
+                ends.append(until)
+                clipped = True
+                break
+            ends.append(invalid)
+            start = invalid
+
+        self.intervals_starts = starts
+        self.intervals_ends = ends
+        self.valid_after = valid_after
+        self.intervals_clipped = clipped
+        # The (real end,) of the clipped interval, when we looked for it
+        self.clipped_end = None
+        self.intervals_from = t
+        self.intervals_until = until
+
+    # Give the index of the interval that is before or on t, and compute the
+    # intervals if t is after them. None if we do not manage t (in the past)
+    def get_interval_index(self, t):
+        if self.intervals_from is None or t >= self.intervals_until:
+            self.compute_intervals(t)
+        if t < self.intervals_from:
             return None
+        return bisect_right(self.intervals_starts, t) - 1
 
     # will look for active/un-active change. And log it
     # [1327392000] TIMEPERIOD TRANSITION: <name>;<from>;<to>
@@ -241,39 +303,63 @@ class Timeperiod(Item):
                 % (self.get_name(), _from, _to)
             )
 
-    # clean the get_next_valid_time_from_t cache
-    # The entries are a dict on t. t < now are useless
-    # Because we do not care about past anymore.
-    # If not, it's not important, it's just a cache after all :)
+    # clean the intervals that are in the past
+    # Because we do not care about past anymore (but the last
+    # intervals_behind seconds).
     def clean_cache(self):
+        if self.intervals_from is None:
+            return
         now = int(time.time())
-        t_to_del = []
-        for t in self.cache:
-            if t < now:
-                t_to_del.append(t)
-        for t in t_to_del:
-            del self.cache[t]
-
-        # same for the invalid cache
-        t_to_del = []
-        for t in self.invalid_cache:
-            if t < now:
-                t_to_del.append(t)
-        for t in t_to_del:
-            del self.invalid_cache[t]
-
+        if now >= self.intervals_until:
+            self.reset_intervals()
+            return
+        oldest = now - self.intervals_behind
+        i = 0
+        while i < len(self.intervals_ends) and self.intervals_ends[i] <= oldest:
+            i += 1
+        if i:
+            del self.intervals_starts[:i]
+            del self.intervals_ends[:i]
+        self.intervals_from = max(self.intervals_from, oldest)
+
+    # will give the first time >= t which is valid
     def get_next_valid_time_from_t(self, t):
-        # first find from cache
+        t = int(t)
+        i = self.get_interval_index(t)
+        if i is None:
+            return self.find_next_valid_time_from_t(t)
+        # Maybe we are in an interval
+        if i >= 0 and t < self.intervals_ends[i]:
+            return t
+        if i + 1 < len(self.intervals_starts):
+            return self.intervals_starts[i + 1]
+        return self.valid_after
+
+    # will give the first time >= t which is not valid
+    def get_next_invalid_time_from_t(self, t):
+        t = int(t)
+        i = self.get_interval_index(t)
+        if i is None:
+            return self.find_next_invalid_time_from_t(t)
+        if i >= 0 and t < self.intervals_ends[i]:
+            # The last interval may go on after the window
+            if self.intervals_clipped and i == len(self.intervals_ends) - 1:
+                if self.clipped_end is None:
+                    end = self.find_next_invalid_time_from_t(self.intervals_ends[i])
+                    self.clipped_end = (end,)
+                return self.clipped_end[0]
+            return self.intervals_ends[i]
+        return t
+
+    # Look at the dateranges and excludes for the first time >= t which
+    # is valid
+    def find_next_valid_time_from_t(self, t):
         t = int(t)
         original_t = t
 
         # logger.debug("[%s] Check valid time for %s" %
         #  ( self.get_name(), time.asctime(time.localtime(t)))
 
-        res_from_cache = self.find_next_valid_time_from_cache(t)
-        if res_from_cache is not None:
-            return res_from_cache
-
         still_loop = True
 
         # Loop for all minutes...
@@ -322,23 +408,19 @@ class Timeperiod(Item):
                     still_loop = False
                     local_min = None
 
-        # Ok, we update the cache...
-        self.cache[original_t] = local_min
         return local_min
 
-    def get_next_invalid_time_from_t(self, t):
+    # Look at the dateranges and excludes for the first time >= t which
+    # is not valid. With until, we stop looking there, and give until if
+    # we are still valid
+    def find_next_invalid_time_from_t(self, t, until=None):
         # print '\n\n', self.get_name(), 'Search for next invalid from',
         # time.asctime(time.localtime(t)), t
         t = int(t)
         original_t = t
         still_loop = True
 
-        # First try to find in cache
-        res_from_cache = self.find_next_invalid_time_from_cache(t)
-        if res_from_cache is not None:
-            return res_from_cache
-
-        # Then look, maybe t is already invalid
+        # First look, maybe t is already invalid
         if not self.is_time_valid(t):
             return t
 
@@ -347,6 +429,8 @@ class Timeperiod(Item):
         # Loop for all minutes...
         while still_loop:
             # print "Invalid loop with", time.asctime(time.localtime(local_min))
+            if until is not None and local_min >= until:
+                return until
 
             dr_mins = []
             # val_valids = []
@@ -433,8 +517,6 @@ class Timeperiod(Item):
                     res = local_min
 
         # print "Finished Return the next invalid", time.asctime(time.localtime(local_min))
-        # Ok, we update the cache...
-        self.invalid_cache[original_t] = local_min
         return local_min
 
     def has(self, prop):
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#     Gabes Jean, naparuba@gmail.com
+#     Gerhard Lausser, Gerhard.Lausser@consol.de
+#     Gregory Starck, g.starck@gmail.com
+#     Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module launches the checks commands with posix_spawn, from the
+libc by ctypes. Unlike subprocess.Popen with preexec_fn, no python code
+runs in the child, and we do not have to close all the fds in it: the
+ones of the worker are set close on exec once.
+"""
+
+import os
+import errno
+
+try:
+    import fcntl
+    import ctypes
+    import ctypes.util
+except ImportError:
+    fcntl = None
+    ctypes = None
+
+
+# posix_spawnattr_setflags flags, the same for the glibc and the BSDs
+POSIX_SPAWN_SETPGROUP = 0x02
+
+# We do not know the size of the libc opaque types, so be large
+SPAWN_ATTR_SIZE = 1024
+SPAWN_FILE_ACTIONS_SIZE = 1024
+
+_libc = None
+
+
+# Get the libc if it has posix_spawn, or None
+def get_libc():
+    global _libc
+    if _libc is not None:
+        return _libc or None
+    _libc = False
+    if ctypes is None or fcntl is None or os.name != 'posix':
+        return None
+    path = ctypes.util.find_library('c')
+    if path is None:
+        return None
+    try:
+        libc = ctypes.CDLL(path, use_errno=True)
+        libc.posix_spawn
+        libc.posix_spawnattr_setpgroup
+    except (OSError, AttributeError):
+        return None
+    _libc = libc
+    return libc
+
+
+def is_available():
+    return get_libc() is not None
+
+
+# Set the close on exec flag of a fd
+def set_cloexec(fd):
+    try:
+        flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+        fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    except IOError:
+        pass
+
+
+# Set all our fds (but the standard ones) close on exec, so the
+# launched processes do not get them
+def set_all_cloexec():
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        try:
+            max_fd = os.sysconf('SC_OPEN_MAX')
+        except (ValueError, OSError):
+            max_fd = 1024
+        fds = xrange(3, max_fd)
+    for fd in fds:
+        if fd > 2:
+            set_cloexec(fd)
+
+
+# A NULL terminated char * array
+def to_c_array(strings):
+    arr = (ctypes.c_char_p * (len(strings) + 1))()
+    arr[:-1] = strings
+    arr[-1] = None
+    return arr
+
+
+# The environment of the worker does not change, so we prepare it once
+_environ = None
+
+
+def get_environ(env):
+    global _environ
+    if _environ is None:
+        _environ = ['%s=%s' % (k, v) for (k, v) in os.environ.iteritems()]
+    if not env:
+        return _environ
+    local_env = [e for e in _environ if e.split('=', 1)[0] not in env]
+    local_env.extend('%s=%s' % (str(k), v.encode('utf8')) for (k, v) in env.iteritems())
+    return local_env
+
+
+# Look for the program like execvpe does, in the PATH of the environment
+# given to the process, and not in our. None if we cannot find it
+def find_program(name, env):
+    if '/' in name:
+        return name
+    path = (env or {}).get('PATH')
+    if path is None:
+        path = os.environ.get('PATH', os.defpath)
+    for d in path.split(os.pathsep):
+        full = os.path.join(d or '.', name)
+        if os.path.isfile(full) and os.access(full, os.X_OK):
+            return full
+    return None
+
+
+class SpawnedProcess(object):
+    """The Popen like object of a process launched by spawn, with what
+    the actions use: pid, stdout, stderr, returncode and poll().
+    """
+
+    def __init__(self, pid, stdout, stderr):
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+
+
+    # Like Popen.poll: the return code if the process exited, None if not
+    def poll(self):
+        if self.returncode is not None:
+            return self.returncode
+        try:
+            pid, sts = os.waitpid(self.pid, os.WNOHANG)
+        except OSError, exp:
+            if exp.errno != errno.ECHILD:
+                raise
+            # Someone else got it, we will never know: UNKNOWN
+            self.returncode = 3
+            return self.returncode
+        if pid == self.pid:
+            if os.WIFSIGNALED(sts):
+                self.returncode = -os.WTERMSIG(sts)
+            else:
+                self.returncode = os.WEXITSTATUS(sts)
+        return self.returncode
+
+
+# Launch cmd (a list of args, or a string for the shell) in its own
+# process group, with stdout and stderr in pipes. Raise OSError like
+# Popen if we cannot
+def spawn(cmd, shell, env):
+    libc = get_libc()
+    if shell:
+        args = ['/bin/sh', '-c', cmd]
+    else:
+        args = list(cmd)
+    # posix_spawnp would look in the PATH of the worker
+    program = find_program(args[0], env)
+    if program is None:
+        raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+    argv = to_c_array(args)
+    envp = to_c_array(get_environ(env))
+
+    out_r, out_w = os.pipe()
+    try:
+        err_r, err_w = os.pipe()
+    except OSError:
+        os.close(out_r)
+        os.close(out_w)
+        raise
+    # The dup2 in the child will clear the flag for its outputs
+    for fd in (out_r, out_w, err_r, err_w):
+        set_cloexec(fd)
+
+    attr = ctypes.create_string_buffer(SPAWN_ATTR_SIZE)
+    actions = ctypes.create_string_buffer(SPAWN_FILE_ACTIONS_SIZE)
+    libc.posix_spawnattr_init(attr)
+    libc.posix_spawn_file_actions_init(actions)
+    try:
+        # A new process group, so we can kill the whole tree on timeout
+        libc.posix_spawnattr_setflags(attr, ctypes.c_short(POSIX_SPAWN_SETPGROUP))
+        libc.posix_spawnattr_setpgroup(attr, 0)
+        libc.posix_spawn_file_actions_adddup2(actions, out_w, 1)
+        libc.posix_spawn_file_actions_adddup2(actions, err_w, 2)
+
+        pid = ctypes.c_int(0)
+        res = libc.posix_spawn(ctypes.byref(pid), program, actions, attr, argv, envp)
+    finally:
+        libc.posix_spawn_file_actions_destroy(actions)
+        libc.posix_spawnattr_destroy(attr)
+        os.close(out_w)
+        os.close(err_w)
+
+    if res != 0:
+        os.close(out_r)
+        os.close(err_r)
+        raise OSError(res, os.strerror(res))
+    return SpawnedProcess(pid.value, os.fdopen(out_r, 'rb'), os.fdopen(err_r, 'rb'))
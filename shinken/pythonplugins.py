@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#     Gabes Jean, naparuba@gmail.com
+#     Gerhard Lausser, Gerhard.Lausser@consol.de
+#     Gregory Starck, g.starck@gmail.com
+#     Hartmut Goebel, h.goebel@goebel-consult.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module runs python check plugins in the worker process itself,
+like the embedded perl of Nagios. The plugins are loaded once, and then
+their entry point is called for each check, with its argv and
+environment, so we do not pay the interpreter start and the imports
+each time.
+
+The plugins modules are kept between the calls, so their global state
+too: only plugins that are fine with it should be registered.
+"""
+
+import os
+import sys
+import imp
+import time
+import shlex
+import signal
+import traceback
+import cStringIO
+
+from shinken.log import logger
+
+__all__ = ('PythonPlugins', )
+
+valid_exit_status = (0, 1, 2, 3)
+
+
+# Not an Exception, so the plugins that catch all of them (except
+# Exception:) do not catch their timeout too
+class PluginTimeout(BaseException):
+    pass
+
+
+class PythonPlugins(object):
+    """The registered plugins, by path and by file name, and how to
+    run them for an action.
+    """
+
+    def __init__(self):
+        # path -> (path, entry point name), and the same by file name
+        self.registered = {}
+        self.by_name = {}
+        # path -> function, loaded when first used
+        self.entry_points = {}
+
+
+    # Register a plugin file. entry is the name of the function to call,
+    # that reads sys.argv like the __main__ of the script
+    def register(self, path, entry='main'):
+        path = os.path.abspath(path)
+        self.registered[path] = (path, entry)
+        self.by_name[os.path.basename(path)] = (path, entry)
+
+
+    # Register the plugins of a module parameter, like
+    # "/path/check_foo.py, /path/check_bar.py:run"
+    def register_from_string(self, s):
+        for elt in s.split(','):
+            elt = elt.strip()
+            if not elt:
+                continue
+            if ':' in elt:
+                path, entry = elt.rsplit(':', 1)
+                self.register(path.strip(), entry.strip())
+            else:
+                self.register(elt)
+
+
+    # Get the entry point of a registered plugin, loading it if need.
+    # None if it's not a registered one, or if it cannot be loaded
+    def get_entry_point(self, cmd):
+        reg = self.registered.get(os.path.abspath(cmd))
+        if reg is None:
+            reg = self.by_name.get(os.path.basename(cmd))
+        if reg is None:
+            return None
+        path, entry = reg
+        if path in self.entry_points:
+            return self.entry_points[path]
+
+        # Not __main__, so the script main part is not run
+        mod_name = 'shinken_plugin_' + os.path.basename(path).replace('.', '_').replace('-', '_')
+        func = None
+        try:
+            mod = imp.load_source(mod_name, path)
+            func = getattr(mod, entry)
+        except Exception, exp:
+            logger.error("Cannot load the python plugin %s (%s): %s", path, entry, exp)
+        # We do not try again each time
+        self.entry_points[path] = func
+        return func
+
+
+    # Get the argv of an action, if it's for a registered plugin. We do
+    # not manage shell commands
+    def get_argv(self, action):
+        if action.got_shell_characters():
+            return None
+        try:
+            argv = shlex.split(action.command.encode('utf8', 'ignore'))
+        except Exception:
+            return None
+        if not argv or self.get_entry_point(argv[0]) is None:
+            return None
+        return argv
+
+
+    def manage_alarm(self, sig, frame):
+        raise PluginTimeout()
+
+
+    # Run the action plugin in our process, and set its results like
+    # Action.check_finished. The action must have argv from get_argv
+    def run(self, action, argv, max_plugins_output_length):
+        func = self.get_entry_point(argv[0])
+        action.status = 'launched'
+        action.check_time = time.time()
+
+        old_argv = sys.argv
+        old_env = {}
+        old_stdout, old_stderr = sys.stdout, sys.stderr
+        stdout = cStringIO.StringIO()
+        stderr = cStringIO.StringIO()
+        old_handler = None
+        utime, stime = os.times()[:2]
+
+        timeout = False
+        try:
+            try:
+                # We give the plugin what it would get as a process
+                for (k, v) in action.env.iteritems():
+                    k = str(k)
+                    old_env[k] = os.environ.get(k)
+                    if isinstance(v, unicode):
+                        v = v.encode('utf8')
+                    os.environ[k] = v
+                sys.stdout, sys.stderr = stdout, stderr
+                sys.argv = argv
+                old_handler = signal.signal(signal.SIGALRM, self.manage_alarm)
+                signal.setitimer(signal.ITIMER_REAL, max(action.timeout, 0.001))
+                res = func()
+                exit_status = 0
+                if isinstance(res, (int, long)):
+                    exit_status = res
+            except SystemExit, exp:
+                exit_status = exp.code
+                if exit_status is None:
+                    exit_status = 0
+                elif not isinstance(exit_status, (int, long)):
+                    # Like python, the message goes on stderr
+                    stderr.write('%s\n' % exit_status)
+                    exit_status = 1
+            except PluginTimeout:
+                timeout = True
+            except Exception:
+                # Like a crashed python process
+                stderr.write(traceback.format_exc())
+                exit_status = 1
+        finally:
+            if old_handler is not None:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, old_handler)
+            sys.stdout, sys.stderr = old_stdout, old_stderr
+            sys.argv = old_argv
+            for (k, v) in old_env.iteritems():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+
+        n_utime, n_stime = os.times()[:2]
+        action.u_time = n_utime - utime
+        action.s_time = n_stime - stime
+        action.execution_time = time.time() - action.check_time
+
+        if timeout:
+            action.status = 'timeout'
+            action.exit_status = 3
+            return
+
+        stdoutdata = stdout.getvalue()
+        stderrdata = stderr.getvalue()
+        if exit_status not in valid_exit_status:
+            exit_status = 3
+        if not stdoutdata.strip():
+            stdoutdata = stderrdata
+        action.exit_status = exit_status
+        action.get_outputs(stdoutdata, max_plugins_output_length)
+        action.status = 'done'
@@ -32,7 +32,8 @@ from cStringIO import StringIO
 # Code from Graphite::carbon project
 class SafeUnpickler(object):
     PICKLE_SAFE = {
-        'copy_reg': set(['_reconstructor']),
+        # __newobj__ is for the new style objects of the binary protocol
+        'copy_reg': set(['_reconstructor', '__newobj__']),
         '__builtin__': set(['object', 'set']),
     }
 
@@ -58,8 +58,10 @@ import traceback
 import zlib
 import base64
 import threading
+from functools import partial
 
-from shinken.http_client import HTTPClient, HTTPExceptions
+from shinken.http_client import HTTPClient, HTTPMultiClient, HTTPExceptions
+from shinken.action_packer import FORMAT, is_packed, unpack_actions, pack_results
 
 from shinken.message import Message
 from shinken.worker import Worker
@@ -118,11 +120,10 @@ class IForArbiter(Interface):
     # NB: following methods are only used by broker
     # Used by the Arbiter to push broks to broker
     def push_broks(self, broks):
-        with self.app.arbiter_broks_lock:
-            self.app.arbiter_broks.extend(broks.values())
+        self.app.arbiter_broks.extend(broks.values())
     push_broks.method = 'post'
     # We are using a Lock just for NOT lock this call from the arbiter :)
-    push_broks.need_lock = False
+    push_broks.need_lock = 'arbiter_broks'
     push_broks.doc = doc
 
     doc = 'Get the external commands from the daemon (internal)'
@@ -130,11 +131,10 @@ class IForArbiter(Interface):
     # Same than push_broks, we will not using Global lock here,
     # and only lock for external_commands
     def get_external_commands(self):
-        with self.app.external_commands_lock:
-            cmds = self.app.get_external_commands()
-            raw = cPickle.dumps(cmds)
-        return raw
-    get_external_commands.need_lock = False
+        cmds = self.app.get_external_commands()
+        return cPickle.dumps(cmds)
+    get_external_commands.encode = 'raw'
+    get_external_commands.need_lock = 'external_commands'
     get_external_commands.doc = doc
 
 
@@ -174,6 +174,7 @@ class ISchedulers(Interface):
         ret = self.app.get_return_for_passive(int(sched_id))
         # print "Send mack", len(ret), "returns"
         return cPickle.dumps(ret)
+    get_returns.encode = 'raw'
     get_returns.doc = doc
 
 
@@ -189,6 +190,7 @@ class IBroks(Interface):
     def get_broks(self, bname):
         res = self.app.get_broks()
         return base64.b64encode(zlib.compress(cPickle.dumps(res), 2))
+    get_broks.need_lock = 'broks'
     get_broks.doc = doc
 
 
@@ -198,17 +200,18 @@ class IStats(Interface):
     """
 
     doc = 'Get raw stats from the daemon'
+    # Only lists of the queues are used, so we do not need to wait for
+    # the loop that can change them
     def get_raw_stats(self):
         app = self.app
         res = {}
 
-        for sched_id in app.schedulers:
-            sched = app.schedulers[sched_id]
+        for (sched_id, sched) in app.schedulers.items():
             lst = []
             res[sched_id] = lst
-            for mod in app.q_by_mod:
+            for (mod, queues) in app.q_by_mod.items():
                 # In workers we've got actions send to queue - queue size
-                for (i, q) in app.q_by_mod[mod].items():
+                for (i, q) in queues.items():
                     lst.append({
                         'scheduler_name': sched['name'],
                         'module': mod,
@@ -216,6 +219,7 @@ class IStats(Interface):
                         'queue_size': q.qsize(),
                         'return_queue_len': app.get_returns_queue_len()})
         return res
+    get_raw_stats.need_lock = False
     get_raw_stats.doc = doc
 
 
@@ -239,6 +243,16 @@ class BaseSatellite(Daemon):
         self.external_commands = []
         self.external_commands_lock = threading.RLock()
 
+        # To send our queries to all the schedulers at the same time
+        self.http_multi = HTTPMultiClient()
+
+
+    # Time of the last query to each of our schedulers
+    def get_latency_metrics(self, _type, now):
+        return ['%s.%s.latency.%s %f %d' % (_type, self.name, sched['name'],
+                                            sched['con'].latency, now)
+                for sched in self.schedulers.values() if sched.get('con') is not None]
+
 
     # The arbiter can resent us new conf in the pyro_daemon port.
     # We do not want to loose time about it, so it's not a blocking
@@ -283,6 +297,7 @@ class Satellite(BaseSatellite):
 
         # Keep broks so they can be eaten by a broker
         self.broks = {}
+        self.broks_lock = threading.RLock()
 
         self.workers = {}   # dict of active workers
 
@@ -300,6 +315,9 @@ class Satellite(BaseSatellite):
         self.returns_queue = None
         self.q_by_mod = {}
 
+        # Time we can wait in the schedulers long polls for new actions
+        self.long_poll_timeout = 0.0
+
 
     # Wrapper function for the true con init
     def pynag_con_init(self, id):
@@ -355,6 +373,8 @@ class Satellite(BaseSatellite):
                         self.name, sname)
             sched['wait_homerun'].clear()
         sched['running_id'] = new_run_id
+        # Maybe it's another version now, the next get_checks will tell us
+        sched['packed'] = False
         logger.info("[%s] Connection OK with scheduler %s", self.name, sname)
 
 
@@ -408,30 +428,38 @@ class Satellite(BaseSatellite):
     # REF: doc/shinken-action-queues.png (6)
     def do_manage_returns(self):
         # For all schedulers, we check for waitforhomerun
-        # and we send back results
+        # and we send back results, to all of them at once
+        sched_ids = []
         for sched_id in self.schedulers:
             sched = self.schedulers[sched_id]
             # If sched is not active, I do not try return
             if not sched['active']:
                 continue
             # Now ret have all verifs, we can return them
-            send_ok = False
             ret = sched['wait_homerun'].values()
-            if ret is not []:
-                try:
-                    con = sched['con']
-                    if con is not None:  # None = not initialized
-                        send_ok = con.post('put_results', {'results': ret})
-                        # Not connected or sched is gone
-                except (HTTPExceptions, KeyError), exp:
-                    logger.error('manage_returns exception:: %s,%s ', type(exp), str(exp))
-                    self.pynag_con_init(sched_id)
-                    return
-                except AttributeError, exp:  # the scheduler must  not be initialized
-                    logger.error('manage_returns exception:: %s,%s ', type(exp), str(exp))
-                except Exception, exp:
-                    logger.error("A satellite raised an unknown exception: %s (%s)", exp, type(exp))
-                    raise
+            con = sched.get('con', None)
+            if con is not None and sched.get('packed', False):
+                self.http_multi.put(con, 'put_packed_results', pack_results(ret))
+            elif con is not None:  # None = not initialized
+                self.http_multi.post(con, 'put_results', {'results': ret})
+            else:
+                # Not connected or sched is gone
+                self.pynag_con_init(sched_id)
+                logger.warning("Sent failed!")
+                continue
+            sched_ids.append(sched_id)
+
+        results = self.http_multi.perform()
+        for (sched_id, send_ok) in zip(sched_ids, results):
+            sched = self.schedulers[sched_id]
+            # Not connected or sched is gone, or not initialized
+            if isinstance(send_ok, HTTPExceptions) or isinstance(send_ok, AttributeError):
+                logger.error('manage_returns exception:: %s,%s ', type(send_ok), str(send_ok))
+                send_ok = False
+            elif isinstance(send_ok, Exception):
+                logger.error("A satellite raised an unknown exception: %s (%s)",
+                             send_ok, type(send_ok))
+                raise send_ok
 
             # We clean ONLY if the send is OK
             if send_ok:
@@ -464,12 +492,10 @@ class Satellite(BaseSatellite):
     # Create and launch a new worker, and put it into self.workers
     # It can be mortal or not
     def create_and_launch_worker(self, module_name='fork', mortal=True):
-        # create the input queue of this worker
+        # create the input queue of this worker. It is not a manager one:
+        # the worker waits for its jobs on the pipe behind the queue
         try:
-            if is_android:
-                q = Queue()
-            else:
-                q = self.manager.Queue()
+            q = Queue()
         # If we got no /dev/shm on linux, we can got problem here.
         # Must raise with a good message
         except OSError, exp:
@@ -497,7 +523,8 @@ class Satellite(BaseSatellite):
         cls_name = self.__class__.__name__.lower()
         w = Worker(1, q, self.returns_queue, self.processes_by_worker,
                    mortal=mortal, max_plugins_output_length=self.max_plugins_output_length,
-                   target=target, loaded_into=cls_name, http_daemon=self.http_daemon)
+                   target=target, loaded_into=cls_name, http_daemon=self.http_daemon,
+                   spawn_method=getattr(self, 'spawn_method', 'popen'))
         w.module_name = module_name
         # save this worker
         self.workers[w.id] = w
@@ -506,8 +533,12 @@ class Satellite(BaseSatellite):
         self.q_by_mod[module_name][w.id] = q
         logger.info("[%s] Allocating new %s Worker: %s", self.name, module_name, w.id)
 
-        # Ok, all is good. Start it!
-        w.start()
+        # Ok, all is good. Start it! But not while the logs are written
+        paused = logger.pause_writer()
+        try:
+            w.start()
+        finally:
+            logger.resume_writer(paused)
 
 
     # The main stop of this daemon. Stop all workers
@@ -539,7 +570,8 @@ class Satellite(BaseSatellite):
         if cls_type == 'brok':
             # For brok, we TAG brok with our instance_id
             elt.instance_id = 0
-            self.broks[elt.id] = elt
+            with self.broks_lock:
+                self.broks[elt.id] = elt
             return
         elif cls_type == 'externalcommand':
             logger.debug("Enqueuing an external command '%s'", str(elt.__dict__))
@@ -548,6 +580,7 @@ class Satellite(BaseSatellite):
 
 
     # Someone ask us our broks. We send them, and clean the queue
+    # (under the broks_lock)
     def get_broks(self):
         res = copy.copy(self.broks)
         self.broks.clear()
@@ -701,6 +734,12 @@ class Satellite(BaseSatellite):
         do_checks = self.__class__.do_checks
         do_actions = self.__class__.do_actions
 
+        # The schedulers that know the packed format can also wait for new
+        # checks. They are all asked at the same time, so each one can
+        # use all our waiting time
+        long_poll_timeout = self.long_poll_timeout
+        self.long_poll_timeout = 0.0
+
         # We check for new check in each schedulers and put the result in new_checks
         for sched_id in self.schedulers:
             sched = self.schedulers[sched_id]
@@ -708,47 +747,72 @@ class Satellite(BaseSatellite):
             if not sched['active']:
                 continue
 
-            try:
-                try:
-                    con = sched['con']
-                except KeyError:
-                    con = None
-                if con is not None:  # None = not initialized
-                    # OK, go for it :)
-                    # Before ask a call that can be long, do a simple ping to be sure it is alive
-                    con.get('ping')
-                    tmp = con.get('get_checks', {
-                        'do_checks': do_checks, 'do_actions': do_actions,
-                        'poller_tags': self.poller_tags,
-                        'reactionner_tags': self.reactionner_tags,
-                        'worker_name': self.name,
-                        'module_types': self.q_by_mod.keys()
-                    },
-                        wait='long')
-                    # Explicit pickle load
-                    tmp = base64.b64decode(tmp)
-                    tmp = zlib.decompress(tmp)
-                    tmp = cPickle.loads(str(tmp))
-                    logger.debug("Ask actions to %d, got %d", sched_id, len(tmp))
-                    # We 'tag' them with sched_id and put into queue for workers
-                    # REF: doc/shinken-action-queues.png (2)
-                    self.add_actions(tmp, sched_id)
-                else:  # no con? make the connection
-                    self.pynag_con_init(sched_id)
-            # Ok, con is unknown, so we create it
-            # Or maybe is the connection lost, we recreate it
-            except (HTTPExceptions, KeyError), exp:
-                logger.debug('get_new_actions exception:: %s,%s ', type(exp), str(exp))
+            con = sched.get('con', None)
+            if con is None:  # None = not initialized
+                # no con? make the connection
                 self.pynag_con_init(sched_id)
-            # scheduler must not be initialized
-            # or scheduler must not have checks
+                continue
+
+            # OK, go for it :)
+            try:
+                args = {
+                    'do_checks': do_checks, 'do_actions': do_actions,
+                    'poller_tags': self.poller_tags,
+                    'reactionner_tags': self.reactionner_tags,
+                    'worker_name': self.name,
+                    'module_types': self.q_by_mod.keys(),
+                    'wire_format': FORMAT
+                }
+            # we must not be initialized
             except AttributeError, exp:
                 logger.debug('get_new_actions exception:: %s,%s ', type(exp), str(exp))
-            # What the F**k? We do not know what happened,
-            # log the error message if possible.
-            except Exception, exp:
-                logger.error("A satellite raised an unknown exception: %s (%s)", exp, type(exp))
-                raise
+                continue
+            # The actions of a scheduler go to the workers as soon as it
+            # answers, without waiting for the others
+            callback = partial(self.got_new_actions, sched_id)
+            # Newer schedulers give us the checks as soon as they are due
+            if sched.get('packed', False):
+                args['timeout'] = long_poll_timeout
+                self.http_multi.get(con, 'wait_checks', args, wait='long', callback=callback)
+            else:
+                self.http_multi.get(con, 'get_checks', args, wait='long', callback=callback)
+        self.http_multi.perform()
+
+
+    # A scheduler answered to our get_checks/wait_checks query
+    def got_new_actions(self, sched_id, tmp):
+        sched = self.schedulers[sched_id]
+        try:
+            if isinstance(tmp, Exception):
+                raise tmp
+            # Newer schedulers answer with the packed format, the
+            # olders with a base64 of the pickled checks
+            sched['packed'] = is_packed(tmp)
+            if sched['packed']:
+                tmp = unpack_actions(tmp)
+            else:
+                # Explicit pickle load
+                tmp = base64.b64decode(tmp)
+                tmp = zlib.decompress(tmp)
+                tmp = cPickle.loads(str(tmp))
+            logger.debug("Ask actions to %d, got %d", sched_id, len(tmp))
+            # We 'tag' them with sched_id and put into queue for workers
+            # REF: doc/shinken-action-queues.png (2)
+            self.add_actions(tmp, sched_id)
+        # Ok, con is unknown, so we create it
+        # Or maybe is the connection lost, we recreate it
+        except (HTTPExceptions, KeyError), exp:
+            logger.debug('get_new_actions exception:: %s,%s ', type(exp), str(exp))
+            self.pynag_con_init(sched_id)
+        # scheduler must not be initialized
+        # or scheduler must not have checks
+        except AttributeError, exp:
+            logger.debug('get_new_actions exception:: %s,%s ', type(exp), str(exp))
+        # What the F**k? We do not know what happened,
+        # log the error message if possible.
+        except Exception, exp:
+            logger.error("A satellite raised an unknown exception: %s (%s)", exp, type(exp))
+            raise
 
 
     # In android we got a Queue, and a manager list for others
@@ -766,7 +830,8 @@ class Satellite(BaseSatellite):
     def clean_previous_run(self):
         # Clean all lists
         self.schedulers.clear()
-        self.broks.clear()
+        with self.broks_lock:
+            self.broks.clear()
         with self.external_commands_lock:
             self.external_commands = self.external_commands[:]
 
@@ -787,6 +852,16 @@ class Satellite(BaseSatellite):
                 return
             self.setup_new_conf()
 
+        # With long polling schedulers, we will wait in them for new
+        # actions instead of sleeping here, so just look at the arbiter
+        if not self.passive and [s for s in self.schedulers.values()
+                                 if s['active'] and s.get('packed', False)]:
+            self.long_poll_timeout = max(0.0, self.timeout)
+            self.timeout = 0.0
+            self.watch_for_new_conf(0.0)
+            if self.new_conf:
+                self.setup_new_conf()
+
         # Now we check if arbiter speak to us in the pyro_daemon.
         # If so, we listen to it
         # When it push a conf, we reinit connections
@@ -909,9 +984,10 @@ class Satellite(BaseSatellite):
 
     # Setup the new received conf from arbiter
     def setup_new_conf(self):
-        conf = self.new_conf
+        with self.conf_lock:
+            conf = self.new_conf
+            self.new_conf = None
         logger.debug("[%s] Sending us a configuration %s", self.name, conf)
-        self.new_conf = None
         self.cur_conf = conf
         g_conf = conf['global']
 
@@ -989,6 +1065,7 @@ class Satellite(BaseSatellite):
                 self.schedulers[sched_id]['wait_homerun'] = {}
                 self.schedulers[sched_id]['actions'] = {}
             self.schedulers[sched_id]['running_id'] = 0
+            self.schedulers[sched_id]['packed'] = False
             self.schedulers[sched_id]['active'] = s['active']
             self.schedulers[sched_id]['timeout'] = s['timeout']
             self.schedulers[sched_id]['data_timeout'] = s['data_timeout']
@@ -1016,6 +1093,7 @@ class Satellite(BaseSatellite):
         logger.info("[%s] Using min workers: %s", self.name, self.min_workers)
 
         self.processes_by_worker = g_conf['processes_by_worker']
+        self.spawn_method = g_conf.get('spawn_method', 'popen')
         self.polling_interval = g_conf['polling_interval']
         self.timeout = self.polling_interval
 
@@ -1060,6 +1138,7 @@ class Satellite(BaseSatellite):
         # metrics specific
         metrics.append('%s.%s.external-commands.queue %d %d' % (
             _type, self.name, len(self.external_commands), now))
+        metrics.extend(self.get_latency_metrics(_type, now))
 
         return res
 
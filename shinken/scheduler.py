@@ -29,12 +29,14 @@ import cStringIO
 import tempfile
 import traceback
 import cPickle
+import heapq
 
 import threading
 from Queue import Empty
 
 from shinken.external_command import ExternalCommand
 from shinken.check import Check
+from shinken.checkqueue import CheckQueue
 from shinken.notification import Notification
 from shinken.eventhandler import EventHandler
 from shinken.brok import Brok
@@ -66,6 +68,10 @@ class Scheduler(object):
         # and to not wait for them, we put them here and
         # use them later
 
+        # The brokers queues are given by the http threads without the
+        # global lock, so they are protected by their own lock
+        self.broks_lock = threading.RLock()
+
         # Every N seconds we call functions like consume, del zombies
         # etc. All of theses functions are in recurrent_works with the
         # every tick to run. So must be an integer > 0
@@ -120,6 +126,9 @@ class Scheduler(object):
 
         # Ours queues
         self.checks = {}
+        # checks indexed by status, and scheduled ones by poller_tag/module_type
+        # and t_to_go
+        self.checks_queue = CheckQueue(self.checks)
         self.actions = {}
         self.downtimes = {}
         self.contact_downtimes = {}
@@ -136,6 +145,13 @@ class Scheduler(object):
 
         # Now fake initialize for our satellites
         self.brokers = {}
+        # The last stats of the loop, given as is to the get_raw_stats
+        # calls, so they do not need any lock
+        self.raw_stats = {'nb_scheduled': 0, 'nb_inpoller': 0, 'nb_zombies': 0,
+                          'nb_notifications': 0, 'broks_lag': {}}
+        # A broker that stream its broks but did not ack them since
+        # this time is a dead one, so its queue is cleaned like the others
+        self.broks_ack_timeout = 300
         self.pollers = {}
         self.reactionners = {}
 
@@ -144,10 +160,13 @@ class Scheduler(object):
         self.must_run = True
         with self.waiting_results_lock:
             del self.waiting_results[:]
+        with self.broks_lock:
+            self.broks.clear()
+            self.brokers.clear()
         for o in self.checks, self.actions, self.downtimes,\
-                self.contact_downtimes, self.comments,\
-                self.broks, self.brokers:
+                self.contact_downtimes, self.comments:
             o.clear()
+        self.checks_queue.clear()
 
     def iter_hosts_and_services(self):
         for what in (self.hosts, self.services):
@@ -292,21 +311,22 @@ class Scheduler(object):
     def add_Brok(self, brok, bname=None):
         # For brok, we TAG brok with our instance_id
         brok.instance_id = self.instance_id
-        # Maybe it's just for one broker
-        if bname:
-            broks = self.brokers[bname]['broks']
-            broks[brok.id] = brok
-        else:
-            # If there are known brokers, give it to them
-            if len(self.brokers) > 0:
-                # Or maybe it's for all
-                for bname in self.brokers:
-                    broks = self.brokers[bname]['broks']
-                    broks[brok.id] = brok
-            else:  # no brokers? maybe at startup for logs
-                # we will put in global queue, that the first broker
-                # connection will get all
-                self.broks[brok.id] = brok
+        with self.broks_lock:
+            # Maybe it's just for one broker
+            if bname:
+                broks = self.brokers[bname]['broks']
+                broks[brok.id] = brok
+            else:
+                # If there are known brokers, give it to them
+                if len(self.brokers) > 0:
+                    # Or maybe it's for all
+                    for bname in self.brokers:
+                        broks = self.brokers[bname]['broks']
+                        broks[brok.id] = brok
+                else:  # no brokers? maybe at startup for logs
+                    # we will put in global queue, that the first broker
+                    # connection will get all
+                    self.broks[brok.id] = brok
 
 
     def add_Notification(self, notif):
@@ -319,6 +339,8 @@ class Scheduler(object):
 
     def add_Check(self, c):
         self.checks[c.id] = c
+        # Index it so pollers will find it when it will be due
+        self.checks_queue.add(c)
         # A new check means the host/service changes its next_check
         # need to be refreshed
         b = c.ref.get_next_schedule_brok()
@@ -434,24 +456,29 @@ class Scheduler(object):
                     dependent_checks.depend_on.remove(c.id)
                 for c_temp in c.depend_on:
                     c_temp.depen_on_me.remove(c)
+                self.checks_queue.remove(c)
                 del self.checks[i]  # Final Bye bye ...
         else:
             nb_checks_drops = 0
 
         # For broks and actions, it's more simple
-        # or brosk, manage global but also all brokers queue
-        b_lists = [self.broks]
-        for (bname, e) in self.brokers.iteritems():
-            b_lists.append(e['broks'])
-        for broks in b_lists:
-            if len(broks) > max_broks:
-                id_max = max(broks.keys())
-                id_to_del_broks = [i for i in broks if i < id_max - max_broks]
-                nb_broks_drops = len(id_to_del_broks)
-                for i in id_to_del_broks:
-                    del broks[i]
-            else:
-                nb_broks_drops = 0
+        # or brosk, manage global but also all brokers queue.
+        # Brokers that stream their broks ack them, so we keep their queue
+        # until they are too late to ack, and they will get them all
+        now = time.time()
+        nb_broks_drops = 0
+        with self.broks_lock:
+            b_lists = [self.broks]
+            for (bname, e) in self.brokers.iteritems():
+                if now - e.get('last_ack', 0) > self.broks_ack_timeout:
+                    b_lists.append(e['broks'])
+            for broks in b_lists:
+                if len(broks) > max_broks:
+                    id_max = max(broks.keys())
+                    id_to_del_broks = [i for i in broks if i < id_max - max_broks]
+                    nb_broks_drops += len(id_to_del_broks)
+                    for i in id_to_del_broks:
+                        del broks[i]
 
         if len(self.actions) > max_actions:
             id_max = max(self.actions.keys())
@@ -466,6 +493,10 @@ class Scheduler(object):
         else:
             nb_actions_drops = 0
 
+        # Some brokers lost status broks, they need the whole status again
+        if nb_broks_drops != 0:
+            self.reset_status_brok_data()
+
         if nb_checks_drops != 0 or nb_broks_drops != 0 or nb_actions_drops != 0:
             logger.warning("We drop %d checks, %d broks and %d actions",
                            nb_checks_drops, nb_broks_drops, nb_actions_drops)
@@ -565,6 +596,8 @@ class Scheduler(object):
                     # We use it to create "child" notifications (for the contacts and
                     # notification_commands) which are executed in the reactionner.
                     item = a.ref
+                    # Its notifications will change, the retention must see it
+                    item.retention_dirty = True
                     childnotifications = []
                     if not item.notification_is_blocked_by_item(a.type, now):
                         # If it is possible to send notifications
@@ -621,22 +654,20 @@ class Scheduler(object):
 
         # If poller want to do checks
         if do_checks:
-            for c in self.checks.values():
-                #  If the command is untagged, and the poller too, or if both are tagged
-                #  with same name, go for it
-                # if do_check, call for poller, and so poller_tags by default is ['None']
-                # by default poller_tag is 'None' and poller_tags is ['None']
-                # and same for module_type, the default is the 'fork' type
-                if c.poller_tag in poller_tags and c.module_type in module_types:
-                    # must be ok to launch, and not an internal one (business rules based)
-                    if c.status == 'scheduled' and c.is_launchable(now) and not c.internal:
-                        c.status = 'inpoller'
-                        c.worker = worker_name
-                        # We do not send c, because it is a link (c.ref) to
-                        # host/service and poller do not need it. It only
-                        # need a shell with id, command and defaults
-                        # parameters. It's the goal of copy_shell
-                        res.append(c.copy_shell())
+            #  If the command is untagged, and the poller too, or if both are tagged
+            #  with same name, go for it
+            # if do_check, call for poller, and so poller_tags by default is ['None']
+            # by default poller_tag is 'None' and poller_tags is ['None']
+            # and same for module_type, the default is the 'fork' type
+            # The queue only give us scheduled, launchable and not internal checks
+            for c in self.checks_queue.pop_launchable(now, poller_tags, module_types):
+                c.status = 'inpoller'
+                c.worker = worker_name
+                # We do not send c, because it is a link (c.ref) to
+                # host/service and poller do not need it. It only
+                # need a shell with id, command and defaults
+                # parameters. It's the goal of copy_shell
+                res.append(c.copy_shell())
 
         # If reactionner want to notify too
         if do_actions:
@@ -946,7 +977,7 @@ class Scheduler(object):
     # simply ask their ref to manage it when it's ok to run
     def manage_internal_checks(self):
         now = time.time()
-        for c in self.checks.values():
+        for c in self.checks_queue.get_by_status('scheduled'):
             # must be ok to launch, and not an internal one (business rules based)
             if c.internal and c.status == 'scheduled' and c.is_launchable(now):
                 c.ref.manage_internal_check(self.hosts, self.services, c)
@@ -956,7 +987,7 @@ class Scheduler(object):
 
 
     # Call by brokers to have broks
-    # We give them, and clean them!
+    # We give them, and clean them! (under the broks_lock)
     def get_broks(self, bname):
         # If we are here, we are sure the broker entry exists
         res = self.brokers[bname]['broks']
@@ -971,6 +1002,45 @@ class Scheduler(object):
         return res
 
 
+    # Call by brokers that stream their broks. They give us the id of
+    # the last brok they got (after), so we can forget the batch we sent
+    # them, and they get at most max_broks of the next ones, by id order.
+    # If they did not get the last batch (timeout or so), they do not
+    # ack it and we give it again. Returns the batch and the number of
+    # broks still waiting for this broker (under the broks_lock)
+    def get_broks_after(self, bname, after, max_broks):
+        # If we are here, we are sure the broker entry exists
+        e = self.brokers[bname]
+        broks = e['broks']
+
+        # Also give the possible first log broks if so
+        if self.broks:
+            broks.update(self.broks)
+            self.broks.clear()
+
+        # The last batch was received, we can free it right now
+        sent = e.get('sent', [])
+        if sent and sent[-1] <= after:
+            for i in sent:
+                broks.pop(i, None)
+        e['last_ack'] = time.time()
+
+        # Only the smallest ids, we do not sort all of the waiting ones
+        ids = heapq.nsmallest(max(1, max_broks), broks)
+        e['sent'] = ids
+        res = [broks[i] for i in ids]
+        return res, len(broks) - len(res)
+
+
+    # Number of broks waiting for each broker
+    def get_broks_lag(self):
+        res = {}
+        with self.broks_lock:
+            for (bname, e) in self.brokers.iteritems():
+                res[bname] = len(e['broks'])
+        return res
+
+
     # An element can have its topology changed by an external command
     # if so a brok will be generated with this flag. No need to reset all of
     # them.
@@ -1007,68 +1077,71 @@ class Scheduler(object):
         # of our hosts and services
         all_data = {'hosts': {}, 'services': {}}
         for h in self.hosts:
-            d = {}
-            running_properties = h.__class__.running_properties
-            for prop, entry in running_properties.items():
-                if entry.retention:
-                    v = getattr(h, prop)
-                    # Maybe we should "prepare" the data before saving it
-                    # like get only names instead of the whole objects
-                    f = entry.retention_preparation
-                    if f:
-                        v = f(h, v)
-                    d[prop] = v
-            # and some properties are also like this, like
-            # active checks enabled or not
-            properties = h.__class__.properties
-            for prop, entry in properties.items():
-                if entry.retention:
-                    v = getattr(h, prop)
-                    # Maybe we should "prepare" the data before saving it
-                    # like get only names instead of the whole objects
-                    f = entry.retention_preparation
-                    if f:
-                        v = f(h, v)
-                    d[prop] = v
-            all_data['hosts'][h.host_name] = d
+            all_data['hosts'][h.host_name] = self.get_item_retention_data(h)
 
         # Same for services
         for s in self.services:
-            d = {}
-            running_properties = s.__class__.running_properties
-            for prop, entry in running_properties.items():
-                if entry.retention:
-                    v = getattr(s, prop)
-                    # Maybe we should "prepare" the data before saving it
-                    # like get only names instead of the whole objects
-                    f = entry.retention_preparation
-                    if f:
-                        v = f(s, v)
-                    d[prop] = v
-
-            # We consider the service ONLY if it has modified attributes.
-            # If not, then no non-running attributes will be saved for this service.
-            if s.modified_attributes > 0:
-                # Same for properties, like active checks enabled or not
-                properties = s.__class__.properties
+            all_data['services'][(s.host.host_name, s.service_description)] = \
+                self.get_item_retention_data(s)
+        return all_data
 
-                for prop, entry in properties.items():
-                    # We save the value only if the attribute
-                    # is selected for retention AND has been modified.
-                    if entry.retention and \
-                            not (prop in DICT_MODATTR and
-                                 not DICT_MODATTR[prop].value & s.modified_attributes):
-                        v = getattr(s, prop)
-                        # Maybe we should "prepare" the data before saving it
-                        # like get only names instead of the whole objects
-                        f = entry.retention_preparation
-                        if f:
-                            v = f(s, v)
-                        d[prop] = v
-            all_data['services'][(s.host.host_name, s.service_description)] = d
+
+    # Helper function for modules that only save what changed: give the
+    # data of the hosts and services that changed since the last call
+    # (or of all of them with full), and forget about these changes
+    def get_changed_retention_data(self, full=False):
+        all_data = {'hosts': {}, 'services': {}}
+        for h in self.hosts:
+            if full or getattr(h, 'retention_dirty', True):
+                all_data['hosts'][h.host_name] = self.get_item_retention_data(h)
+                h.retention_dirty = False
+
+        for s in self.services:
+            if full or getattr(s, 'retention_dirty', True):
+                all_data['services'][(s.host.host_name, s.service_description)] = \
+                    self.get_item_retention_data(s)
+                s.retention_dirty = False
         return all_data
 
 
+    # Give the retention data of a host or a service
+    def get_item_retention_data(self, i):
+        d = {}
+        running_properties = i.__class__.running_properties
+        for prop, entry in running_properties.items():
+            if entry.retention:
+                v = getattr(i, prop)
+                # Maybe we should "prepare" the data before saving it
+                # like get only names instead of the whole objects
+                f = entry.retention_preparation
+                if f:
+                    v = f(i, v)
+                d[prop] = v
+
+        # We consider the service ONLY if it has modified attributes.
+        # If not, then no non-running attributes will be saved for this service.
+        if i.my_type == 'service' and i.modified_attributes == 0:
+            return d
+
+        # and some properties are also like this, like
+        # active checks enabled or not
+        properties = i.__class__.properties
+        for prop, entry in properties.items():
+            # For services, we save the value only if the attribute
+            # is selected for retention AND has been modified.
+            if entry.retention and \
+                    not (i.my_type == 'service' and prop in DICT_MODATTR and
+                         not DICT_MODATTR[prop].value & i.modified_attributes):
+                v = getattr(i, prop)
+                # Maybe we should "prepare" the data before saving it
+                # like get only names instead of the whole objects
+                f = entry.retention_preparation
+                if f:
+                    v = f(i, v)
+                d[prop] = v
+        return d
+
+
     # Get back our broks from a retention module :)
     def restore_retention_data(self, data):
         # Now load interesting properties in hosts/services
@@ -1203,6 +1276,13 @@ class Scheduler(object):
                     s.notified_contacts = new_notified_contacts
 
 
+    # The next update status broks of hosts and services will give
+    # their whole status, and not only the changed properties
+    def reset_status_brok_data(self):
+        for elt in self.iter_hosts_and_services():
+            elt.reset_status_brok_data()
+
+
     # Fill the self.broks with broks of self (process id, and co)
     # broks of service and hosts (initial status)
     def fill_initial_broks(self, bname, with_logs=False):
@@ -1241,6 +1321,10 @@ class Scheduler(object):
         b = Brok('initial_broks_done', {'instance_id': self.instance_id})
         self.add_Brok(b, bname)
 
+        # The other brokers did not get these initial broks, so our next
+        # status updates must be whole ones for all of them
+        self.reset_status_brok_data()
+
         # We now have all full broks
         self.has_full_broks = True
 
@@ -1313,14 +1397,16 @@ class Scheduler(object):
 
         # Then we consume them
         # print "**********Consume*********"
-        for c in self.checks.values():
+        # Consuming a check can change the status of others, so look
+        # again at it
+        for c in self.checks_queue.get_by_status('waitconsume'):
             if c.status == 'waitconsume':
                 item = c.ref
                 item.consume_result(c)
 
 
         # All 'finished' checks (no more dep) raise checks they depends on
-        for c in self.checks.values():
+        for c in self.checks_queue.get_by_status('havetoresolvedep'):
             if c.status == 'havetoresolvedep':
                 for dependent_checks in c.depend_on_me:
                     # Ok, now dependent will no more wait c
@@ -1329,7 +1415,7 @@ class Scheduler(object):
                 c.status = 'zombie'
 
         # Now, reinteger dep checks
-        for c in self.checks.values():
+        for c in self.checks_queue.get_by_status('waitdep'):
             if c.status == 'waitdep' and len(c.depend_on) == 0:
                 item = c.ref
                 item.consume_result(c)
@@ -1339,14 +1425,13 @@ class Scheduler(object):
     # zombie = not useful anymore
     def delete_zombie_checks(self):
         # print "**********Delete zombies checks****"
-        id_to_del = []
-        for c in self.checks.values():
-            if c.status == 'zombie':
-                id_to_del.append(c.id)
         # une petite tape dans le dos et tu t'en vas, merci...
         # *pat pat* GFTO, thks :)
-        for id in id_to_del:
-            del self.checks[id]  # ZANKUSEN!
+        for c in self.checks_queue.get_by_status('zombie'):
+            self.checks_queue.remove(c)
+            del self.checks[c.id]  # ZANKUSEN!
+        # And forget about them in the queue too if need
+        self.checks_queue.compact()
 
 
     # Called every 1sec to delete all actions in a zombie state
@@ -1485,7 +1570,7 @@ class Scheduler(object):
     def check_orphaned(self):
         worker_names = {}
         now = int(time.time())
-        for c in self.checks.values():
+        for c in self.checks_queue.get_by_status('inpoller'):
             time_to_orphanage = c.ref.get_time_to_orphanage()
             if time_to_orphanage:
                 if c.status == 'inpoller' and c.t_to_go < now - time_to_orphanage:
@@ -1553,19 +1638,19 @@ class Scheduler(object):
         # metrics specific
         metrics = res['metrics']
         metrics.append('scheduler.%s.checks.scheduled %d %d' %
-                       (self.instance_name,
-                        len([c for c in self.checks.values() if c.status == 'scheduled']), now))
+                       (self.instance_name, self.checks_queue.count('scheduled'), now))
         metrics.append('scheduler.%s.checks.inpoller %d %d' %
-                       (self.instance_name,
-                        len([c for c in self.checks.values() if c.status == 'scheduled']), now))
+                       (self.instance_name, self.checks_queue.count('inpoller'), now))
         metrics.append('scheduler.%s.checks.zombie %d %d' %
-                       (self.instance_name,
-                        len([c for c in self.checks.values() if c.status == 'scheduled']), now))
+                       (self.instance_name, self.checks_queue.count('zombie'), now))
         metrics.append('scheduler.%s.actions.queue %d %d' %
                        (self.instance_name,
                         len(self.actions), now))
         metrics.append('scheduler.%s.broks.queue %d %d' %
                        (self.instance_name, len(self.broks), now))
+        for (bname, lag) in self.get_broks_lag().iteritems():
+            metrics.append('scheduler.%s.broks.lag.%s %d %d' %
+                           (self.instance_name, bname, lag, now))
         metrics.append('scheduler.%s.downtimes %d %d' %
                        (self.instance_name, len(self.downtimes), now))
         metrics.append('scheduler.%s.comments %d %d' %
@@ -1679,14 +1764,18 @@ class Scheduler(object):
                         f()
                         statsmgr.incr('loop.%s' % name, time.time() - _t)
 
+            # New actions and checks may be there now for the long polling
+            # satellites
+            self.checks_queue.wake_up_waiters()
+
             # DBG: push actions to passives?
             self.push_actions_to_passives_satellites()
             self.get_actions_from_passives_satellites()
 
             # stats
-            nb_scheduled = len([c for c in self.checks.values() if c.status == 'scheduled'])
-            nb_inpoller = len([c for c in self.checks.values() if c.status == 'inpoller'])
-            nb_zombies = len([c for c in self.checks.values() if c.status == 'zombie'])
+            nb_scheduled = self.checks_queue.count('scheduled')
+            nb_inpoller = self.checks_queue.count('inpoller')
+            nb_zombies = self.checks_queue.count('zombie')
             nb_notifications = len(self.actions)
 
             logger.debug("Checks: total %s, scheduled %s,"
@@ -1700,6 +1789,15 @@ class Scheduler(object):
             if lat_avg is not None:
                 logger.debug("Latency (avg/min/max): %.2f/%.2f/%.2f", lat_avg, lat_min, lat_max)
 
+            # A new dict each time, so the http threads can give it
+            # without any lock
+            raw_stats = {'nb_scheduled': nb_scheduled, 'nb_inpoller': nb_inpoller,
+                         'nb_zombies': nb_zombies, 'nb_notifications': nb_notifications,
+                         'broks_lag': self.get_broks_lag(), 'latency': (0.0, 0.0, 0.0)}
+            if lat_avg:
+                raw_stats['latency'] = (lat_avg, lat_min, lat_max)
+            self.raw_stats = raw_stats
+
             # print "Notifications:", nb_notifications
             now = time.time()
 
@@ -27,6 +27,8 @@ import copy
 import sys
 import os
 import json
+import zlib
+import cPickle
 
 try:
     from ClusterShell.NodeSet import NodeSet, NodeSetParseRangeError
@@ -717,11 +719,120 @@ def expect_file_dirs(root, path):
     return True
 
 
+# ############################## Serialization #######################
+# File like object that compress what is written in it, so a pickle can
+# be streamed in it without never holding the whole uncompressed pickle
+class ZlibWriter(object):
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level)
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(self.compressor.compress(data))
+
+    def getvalue(self):
+        self.chunks.append(self.compressor.flush())
+        res = ''.join(self.chunks)
+        self.chunks = [res]
+        return res
+
+
+# Pickle obj with the binary protocol and compress it on the fly
+def compressed_dumps(obj, level=1):
+    w = ZlibWriter(level)
+    cPickle.Pickler(w, cPickle.HIGHEST_PROTOCOL).dump(obj)
+    return w.getvalue()
+
+
+def compressed_loads(s):
+    return cPickle.loads(zlib.decompress(s))
+
+
 # ####################### Services/hosts search filters  #######################
+# The regex of the business rules are evaluated again on each bp check
+# in the scheduler, so we keep the compiled ones
+_compiled_regexes = {}
+
+
+def get_compiled_regex(regex):
+    r = _compiled_regexes.get(regex)
+    if r is None:
+        # Do not grow without limit with macro modulated regexes
+        if len(_compiled_regexes) >= 1000:
+            _compiled_regexes.clear()
+        r = _compiled_regexes[regex] = re.compile(regex)
+    return r
+
+
+# Index functions used by the Items.find_by_filter secondary indexes.
+# They return the keys under which the host or service is indexed, and
+# must match what the filters below are looking at
+def index_host_by_name(host):
+    return [host.host_name]
+
+
+def index_host_by_group(host):
+    return [g.hostgroup_name for g in host.hostgroups]
+
+
+def index_host_by_tag(host):
+    return [t.strip() for t in host.tags]
+
+
+# labels is a coma separated string, or the empty list default
+def _split_labels(labels):
+    if isinstance(labels, basestring):
+        return [l.strip() for l in labels.split(',')]
+    return labels
+
+
+def index_host_by_bp_rule_label(host):
+    return _split_labels(host.labels)
+
+
+def index_service_by_name(service):
+    return [service.service_description]
+
+
+def index_service_by_host_name(service):
+    if service.host is None:
+        return []
+    return [service.host.host_name]
+
+
+def index_service_by_hostgroup_name(service):
+    if service.host is None:
+        return []
+    return [g.hostgroup_name for g in service.host.hostgroups]
+
+
+def index_service_by_host_tag_name(service):
+    if service.host is None:
+        return []
+    return [t.strip() for t in service.host.tags]
+
+
+def index_service_by_servicegroup_name(service):
+    return [g.servicegroup_name for g in service.servicegroups]
+
+
+def index_service_by_host_bp_rule_label(service):
+    if service.host is None:
+        return []
+    return _split_labels(service.host.labels)
+
+
+def index_service_by_bp_rule_label(service):
+    return _split_labels(service.labels)
+
+
 # Filters used in services or hosts find_by_filter method
 # Return callback functions which are passed host or service instances, and
 # should return a boolean value that indicates if the inscance mached the
-# filter
+# filter.
+# The filters that can be resolved by an index get an index attribute
+# (index function, key) or an index_regex one (index function, regex),
+# find_by_filter use them to get the candidates without a full scan
 def filter_any(name):
 
     def inner_filter(host):
@@ -745,17 +856,19 @@ def filter_host_by_name(name):
             return False
         return host.host_name == name
 
+    inner_filter.index = (index_host_by_name, name)
     return inner_filter
 
 
 def filter_host_by_regex(regex):
-    host_re = re.compile(regex)
+    host_re = get_compiled_regex(regex)
 
     def inner_filter(host):
         if host is None:
             return False
         return host_re.match(host.host_name) is not None
 
+    inner_filter.index_regex = (index_host_by_name, host_re)
     return inner_filter
 
 
@@ -766,6 +879,7 @@ def filter_host_by_group(group):
             return False
         return group in [g.hostgroup_name for g in host.hostgroups]
 
+    inner_filter.index = (index_host_by_group, group)
     return inner_filter
 
 
@@ -776,6 +890,7 @@ def filter_host_by_tag(tpl):
             return False
         return tpl in [t.strip() for t in host.tags]
 
+    inner_filter.index = (index_host_by_tag, tpl)
     return inner_filter
 
 
@@ -787,17 +902,19 @@ def filter_service_by_name(name):
             return False
         return service.service_description == name
 
+    inner_filter.index = (index_service_by_name, name)
     return inner_filter
 
 
 def filter_service_by_regex_name(regex):
-    host_re = re.compile(regex)
+    host_re = get_compiled_regex(regex)
 
     def inner_filter(service):
         if service is None:
             return False
         return host_re.match(service.service_description) is not None
 
+    inner_filter.index_regex = (index_service_by_name, host_re)
     return inner_filter
 
 
@@ -808,17 +925,19 @@ def filter_service_by_host_name(host_name):
             return False
         return service.host.host_name == host_name
 
+    inner_filter.index = (index_service_by_host_name, host_name)
     return inner_filter
 
 
 def filter_service_by_regex_host_name(regex):
-    host_re = re.compile(regex)
+    host_re = get_compiled_regex(regex)
 
     def inner_filter(service):
         if service is None or service.host is None:
             return False
         return host_re.match(service.host.host_name) is not None
 
+    inner_filter.index_regex = (index_service_by_host_name, host_re)
     return inner_filter
 
 
@@ -829,6 +948,7 @@ def filter_service_by_hostgroup_name(group):
             return False
         return group in [g.hostgroup_name for g in service.host.hostgroups]
 
+    inner_filter.index = (index_service_by_hostgroup_name, group)
     return inner_filter
 
 
@@ -839,6 +959,7 @@ def filter_service_by_host_tag_name(tpl):
             return False
         return tpl in [t.strip() for t in service.host.tags]
 
+    inner_filter.index = (index_service_by_host_tag_name, tpl)
     return inner_filter
 
 
@@ -849,6 +970,7 @@ def filter_service_by_servicegroup_name(group):
             return False
         return group in [g.servicegroup_name for g in service.servicegroups]
 
+    inner_filter.index = (index_service_by_servicegroup_name, group)
     return inner_filter
 
 
@@ -859,6 +981,7 @@ def filter_host_by_bp_rule_label(label):
             return False
         return label in host.labels
 
+    inner_filter.index = (index_host_by_bp_rule_label, label)
     return inner_filter
 
 
@@ -869,6 +992,7 @@ def filter_service_by_host_bp_rule_label(label):
             return False
         return label in service.host.labels
 
+    inner_filter.index = (index_service_by_host_bp_rule_label, label)
     return inner_filter
 
 
@@ -878,6 +1002,7 @@ def filter_service_by_bp_rule_label(label):
             return False
         return label in service.labels
 
+    inner_filter.index = (index_service_by_bp_rule_label, label)
     return inner_filter
 
 
@@ -41,12 +41,86 @@ import os
 import time
 import sys
 import signal
+import select
+import errno
 import traceback
 import cStringIO
 
+# We need non blocking fds to wait for the checks outputs, only on Unix
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 
 from shinken.log import logger
 from shinken.misc.common import setproctitle
+from shinken import posixspawn
+
+
+class Poller(object):
+    """Wait for input events on file descriptors, with epoll if we can,
+    and poll if not. The errors and hang ups are always given.
+    """
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self.poller = select.epoll()
+            self.flags = select.EPOLLIN | select.EPOLLPRI
+            self.closed = select.EPOLLHUP | select.EPOLLERR
+            # epoll wants seconds, poll milliseconds
+            self.unit = 1
+        else:
+            self.poller = select.poll()
+            self.flags = select.POLLIN | select.POLLPRI
+            self.closed = select.POLLHUP | select.POLLERR | select.POLLNVAL
+            self.unit = 1000
+
+
+    def register(self, fd):
+        self.poller.register(fd, self.flags)
+
+
+    # The fd can be already closed, so maybe already gone for epoll
+    def unregister(self, fd):
+        try:
+            self.poller.unregister(fd)
+        except (KeyError, IOError, ValueError):
+            pass
+
+
+    # Give the (fd, events) list, void on timeout or if a signal came
+    def poll(self, timeout):
+        try:
+            return self.poller.poll(timeout * self.unit)
+        except (IOError, select.error), exp:
+            if exp.args[0] == errno.EINTR:
+                return []
+            raise
+
+
+    def close(self):
+        if hasattr(self.poller, 'close'):
+            self.poller.close()
+
+
+# Set a fd in non blocking mode
+def set_non_blocking(fd):
+    fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+
+
+# Get the fd to wait for messages in a Queue, if we can (not for the
+# Manager ones)
+def get_queue_fd(q):
+    reader = getattr(q, '_reader', None)
+    if reader is None:
+        return None
+    try:
+        return reader.fileno()
+    except Exception:
+        return None
+
 
 class Worker:
     """This class is used for poller and reactionner to work.
@@ -66,7 +140,7 @@ class Worker:
 
     def __init__(self, id, s, returns_queue, processes_by_worker, mortal=True, timeout=300,
                  max_plugins_output_length=8192, target=None, loaded_into='unknown',
-                 http_daemon=None):
+                 http_daemon=None, spawn_method='popen'):
         self.id = self.__class__.id
         self.__class__.id += 1
 
@@ -82,7 +156,11 @@ class Worker:
         self._process = Process(target=target, args=(s, returns_queue, self._c))
         self.returns_queue = returns_queue
         self.max_plugins_output_length = max_plugins_output_length
+        # How we launch the checks processes: popen or posix_spawn
+        self.spawn_method = spawn_method
         self.i_am_dying = False
+        # Set in the worker process if it can wait for events
+        self.poller = None
         # Keep a trace where the worker is launch from (poller or reactionner?)
         self.loaded_into = loaded_into
         if os.name != 'nt':
@@ -149,7 +227,8 @@ class Worker:
                     self.checks.append(msg.get_data())
                 # print "I", self.id, "I've got a message!"
         except Empty, exp:
-            if len(self.checks) == 0:
+            # With a poller, we will wait for the queue in wait_for_events
+            if len(self.checks) == 0 and self.poller is None:
                 self._idletime = self._idletime + 1
                 time.sleep(1)
         # Maybe the Queue() is not available, if so, just return
@@ -165,13 +244,22 @@ class Worker:
         for chk in self.checks:
             if chk.status == 'queue':
                 self._idletime = 0
-                r = chk.execute()
+                r = chk.execute(self.spawn_method)
                 # Maybe we got a true big problem in the
                 # action launching
                 if r == 'toomanyopenfiles':
                     # We should die as soon as we return all checks
                     logger.error("[%d] I am dying Too many open files %s ... ", self.id, chk)
                     self.i_am_dying = True
+                # We will be wake up when it writes on its outputs
+                if self.poller is not None and chk.status == 'launched':
+                    fds = chk.get_outputs_fds()
+                    for fd in fds:
+                        self.poller.register(fd)
+                        self.actions_by_fd[fd] = chk
+                    self.fds_by_action[chk] = fds
+                    # Maybe it already finished
+                    self.to_check.add(chk)
 
 
     # Check the status of checks
@@ -182,11 +270,17 @@ class Worker:
         wait_time = 1
         now = time.time()
         for action in self.checks:
-            if action.status == 'launched' and action.last_poll < now - action.wait_time:
+            if self.poller is not None:
+                # We only look at the ones we got events for, or too long
+                if action.status == 'launched' and (action in self.to_check or
+                                                    now - action.check_time > action.timeout):
+                    action.check_finished(self.max_plugins_output_length)
+            elif action.status == 'launched' and action.last_poll < now - action.wait_time:
                 action.check_finished(self.max_plugins_output_length)
                 wait_time = min(wait_time, action.wait_time)
                 # If action done, we can launch a new one
             if action.status in ('done', 'timeout'):
+                self.forget_fds(action)
                 to_del.append(action)
                 # We answer to the master
                 # msg = Message(id=self.id, type='Result', data=action)
@@ -202,9 +296,114 @@ class Worker:
         for chk in to_del:
             self.checks.remove(chk)
 
+        # With a poller, we will wait for events instead
+        if self.poller is not None:
+            self.to_check.clear()
+            return
+
         # Little sleep
         time.sleep(wait_time)
 
+
+    # Create the poller and the pipe that will wake us up when a child
+    # process exits. No poller if we cannot (Windows, android or
+    # without fcntl), so we will look at the checks regularly
+    def create_poller(self, s, c):
+        if is_android or os.name == 'nt' or fcntl is None:
+            return
+        if not hasattr(select, 'epoll') and not hasattr(select, 'poll'):
+            return
+        # The signal handler only wakes up the poll, the pipe will
+        # be written by python
+        self.sigchld_pipe = os.pipe()
+        for fd in self.sigchld_pipe:
+            set_non_blocking(fd)
+        try:
+            signal.set_wakeup_fd(self.sigchld_pipe[1])
+        except ValueError:  # not in the main thread
+            for fd in self.sigchld_pipe:
+                os.close(fd)
+            return
+        signal.signal(signal.SIGCHLD, self.manage_sigchld)
+        # The others system calls must not be interrupted
+        signal.siginterrupt(signal.SIGCHLD, False)
+
+        self.poller = Poller()
+        self.actions_by_fd = {}
+        self.fds_by_action = {}
+        self.to_check = set()
+        self.poller.register(self.sigchld_pipe[0])
+
+        # And the queues for orders and new jobs. We only wait for
+        # new jobs when we can take them
+        control_fd = get_queue_fd(c)
+        if control_fd is not None:
+            self.poller.register(control_fd)
+        self.jobs_fd = get_queue_fd(s)
+        self.wait_for_jobs = False
+
+
+    def manage_sigchld(self, sig, frame):
+        pass
+
+
+    # An action is finished, we do not wait for its outputs anymore
+    def forget_fds(self, action):
+        if self.poller is None:
+            return
+        for fd in self.fds_by_action.pop(action, []):
+            self.poller.unregister(fd)
+            if self.actions_by_fd.get(fd) is action:
+                del self.actions_by_fd[fd]
+
+
+    # Wait for something to do: a check that writes or exits, a new job or
+    # order, or a check timeout. But no more than 1s.
+    def wait_for_events(self):
+        now = time.time()
+        timeout = 1.0
+        for action in self.checks:
+            if action.status == 'launched':
+                timeout = min(timeout, action.check_time + action.timeout - now)
+
+        want_jobs = len(self.checks) < self.processes_by_worker and not self.i_am_dying
+        if self.jobs_fd is None:
+            # We can take more checks but we cannot be wake up for them
+            if want_jobs and self.checks:
+                timeout = min(timeout, 0.1)
+        elif want_jobs != self.wait_for_jobs:
+            if want_jobs:
+                self.poller.register(self.jobs_fd)
+            else:
+                self.poller.unregister(self.jobs_fd)
+            self.wait_for_jobs = want_jobs
+        timeout = max(timeout, 0)
+
+        events = self.poller.poll(timeout)
+        if not self.checks:
+            self._idletime += time.time() - now
+
+        for (fd, event) in events:
+            if fd == self.sigchld_pipe[0]:
+                # A child exits, but we do not know which one
+                try:
+                    os.read(fd, 4096)
+                except OSError:
+                    pass
+                self.to_check.update(a for a in self.checks if a.status == 'launched')
+                continue
+            action = self.actions_by_fd.get(fd)
+            if action is None:
+                # A queue one, the main loop will get its messages
+                continue
+            # Read it now, so the process is not blocked on a full pipe
+            action.read_outputs()
+            # The process closed it, so it exited (or will soon)
+            if event & self.poller.closed:
+                self.poller.unregister(fd)
+                del self.actions_by_fd[fd]
+                self.to_check.add(action)
+
     # Check if our system time change. If so, change our
     def check_for_system_time_change(self):
         now = time.time()
@@ -258,6 +457,15 @@ class Worker:
         self.returns_queue = returns_queue
         self.s = s
         self.t_each_loop = time.time()
+        self.create_poller(s, c)
+        # The spawned processes will not close our fds, so they must
+        # be closed on exec
+        if self.spawn_method == 'posix_spawn':
+            if posixspawn.is_available():
+                posixspawn.set_all_cloexec()
+            else:
+                logger.warning("[%d] posix_spawn is not available, using popen", self.id)
+                self.spawn_method = 'popen'
         while True:
             begin = time.time()
             msg = None
@@ -273,6 +481,10 @@ class Worker:
             # REF: doc/shinken-action-queues.png (5)
             self.manage_finished_checks()
 
+            # Sleep until something happens
+            if self.poller is not None:
+                self.wait_for_events()
+
             # Now get order from master
             try:
                 cmsg = c.get(block=False)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the packed format of the checks and results
+#
+
+from shinken_test import *
+from shinken.action_packer import (is_packed, pack_actions, unpack_actions,
+                                   pack_results, unpack_results)
+from shinken.check import Check
+from shinken.eventhandler import EventHandler
+from shinken.notification import Notification
+
+
+class TestActionPacker(ShinkenTest):
+    # Uncomment this is you want to use a specific configuration
+    # for your test
+    def setUp(self):
+        pass
+
+    def test_actions(self):
+        c = Check('scheduled', u'plugins/check_ping -H h\xe9', None, 12345.5,
+                  timeout=30, env={'SHINKEN': 'yes'}, module_type='fork')
+        e = EventHandler('plugins/handler.sh', is_snapshot=True)
+        n = Notification(command='plugins/notify.sh', t_to_go=42)
+        raw = pack_actions([c.copy_shell(), e.copy_shell(), n.copy_shell()])
+        self.assertTrue(is_packed(raw))
+
+        c2, e2, n2 = unpack_actions(raw)
+        self.assertIsInstance(c2, Check)
+        self.assertEqual(c.id, c2.id)
+        self.assertEqual(c.command, c2.command)
+        self.assertEqual(12345.5, c2.t_to_go)
+        self.assertEqual(30, c2.timeout)
+        self.assertEqual({'SHINKEN': 'yes'}, c2.env)
+        self.assertIsInstance(e2, EventHandler)
+        self.assertTrue(e2.is_snapshot)
+        self.assertIsInstance(n2, Notification)
+        self.assertEqual(n.id, n2.id)
+        self.assertEqual(42, n2.t_to_go)
+
+    def test_results(self):
+        c = Check('scheduled', 'plugins/check_ping', None, 0).copy_shell()
+        c.status = 'done'
+        c.exit_status = 2
+        c.output = 'CRITICAL'
+        c.long_output = 'line1\nline2'
+        c.perf_data = 'rta=1ms'
+        c.execution_time = 0.5
+        c2 = unpack_results(pack_results([c]))[0]
+        for prop in ('id', 'status', 'exit_status', 'output', 'long_output',
+                     'perf_data', 'execution_time'):
+            self.assertEqual(getattr(c, prop), getattr(c2, prop))
+
+    def test_legacy_data_is_refused(self):
+        self.assertFalse(is_packed(u'eJwDAAAAAAE='))
+        self.assertRaises(ValueError, unpack_actions, 'eJwDAAAAAAE=')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This file is used to test the shared memory ring of the broks batches
+#
+
+from shinken_test import *
+from shinken.brok import Brok
+from shinken.brokring import BrokRing
+
+
+class TestBrokRing(ShinkenTest):
+    # Uncomment this is you want to use a specific configuration
+    # for your test
+    def setUp(self):
+        pass
+
+    def batch(self, name):
+        return [Brok(name, {'data': 'x' * 100}) for i in xrange(5)]
+
+    def test_batches_are_shared(self):
+        ring = BrokRing(4096)
+        q1 = ring.get_queue()
+        q2 = ring.get_queue()
+        for name in ('first', 'second'):
+            blob, desc = ring.write(self.batch(name))
+            self.assertIsNot(None, desc)
+            q1.put_batch(blob, desc)
+            q2.put_batch(blob, desc)
+        for q in (q1, q2):
+            self.assertEqual(['first'] * 5, [b.type for b in q.get()])
+            self.assertEqual(['second'] * 5, [b.type for b in q.get()])
+        q1.close()
+        q2.close()
+
+    def test_full_ring(self):
+        ring = BrokRing(1024)
+        q = ring.get_queue()
+        blob, desc = ring.write(self.batch('first'))
+        q.put_batch(blob, desc)
+        # The reader did not read the first one, so there is no room
+        blob, desc = ring.write(self.batch('second'))
+        self.assertIs(None, desc)
+        # but the batch is still given in the queue
+        q.put_batch(blob, desc)
+        self.assertEqual('first', q.get()[0].type)
+        self.assertEqual('second', q.get()[0].type)
+
+        # Once read, the place can be used again, even if we must
+        # write at the end and the start of the ring
+        for i in xrange(3):
+            blob, desc = ring.write(self.batch('again'))
+            self.assertIsNot(None, desc)
+            q.put_batch(blob, desc)
+            self.assertEqual('again', q.get()[0].type)
+
+        # A gone reader do not hold the ring anymore
+        ring.write(self.batch('not read'))
+        q.close()
+        self.assertIsNot(None, ring.write(self.batch('other'))[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
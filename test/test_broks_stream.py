@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the broks streaming with acked cursors
+#
+
+from shinken_test import *
+import cPickle
+from shinken.brok import Brok, pack_broks, unpack_broks
+from shinken.daemons.schedulerdaemon import IBroks
+
+
+class TestBroksStream(ShinkenTest):
+
+    def add_broker_broks(self, nb):
+        self.sched.brokers['broker'] = {'broks': {}, 'has_full_broks': False}
+        for i in xrange(nb):
+            self.sched.add_Brok(Brok('log', {'log': 'brok %d' % i}), 'broker')
+
+    def test_batches_are_acked(self):
+        self.add_broker_broks(5)
+        res, nb_left = self.sched.get_broks_after('broker', 0, 2)
+        self.assertEqual(2, len(res))
+        self.assertEqual(3, nb_left)
+
+        # Not acked: we got the same batch again
+        again, nb_left = self.sched.get_broks_after('broker', 0, 2)
+        self.assertEqual([b.id for b in res], [b.id for b in again])
+
+        # Acked: they are freed and we got the next ones
+        nxt, nb_left = self.sched.get_broks_after('broker', res[-1].id, 2)
+        self.assertTrue(nxt[0].id > res[-1].id)
+        self.assertEqual(3, len(self.sched.brokers['broker']['broks']))
+        self.assertEqual(1, nb_left)
+        self.assertEqual({'broker': 3}, self.sched.get_broks_lag())
+
+    def test_streamed_broks_are_not_dropped(self):
+        self.add_broker_broks(20)
+        self.sched.get_broks_after('broker', 0, 1)
+        nb_max = 5 * (len(self.sched.hosts) + len(self.sched.services))
+        for i in xrange(nb_max):
+            self.sched.add_Brok(Brok('log', {'log': 'more'}), 'broker')
+        self.sched.clean_queues()
+        self.assertEqual(20 + nb_max, len(self.sched.brokers['broker']['broks']))
+
+        # But a broker that do not ack anymore is a dead one
+        self.sched.brokers['broker']['last_ack'] = time.time() - 2 * self.sched.broks_ack_timeout
+        self.sched.clean_queues()
+        # The log of the drop is a brok too
+        mores = [b for b in self.sched.brokers['broker']['broks'].values()
+                 if 'more' in b.data]
+        self.assertTrue(len(mores) <= nb_max + 1)
+
+    def test_interface(self):
+        self.add_broker_broks(3)
+        self.sched.brokers['broker']['has_full_broks'] = True
+        i = IBroks(self.sched)
+        nb_left, broks = unpack_broks(i.get_broks('broker', after='0', max_broks='10'))
+        self.assertEqual(0, nb_left)
+        self.assertEqual(3, len(broks))
+        self.assertEqual(False, self.sched.brokers['broker']['has_full_broks'])
+        # Legacy brokers still get a base64 encoded dict
+        self.assertFalse(i.get_broks('broker').startswith('SHKB'))
+
+    def test_frames(self):
+        b = Brok('log', {'log': 'hello'})
+        b.instance_id = 3
+        raw = pack_broks([b], 0)
+        # The frame is done once, and is not pickled with the brok
+        self.assertEqual(raw, pack_broks([b], 0))
+        self.assertNotIn('frame', cPickle.loads(cPickle.dumps(b)).__dict__)
+
+        nb_left, broks = unpack_broks(raw)
+        got = broks[0]
+        self.assertEqual((b.id, 'log', 3), (got.id, got.type, got.instance_id))
+        # The data is only decoded by the broker that manage it
+        self.assertEqual(b.data, got.data)
+        got.prepare()
+        self.assertEqual({'log': 'hello', 'instance_id': 3}, got.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
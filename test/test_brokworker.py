@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This file is used to test the threads of the broker internal modules
+#
+
+import threading
+
+from shinken_test import *
+from shinken.brok import Brok
+from shinken.brokworker import BrokWorker
+
+
+class FakeModule(object):
+    def __init__(self, fail_on=None):
+        self.managed = []
+        self.fail_on = fail_on
+        self.ticks = []
+
+    def get_name(self):
+        return 'fake'
+
+    def manage_brok(self, b):
+        if b.type == self.fail_on:
+            raise ValueError('I do not like this brok')
+        self.managed.append(b.id)
+
+    def hook_tick(self, daemon):
+        self.ticks.append((threading.current_thread(), len(self.managed)))
+
+
+class TestBrokWorker(ShinkenTest):
+    # Uncomment this is you want to use a specific configuration
+    # for your test
+    def setUp(self):
+        pass
+
+    def wait_for(self, w, nb):
+        end = time.time() + 5
+        while w.nb_managed < nb and w.failure is None and time.time() < end:
+            w.thread.join(0.01)
+
+    def test_broks_are_managed_in_order(self):
+        mod = FakeModule()
+        w = BrokWorker(mod, 3)
+        broks = [Brok('log', {'log': str(i)}) for i in xrange(3)]
+        w.put(broks)
+        self.assertTrue(w.is_full())
+        self.assertEqual(3, w.get_lag())
+        w.start()
+        self.wait_for(w, 3)
+        self.assertEqual([b.id for b in broks], mod.managed)
+        self.assertEqual(0, w.get_lag())
+        self.assertFalse(w.is_full())
+        w.stop(timeout=1)
+        self.assertFalse(w.thread.is_alive())
+
+    # The hooks are called by the worker thread, after the broks it got
+    def test_hooks(self):
+        mod = FakeModule()
+        w = BrokWorker(mod, 10)
+        w.put([Brok('log', {'log': 'before'})])
+        w.put_hook('tick', None)
+        self.assertEqual(1, len(w.get_pending()))
+        w.start()
+        self.wait_for(w, 1)
+        end = time.time() + 5
+        while not mod.ticks and time.time() < end:
+            w.thread.join(0.01)
+        self.assertEqual([(w.thread, 1)], mod.ticks)
+        w.stop(timeout=1)
+
+    def test_failure(self):
+        mod = FakeModule(fail_on='bad')
+        w = BrokWorker(mod, 10)
+        w.start()
+        w.put([Brok('bad', {}), Brok('log', {'log': 'after'})])
+        self.wait_for(w, 1)
+        self.assertIsNot(None, w.failure)
+        self.assertEqual([], mod.managed)
+        # The ones it did not manage are still here
+        self.assertEqual(1, len(w.get_pending()))
+
+
+if __name__ == '__main__':
+    unittest.main()
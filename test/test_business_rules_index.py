@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the indexed lookup of the business rules
+# expressions
+#
+
+from shinken_test import *
+from shinken.objects.host import Host, Hosts
+from shinken.objects.hostgroup import Hostgroup
+from shinken.objects.service import Service, Services
+from shinken.util import filter_host_by_name, filter_host_by_regex, filter_host_by_group,\
+    filter_host_by_tag, filter_host_by_bp_rule_label, filter_service_by_name,\
+    filter_service_by_regex_host_name, filter_service_by_hostgroup_name, filter_any,\
+    get_compiled_regex
+
+
+def get_hosts():
+    web = Hostgroup({'hostgroup_name': u'web'})
+    db = Hostgroup({'hostgroup_name': u'db'})
+    hosts = []
+    for i in xrange(20):
+        h = Host({'host_name': u'srv%d' % i})
+        h.hostgroups = [web] if i % 2 else [web, db]
+        h.tags = set([u'linux' if i % 3 else u'windows'])
+        h.labels = u'label_%d, all' % (i % 4)
+        hosts.append(h)
+    return Hosts(hosts)
+
+
+def get_services(hosts):
+    services = []
+    for h in hosts:
+        for name in (u'http', u'mysql'):
+            s = Service({'host_name': h.host_name, 'service_description': name})
+            s.host = h
+            services.append(s)
+    return Services(services)
+
+
+# The reference: all the items, checked one by one
+def scan(items, filters):
+    return [i for i in items if all(f(i) for f in filters)]
+
+
+class TestBusinessRulesIndex(ShinkenTest):
+    # Uncomment this is you want to use a specific configuration
+    # for your test
+    def setUp(self):
+        pass
+
+    def test_hosts_lookup(self):
+        hosts = get_hosts()
+        for filters in ([filter_host_by_name(u'srv3')],
+                        [filter_host_by_regex(u'srv1.*')],
+                        [filter_host_by_group(u'db')],
+                        [filter_host_by_group(u'db'), filter_host_by_tag(u'linux')],
+                        [filter_host_by_bp_rule_label(u'label_1')],
+                        [filter_host_by_bp_rule_label(u'all'), filter_host_by_regex(u'srv[12]$')],
+                        [filter_host_by_group(u'unknown')],
+                        [filter_any('')]):
+            self.assertEqual(scan(hosts, filters), hosts.find_by_filter(filters))
+        self.assertEqual(5, len(hosts.find_by_filter([filter_host_by_bp_rule_label(u'label_1')])))
+        # A part of a label is not a label
+        self.assertEqual([], hosts.find_by_filter([filter_host_by_bp_rule_label(u'label')]))
+
+    def test_services_lookup(self):
+        hosts = get_hosts()
+        services = get_services(hosts)
+        filters = [filter_service_by_hostgroup_name(u'db'), filter_service_by_name(u'mysql')]
+        self.assertEqual(scan(services, filters), services.find_by_filter(filters))
+        self.assertEqual(10, len(services.find_by_filter(filters)))
+        filters = [filter_service_by_regex_host_name(u'srv1'), filter_any('')]
+        self.assertEqual(scan(services, filters), services.find_by_filter(filters))
+
+    def test_indexes_follow_items(self):
+        hosts = get_hosts()
+        filters = [filter_host_by_group(u'db')]
+        self.assertEqual(10, len(hosts.find_by_filter(filters)))
+        h = Host({'host_name': u'new'})
+        h.hostgroups = hosts.find_by_name(u'srv0').hostgroups
+        hosts.add_item(h)
+        self.assertIn(h, hosts.find_by_filter(filters))
+        hosts.remove_item(h)
+        self.assertNotIn(h, hosts.find_by_filter(filters))
+
+    def test_regex_cache(self):
+        self.assertIs(get_compiled_regex(u'srv.*'), get_compiled_regex(u'srv.*'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the time ordered queue of the scheduler checks
+#
+
+from shinken_test import *
+from shinken.daemons.schedulerdaemon import IChecks
+from shinken.action_packer import FORMAT, unpack_actions
+
+
+class TestChecksQueue(ShinkenTest):
+
+    def get_svc_check(self):
+        # The checks of the first scheduling are still in their items
+        self.sched.get_new_actions()
+        self.sched.checks.clear()
+        self.sched.checks_queue.clear()
+        svc = self.sched.services.find_srv_by_name_and_hostname("test_host_0", "test_ok_0")
+        svc.checks_in_progress = []
+        svc.act_depend_of = []
+        svc.schedule(force=True)
+        self.sched.get_new_actions()
+        self.assertEqual(1, len(svc.checks_in_progress))
+        return svc.checks_in_progress[0]
+
+    def test_only_due_checks_are_given(self):
+        c = self.get_svc_check()
+        c.t_to_go = time.time() + 3600
+        self.assertEqual([], self.sched.get_to_run_checks(True, False))
+
+        # A t_to_go change is seen by the queue
+        c.t_to_go = time.time() - 1
+        res = self.sched.get_to_run_checks(True, False)
+        self.assertEqual([c.id], [r.id for r in res])
+        self.assertEqual('inpoller', c.status)
+
+        # And it is given only once
+        self.assertEqual([], self.sched.get_to_run_checks(True, False))
+
+    def test_orphaned_checks_are_given_again(self):
+        c = self.get_svc_check()
+        c.t_to_go = time.time() - 1
+        self.assertEqual(1, len(self.sched.get_to_run_checks(True, False)))
+        # The poller never give it back
+        c.t_to_go = time.time() - 3600
+        self.sched.check_orphaned()
+        self.assertEqual('scheduled', c.status)
+        self.assertEqual(1, len(self.sched.get_to_run_checks(True, False)))
+
+    def test_zombies_are_dropped(self):
+        c = self.get_svc_check()
+        c.status = 'zombie'
+        c.t_to_go = time.time() - 1
+        self.sched.delete_zombie_checks()
+        self.assertEqual([], self.sched.get_to_run_checks(True, False))
+
+    def test_checks_by_status(self):
+        self.sched.checks.clear()
+        self.sched.checks_queue.clear()
+        c = self.get_svc_check()
+        self.assertEqual(1, self.sched.checks_queue.count('scheduled'))
+        c.status = 'inpoller'
+        self.assertEqual(0, self.sched.checks_queue.count('scheduled'))
+        self.assertEqual(1, self.sched.checks_queue.count('inpoller'))
+        self.assertEqual([c], self.sched.checks_queue.get_by_status('inpoller'))
+        stats = self.sched.get_stats_struct()
+        self.assertIn('scheduler.%s.checks.inpoller 1 ' % self.sched.instance_name,
+                      ''.join(stats['metrics']))
+        c.status = 'zombie'
+        self.sched.delete_zombie_checks()
+        self.assertEqual(0, self.sched.checks_queue.count('zombie'))
+        self.assertNotIn(c.id, self.sched.checks)
+
+    def test_wait_checks(self):
+        self.sched.checks.clear()
+        self.sched.checks_queue.clear()
+        ichecks = IChecks(self.sched)
+        c = self.get_svc_check()
+        c.t_to_go = time.time() + 3600
+
+        # Nothing is due, we wait for the timeout
+        t0 = time.time()
+        res = ichecks.wait_checks(do_checks='True', wire_format=FORMAT, timeout='0.2')
+        self.assertEqual([], unpack_actions(res))
+        self.assertGreaterEqual(time.time() - t0, 0.2)
+
+        # But a due check is given at once
+        c.t_to_go = time.time() - 1
+        res = ichecks.wait_checks(do_checks='True', wire_format=FORMAT, timeout='3')
+        self.assertEqual([c.id], [r.id for r in unpack_actions(res)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This file is used to test the cache of the parsed configuration files
+#
+
+import os
+import shutil
+import tempfile
+
+from shinken_test import *
+from shinken.objects.config import Config
+
+
+class TestConfigCache(ShinkenTest):
+    # Uncomment this is you want to use a specific configuration
+    # for your test
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'cache.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_buf(self, hosts_part):
+        return ('\n# IMPORTEDFROM=shinken.cfg\n'
+                'config_cache_file=%s\n'
+                '\n# IMPORTEDFROM=commands.cfg\n'
+                'define command {\n  command_name check\n  command_line check_it\n}\n'
+                '\n# IMPORTEDFROM=hosts.cfg\n%s\n' % (self.cache_file, hosts_part))
+
+    def parse(self, buf):
+        conf = Config()
+        conf.read_config_silent = 1
+        return conf.read_config_buf(buf)
+
+    def test_cache(self):
+        host = 'define host {\n  host_name %s\n  check_command check\n}\n'
+        buf = self.get_buf(host % 'h1')
+        objects = self.parse(buf)
+        self.assertTrue(os.path.exists(self.cache_file))
+        self.assertEqual(['h1'], objects['host'][0]['host_name'])
+        self.assertEqual(['hosts.cfg:1'], objects['host'][0]['imported_from'])
+
+        # The same objects from the cache
+        self.assertEqual(objects, self.parse(buf))
+
+        # Only the changed file is parsed again
+        buf = self.get_buf(host % 'h2' + host % 'h3')
+        with open(self.cache_file, 'rb') as f:
+            cache_before = f.read()
+        objects = self.parse(buf)
+        self.assertEqual(['h2'], objects['host'][0]['host_name'])
+        self.assertEqual(['h3'], objects['host'][1]['host_name'])
+        self.assertEqual(['hosts.cfg:5'], objects['host'][1]['imported_from'])
+        self.assertEqual(['check_it'], objects['command'][0]['command_line'])
+        with open(self.cache_file, 'rb') as f:
+            self.assertNotEqual(cache_before, f.read())
+
+    def test_bad_cache(self):
+        with open(self.cache_file, 'wb') as f:
+            f.write('not a cache')
+        objects = self.parse(self.get_buf('define host {\n  host_name h1\n}\n'))
+        self.assertEqual(['h1'], objects['host'][0]['host_name'])
+
+
+if __name__ == '__main__':
+    unittest.main()
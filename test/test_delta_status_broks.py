@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the update status broks with only the changes
+#
+
+from shinken_test import *
+from shinken.objects.host import Host
+from shinken.objects.service import Service
+
+
+class TestDeltaStatusBroks(ShinkenTest):
+
+    def setUp(self):
+        ShinkenTest.setUp(self)
+        # The changes only are given if asked
+        Host.full_status_broks = Service.full_status_broks = False
+
+    def tearDown(self):
+        Host.full_status_broks = Service.full_status_broks = True
+
+    def get_data(self, elt):
+        b = elt.get_update_status_brok()
+        b.prepare()
+        return b.data
+
+    def test_only_changes_are_given(self):
+        svc = self.sched.services.find_srv_by_name_and_hostname("test_host_0", "test_ok_0")
+        svc.reset_status_brok_data()
+        full = self.get_data(svc)
+        self.assertIn('state', full)
+
+        svc.output = 'Something new'
+        delta = self.get_data(svc)
+        self.assertEqual('Something new', delta['output'])
+        self.assertNotIn('state', delta)
+        # But the brokers can still find the service
+        self.assertEqual('test_host_0', delta['host_name'])
+        self.assertEqual('test_ok_0', delta['service_description'])
+
+        # The lists of the element can be changed in place, they are
+        # always given
+        self.assertIn('comments', delta)
+
+    def test_full_status(self):
+        host = self.sched.hosts.find_by_name("test_host_0")
+        host.reset_status_brok_data()
+        full = self.get_data(host)
+        self.assertNotIn('state', self.get_data(host))
+
+        # A new broker got initial broks, so all of them need the whole status
+        self.sched.brokers['broker'] = {'broks': {}, 'has_full_broks': False}
+        self.sched.fill_initial_broks('broker')
+        self.assertEqual(sorted(full.keys()), sorted(self.get_data(host).keys()))
+
+        # And the ones that want only whole status get them
+        host.__class__.full_status_broks = True
+        self.assertEqual(sorted(full.keys()), sorted(self.get_data(host).keys()))
+
+
+if __name__ == '__main__':
+    unittest.main()
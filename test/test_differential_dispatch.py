@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test that the dispatcher keeps the configuration
+# parts the schedulers already run
+#
+
+from shinken_test import *
+
+
+class TestDifferentialDispatch(ShinkenTest):
+    def setUp(self):
+        self.setup_with_file('etc/shinken_pack_hash_memory.cfg')
+
+    def get_realm(self):
+        return [r for r in self.conf.realms if len(r.confs) != 0][0]
+
+    def test_part_hash(self):
+        r = self.get_realm()
+        cfgs = r.confs.values()
+        self.assertEqual(2, len(cfgs))
+        hashes = [cfg.conf_hash for cfg in cfgs]
+        self.assertNotEqual(hashes[0], hashes[1])
+        self.assertEqual(hashes, [self.conf.get_part_hash(cfg) for cfg in cfgs])
+
+        # A change in a host only changes the hash of its part
+        h = list(cfgs[0].hosts)[0]
+        h.hash = 'changed'
+        self.assertNotEqual(hashes[0], self.conf.get_part_hash(cfgs[0]))
+        self.assertEqual(hashes[1], self.conf.get_part_hash(cfgs[1]))
+
+    def test_push_flavor(self):
+        r = self.get_realm()
+        cfg = r.confs.values()[0]
+        sched1, sched2 = r.schedulers[:2]
+        push_flavor = self.dispatcher.get_conf_package(r, cfg, sched1)['push_flavor']
+        # Always the same for the same conf and scheduler
+        self.assertEqual(push_flavor,
+                         self.dispatcher.get_conf_package(r, cfg, sched1)['push_flavor'])
+        self.assertNotEqual(push_flavor,
+                            self.dispatcher.get_conf_package(r, cfg, sched2)['push_flavor'])
+
+    def test_keep_conf(self):
+        r = self.get_realm()
+        cfg = r.confs.values()[0]
+        sched = r.schedulers[0]
+        push_flavor = self.dispatcher.get_conf_package(r, cfg, sched)['push_flavor']
+
+        # The scheduler runs another conf, it will need this one
+        sched.managed_confs = {cfg.id: push_flavor + 1}
+        self.assertFalse(self.dispatcher.keep_conf(r, cfg, [sched]))
+        self.assertFalse(cfg.is_assigned)
+
+        # It already runs this one: it keeps it, nothing is sent
+        sched.managed_confs = {cfg.id: push_flavor}
+        scheds = [sched]
+        self.assertTrue(self.dispatcher.keep_conf(r, cfg, scheds))
+        self.assertEqual([], scheds)
+        self.assertTrue(cfg.is_assigned)
+        self.assertIs(sched, cfg.assigned_to)
+        self.assertEqual(push_flavor, cfg.push_flavor)
+        self.assertFalse(sched.need_conf)
+        for kind in ('reactionner', 'poller', 'broker', 'receiver'):
+            self.assertTrue(r.to_satellites_need_dispatch[kind][cfg.id])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,6 +22,8 @@
 # This file is used to test reading and processing of config files
 #
 
+import threading
+
 from shinken_test import *
 
 
@@ -313,6 +315,32 @@ class TestDispatcher(ShinkenTest):
                 self.assertEqual(True, cfg.is_assigned)
                 self.assertEqual(scheduler1, cfg.assigned_to)
 
+    def test_concurrent_calls(self):
+        # Slow satellites are called at the same time: each call
+        # waits for all the others to be started
+        started = []
+        all_started = threading.Event()
+        def slow(i):
+            started.append(i)
+            if len(started) == 4:
+                all_started.set()
+            all_started.wait(5)
+            return (i * 2, all_started.is_set())
+        res = self.dispatcher.run_concurrently(slow, range(4))
+        self.assertEqual([(0, True), (2, True), (4, True), (6, True)], res)
+
+        # And an error is raised like for a serial call
+        def fail(i):
+            if i == 2:
+                raise ValueError(i)
+        self.assertRaises(ValueError, self.dispatcher.run_concurrently, fail, range(4))
+
+        # The threads can create broks, they must get different ids
+        def make_broks(i):
+            return [Brok('log', {'log': 'hello'}).id for j in xrange(2000)]
+        ids = sum(self.dispatcher.run_concurrently(make_broks, range(8)), [])
+        self.assertEqual(len(ids), len(set(ids)))
+
 
 class TestDispatcherMultiBroker(ShinkenTest):
 
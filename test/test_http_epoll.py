@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the epoll http backend
+#
+
+import socket
+import httplib
+import threading
+
+from shinken_test import *
+from shinken.http_epoll import EpollWSGIServer, has_epoll
+
+
+class TestHttpEpoll(ShinkenTest):
+    # Uncomment this is you want to use a specific configuration
+    # for your test
+    def setUp(self):
+        pass
+
+    def app(self, environ, start_response):
+        path = environ['PATH_INFO']
+        if path == '/slow':
+            self.slow_started.set()
+            self.slow_done.wait(5)
+        if path == '/big':
+            body = 'x' * (3 * 1024 * 1024)
+        elif path == '/echo':
+            body = environ['wsgi.input'].read()
+        elif path == '/error':
+            raise ValueError('bad')
+        else:
+            body = 'pong'
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [body]
+
+    def start_server(self):
+        self.slow_started = threading.Event()
+        self.slow_done = threading.Event()
+        srv = EpollWSGIServer('127.0.0.1', 0, self.app, 4)
+        t = threading.Thread(target=srv.serve_forever)
+        t.daemon = True
+        t.start()
+        return srv, t
+
+    def stop_server(self, srv, t):
+        self.slow_done.set()
+        srv.stop()
+        t.join(5)
+        self.assertFalse(t.is_alive())
+
+    def get(self, con, path, body=None):
+        con.request(body is None and 'GET' or 'POST', path, body)
+        r = con.getresponse()
+        return r.status, r.read()
+
+    def test_keep_alive(self):
+        if not has_epoll:
+            return
+        srv, t = self.start_server()
+        try:
+            con = httplib.HTTPConnection('127.0.0.1', srv.port, timeout=5)
+            self.assertEqual((200, 'pong'), self.get(con, '/ping'))
+            sock = con.sock
+            # Big bodies both ways, still on the same connection
+            data = 'y' * (2 * 1024 * 1024 + 3)
+            self.assertEqual((200, data), self.get(con, '/echo', data))
+            status, body = self.get(con, '/big')
+            self.assertEqual(3 * 1024 * 1024, len(body))
+            self.assertIs(sock, con.sock)
+            # An error do not kill the server
+            self.assertEqual(500, self.get(con, '/error')[0])
+            self.assertEqual((200, 'pong'), self.get(con, '/ping'))
+            con.close()
+        finally:
+            self.stop_server(srv, t)
+
+    def test_slow_calls_do_not_block_pings(self):
+        if not has_epoll:
+            return
+        srv, t = self.start_server()
+        try:
+            slow = httplib.HTTPConnection('127.0.0.1', srv.port, timeout=5)
+            slow.request('GET', '/slow')
+            self.assertTrue(self.slow_started.wait(5))
+            # A big transfer is in progress too, and the client is slow to read it
+            big = socket.create_connection(('127.0.0.1', srv.port), 5)
+            big.sendall('GET /big HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            big.recv(10)
+
+            con = httplib.HTTPConnection('127.0.0.1', srv.port, timeout=5)
+            self.assertEqual((200, 'pong'), self.get(con, '/ping'))
+
+            self.slow_done.set()
+            r = slow.getresponse()
+            self.assertEqual((200, 'pong'), (r.status, r.read()))
+            big.close()
+        finally:
+            self.stop_server(srv, t)
+
+    def test_bad_request(self):
+        if not has_epoll:
+            return
+        srv, t = self.start_server()
+        try:
+            s = socket.create_connection(('127.0.0.1', srv.port), 5)
+            s.sendall('NOT HTTP\r\n\r\n')
+            self.assertTrue(s.recv(100).startswith('HTTP/1.1 400'))
+            # And the connection is closed
+            self.assertEqual('', s.recv(100))
+        finally:
+            self.stop_server(srv, t)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the locks taken by the http interfaces
+#
+
+import threading
+
+from shinken_test import *
+from shinken.brok import Brok, unpack_broks
+from shinken.http_daemon import HTTPDaemon
+from shinken.daemons.schedulerdaemon import IBroks, IChecks, IStats
+
+
+class TestHttpLocks(ShinkenTest):
+
+    def get_http_daemon(self):
+        # No need of a real server, only of its global lock
+        http_daemon = HTTPDaemon('localhost', 0, 'auto', False, None, None, None, False, 1)
+        http_daemon.lock = threading.RLock()
+        return http_daemon
+
+    def test_declared_locks(self):
+        http_daemon = self.get_http_daemon()
+        i = IChecks(self.sched)
+        self.assertEqual([http_daemon.lock], http_daemon.get_locks(i, True))
+        self.assertEqual([], http_daemon.get_locks(i, False))
+        self.assertEqual([self.sched.waiting_results_lock],
+                         http_daemon.get_locks(i, i.put_results.need_lock))
+        # Always taken in the same order
+        self.assertEqual([self.sched.broks_lock, self.sched.waiting_results_lock],
+                         http_daemon.get_locks(i, ('waiting_results', 'broks')))
+
+    def test_broks_without_global_lock(self):
+        http_daemon = self.get_http_daemon()
+        self.sched.sched_daemon.http_daemon = http_daemon
+        self.sched.brokers['broker'] = {'broks': {}, 'has_full_broks': False}
+        self.sched.add_Brok(Brok('log', {'log': 'hello'}), 'broker')
+
+        # The scheduler loop got the global lock
+        taken = threading.Event()
+        done = threading.Event()
+        def loop():
+            with http_daemon.lock:
+                taken.set()
+                done.wait(5)
+        t = threading.Thread(target=loop)
+        t.start()
+        taken.wait(5)
+
+        # But the broker still got its broks
+        res = []
+        def get_broks():
+            res.append(IBroks(self.sched).get_broks('broker', after='0', max_broks='10'))
+        g = threading.Thread(target=get_broks)
+        g.start()
+        g.join(5)
+        done.set()
+        t.join(5)
+        self.sched.sched_daemon.http_daemon = None
+        self.assertEqual(1, len(res))
+        nb_left, broks = unpack_broks(res[0])
+        self.assertEqual(0, nb_left)
+        self.assertEqual(1, len(broks))
+
+    def test_raw_stats_snapshot(self):
+        self.sched.raw_stats = {'nb_scheduled': 3, 'nb_inpoller': 1, 'nb_zombies': 0,
+                                'nb_notifications': 0, 'broks_lag': {}}
+        i = IStats(self.sched.sched_daemon)
+        self.assertEqual(False, i.get_raw_stats.need_lock)
+        res = i.get_raw_stats()
+        self.assertEqual(3, res['nb_scheduled'])
+        # The loop snapshot is not given itself
+        res['nb_scheduled'] = 0
+        self.assertEqual(3, self.sched.raw_stats['nb_scheduled'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the queries run on several satellites at once
+#
+
+import socket
+import threading
+
+from shinken_test import *
+from shinken.http_epoll import EpollWSGIServer, has_epoll
+from shinken.http_client import HTTPClient, HTTPMultiClient, HTTPExceptions
+from shinken.brok import Brok, pack_broks
+
+
+class TestHttpMultiClient(ShinkenTest):
+    # Uncomment this is you want to use a specific configuration
+    # for your test
+    def setUp(self):
+        pass
+
+    def app(self, environ, start_response):
+        path = environ['PATH_INFO']
+        self.paths.append(path)
+        ctype = 'application/json'
+        if path == '/slow':
+            # Answer only when the fast one is done
+            self.fast_done.wait(5)
+            body = '"slow"'
+        elif path == '/get_broks':
+            # By batches of 2, with the number of broks still here
+            batch = self.broks[:2]
+            del self.broks[:2]
+            body = pack_broks(batch, len(self.broks))
+            ctype = 'application/octet-stream'
+        elif path == '/error':
+            raise ValueError('bad')
+        else:
+            body = '"pong"'
+        start_response('200 OK', [('Content-Type', ctype)])
+        return [body]
+
+    def start_server(self):
+        self.paths = []
+        self.broks = []
+        self.fast_done = threading.Event()
+        srv = EpollWSGIServer('127.0.0.1', 0, self.app, 4)
+        t = threading.Thread(target=srv.serve_forever)
+        t.daemon = True
+        t.start()
+        return srv, t
+
+    def stop_server(self, srv, t):
+        self.fast_done.set()
+        srv.stop()
+        t.join(5)
+        self.assertFalse(t.is_alive())
+
+    # A port where nobody listens
+    def get_closed_port(self):
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+        s.close()
+        return port
+
+    def test_results_and_callbacks(self):
+        if not has_epoll:
+            return
+        srv, t = self.start_server()
+        try:
+            clients = [HTTPClient(address='127.0.0.1', port=srv.port) for i in xrange(3)]
+            dead = HTTPClient(address='127.0.0.1', port=self.get_closed_port())
+            done = []
+
+            def on_fast(res):
+                done.append(('fast', res))
+                self.fast_done.set()
+            multi = HTTPMultiClient()
+            multi.get(clients[0], 'slow', wait='long', callback=lambda res: done.append(('slow', res)))
+            multi.get(clients[1], 'ping', callback=on_fast)
+            multi.get(clients[2], 'error', callback=lambda res: done.append(('error', res)))
+            multi.get(dead, 'ping', callback=lambda res: done.append(('dead', res)))
+            results = multi.perform()
+
+            # The results are in the queries order
+            self.assertEqual(4, len(results))
+            self.assertEqual('slow', results[0])
+            self.assertEqual('pong', results[1])
+            # Errors are given as HTTP exceptions, not raised
+            self.assertIsInstance(results[2], HTTPExceptions)
+            self.assertIsInstance(results[3], HTTPExceptions)
+            # Each callback got its result as soon as it was done, so the
+            # slow one after the fast one
+            self.assertEqual(4, len(done))
+            names = [name for (name, res) in done]
+            self.assertLess(names.index('fast'), names.index('slow'))
+            for (name, res) in done:
+                self.assertIs(results[['slow', 'fast', 'error', 'dead'].index(name)], res)
+
+            # The clients can be used again, alone or not
+            self.assertEqual('pong', clients[0].get('ping'))
+            multi.get(clients[0], 'ping')
+            self.assertEqual(['pong'], multi.perform())
+            # Nothing to do is fine
+            self.assertEqual([], multi.perform())
+        finally:
+            self.stop_server(srv, t)
+
+    # The broker asks again the schedulers that still have broks for it,
+    # until they have no more
+    def test_broker_rounds(self):
+        if not has_epoll:
+            return
+        srv, t = self.start_server()
+        try:
+            self.broks = [Brok('log', {'log': str(i)}) for i in xrange(5)]
+            broker = Broker('', False, False, False, None)
+            broker.schedulers = {
+                0: {'name': 'alive', 'instance_id': 0,
+                    'con': HTTPClient(address='127.0.0.1', port=srv.port)},
+                1: {'name': 'dead', 'instance_id': 1,
+                    'con': HTTPClient(address='127.0.0.1', port=self.get_closed_port())},
+            }
+            broker.get_new_broks(type='scheduler')
+
+            self.assertEqual(['/get_broks'] * 3, self.paths)
+            for b in broker.broks:
+                b.prepare()
+            self.assertEqual([str(i) for i in xrange(5)], [b.data['log'] for b in broker.broks])
+            self.assertEqual(0, broker.schedulers[0]['broks_lag'])
+            # The dead one was asked once, and will be connected again
+            self.assertIs(None, broker.schedulers[1]['con'])
+        finally:
+            self.stop_server(srv, t)
+
+
+if __name__ == '__main__':
+    unittest.main()
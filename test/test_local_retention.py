@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the incremental local retention
+#
+
+import os
+import shutil
+import tempfile
+
+from shinken_test import *
+from shinken.localretention import LocalRetention
+
+
+class TestLocalRetention(ShinkenTest):
+
+    def setUp(self):
+        ShinkenTest.setUp(self)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'retention.dat')
+        self.svc = self.sched.services.find_srv_by_name_and_hostname("test_host_0", "test_ok_0")
+        self.svc.checks_in_progress = []
+        self.svc.act_depend_of = []  # no hostchecks on critical checkresults
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_only_changed_items(self):
+        data = self.sched.get_changed_retention_data()
+        self.assertEqual(len(self.sched.hosts), len(data['hosts']))
+        self.assertEqual(len(self.sched.services), len(data['services']))
+        # Nothing changed since
+        data = self.sched.get_changed_retention_data()
+        self.assertEqual({'hosts': {}, 'services': {}}, data)
+
+        self.scheduler_loop(1, [[self.svc, 2, 'BAD']])
+        data = self.sched.get_changed_retention_data()
+        self.assertIn(('test_host_0', 'test_ok_0'), data['services'])
+        self.assertNotIn('test_router_0', data['hosts'])
+        self.assertEqual('BAD', data['services'][('test_host_0', 'test_ok_0')]['output'])
+        # The full data are the same as the classic ones
+        self.assertEqual(self.sched.get_retention_data().keys(),
+                         self.sched.get_changed_retention_data(full=True).keys())
+
+    def test_save_and_load(self):
+        retention = LocalRetention(self.path)
+        self.assertIs(None, retention.load())
+        # The first save is a snapshot
+        retention.save(self.sched)
+        self.assertTrue(os.path.exists(self.path))
+        log_size = os.path.getsize(self.path + '.log')
+
+        self.scheduler_loop(1, [[self.svc, 2, 'BAD']])
+        retention.save(self.sched)
+        self.assertGreater(os.path.getsize(self.path + '.log'), log_size)
+
+        # A new scheduler loads the snapshot and the log
+        data = LocalRetention(self.path).load()
+        self.assertEqual(len(self.sched.hosts), len(data['hosts']))
+        self.assertEqual('BAD', data['services'][('test_host_0', 'test_ok_0')]['output'])
+        self.svc.output = 'before restart'
+        self.sched.restore_retention_data(data)
+        self.assertEqual('BAD', self.svc.output)
+
+    def test_compaction(self):
+        retention = LocalRetention(self.path, max_log_ratio=0)
+        retention.save(self.sched)
+        self.assertEqual(1, retention.generation)
+        # The log is always too big, so we compact at each save
+        self.scheduler_loop(1, [[self.svc, 2, 'BAD']])
+        retention.save(self.sched)
+        self.assertEqual(2, retention.generation)
+        data = LocalRetention(self.path).load()
+        self.assertEqual('BAD', data['services'][('test_host_0', 'test_ok_0')]['output'])
+
+    def test_broken_files(self):
+        retention = LocalRetention(self.path)
+        retention.save(self.sched)
+        self.scheduler_loop(1, [[self.svc, 2, 'BAD']])
+        retention.save(self.sched)
+
+        # We died in the middle of a save: the end is not read
+        size = os.path.getsize(self.path + '.log')
+        f = open(self.path + '.log', 'ab')
+        f.write('\x00\x00\x10\x00\x00')
+        f.close()
+        data = LocalRetention(self.path).load()
+        self.assertEqual('BAD', data['services'][('test_host_0', 'test_ok_0')]['output'])
+
+        # A log from a previous snapshot is not read
+        f = open(self.path + '.log', 'r+b')
+        f.truncate(size)
+        f.seek(len('SHINKEN-RETENTION-LOG-1\n') + 7)
+        f.write('\x00')
+        f.close()
+        data = LocalRetention(self.path).load()
+        self.assertNotEqual('BAD', data['services'][('test_host_0', 'test_ok_0')]['output'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,6 +27,7 @@ import sys
 import os
 import time
 import cPickle
+import threading
 from cStringIO import StringIO
 
 from tempfile import NamedTemporaryFile
@@ -39,7 +40,7 @@ from shinken.log import defaultFormatter, BrokHandler, ColorStreamHandler
 
 shinken_logger.set_log = True
 
-from shinken.brok import Brok
+from shinken.brok import Brok, split_log_brok
 from shinken_test import *
 
 # The logging module requires some object for collecting broks
@@ -464,5 +465,156 @@ class TestNamedCollector(NoSetup, ShinkenTest, LogCollectMixin):
         self.test_basic_logging_info()
 
 
+class BlockingHandler(logging.Handler):
+    """Handler that holds the log writer on its first record"""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.blocked = threading.Event()
+        self.go = threading.Event()
+
+    def emit(self, record):
+        if not self.blocked.is_set():
+            self.blocked.set()
+            self.go.wait(5)
+
+
+class TestAsyncLogging(NoSetup, ShinkenTest, LogCollectMixin):
+
+    def _prepare_logging(self):
+        logger = LogCollectMixin._prepare_logging(self)
+        logger.setLevel(logging.INFO)
+        logger.set_async(True)
+        return logger
+
+    def test_batched_broks(self):
+        logger = self._prepare_logging()
+        blocking = BlockingHandler()
+        logger.addHandler(blocking)
+        logger.info('Some first log-message')
+        self.assertTrue(blocking.blocked.wait(5))
+
+        # The writer is busy, we only queue the records
+        args = ['first']
+        logger.info('Some %s log-message', args)
+        # The message is done when we log, not when it is written
+        args[0] = 'changed'
+        # A monitoring line keeps the Nagios format
+        logger.info('Some monitoring message', extra={'monitoring': True})
+        logger.error('Some other log-message')
+        blocking.go.set()
+        logger.set_async(False)
+        self.assertIs(None, logger.writer)
+
+        stdoutlogs = sys.stdout.getvalue().splitlines()[1:]
+        sys.stdout = sys.__stdout__
+        self.assertEqual(3, len(stdoutlogs))
+        self.assertRegexpMatches(stdoutlogs[0], r"^\[\d+\] INFO:\s+Some \['first'\] log-message$")
+        self.assertRegexpMatches(stdoutlogs[1], r'^\[\d+\] Some monitoring message$')
+        # The writer got the three records at once, so they are in one brok,
+        # and the broker gives one brok by line to its modules
+        self.assertEqual(2, len(self._collector.list))
+        data = cPickle.loads(self._collector.list[1].data)
+        self.assertEqual('\n'.join(stdoutlogs) + '\n', data['log'])
+        broks = split_log_brok(self._collector.list[1])
+        self.assertEqual(3, len(broks))
+        for b in broks:
+            b.prepare()
+        self.assertEqual(stdoutlogs[1] + '\n', broks[1].data['log'])
+
+    def test_forked_process_logs_by_itself(self):
+        logger = self._prepare_logging()
+        writer = logger.writer
+        # We are a worker forked after the writer start
+        writer.pid = -1
+        logger.info('Some log-message')
+        self.assertEqual(1, len(self._collector.list))
+        # The writer of the father is not ours anymore
+        self.assertIs(None, logger.writer)
+        writer.pid = os.getpid()
+        writer.stop()
+        self._get_logging_output()
+
+    def test_forked_process_gets_new_locks(self):
+        logger = self._prepare_logging()
+        writer = logger.writer
+        blocking = BlockingHandler()
+        logger.addHandler(blocking)
+        logger.info('Some first log-message')
+        # The writer holds the lock of the handler
+        self.assertTrue(blocking.blocked.wait(5))
+        # And we are forked now: the lock is not released for us
+        writer.pid = -1
+        t = threading.Thread(target=logger.info, args=('Some log-message',))
+        t.start()
+        t.join(2)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(2, len(self._collector.list))
+        blocking.go.set()
+        writer.pid = os.getpid()
+        writer.stop()
+        self._get_logging_output()
+
+    def test_pause_writer(self):
+        logger = self._prepare_logging()
+        paused = logger.pause_writer()
+        try:
+            self.assertIs(logger.writer, paused)
+            logger.info('Some log-message')
+            # Nothing is written until we resume it
+            self.assertEqual(0, len(self._collector.list))
+        finally:
+            logger.resume_writer(paused)
+        logger.set_async(False)
+        self.assertEqual(1, len(self._collector.list))
+        # Without writer, there is nothing to pause
+        self.assertIs(None, logger.pause_writer())
+        logger.resume_writer(None)
+        self._get_logging_output()
+
+
+class PushingBrokerLink:
+    """Broker link that gets a new brok from the log writer while we push"""
+    manage_arbiters = True
+    alive = True
+
+    def __init__(self, arbiter):
+        self.arbiter = arbiter
+        self.pushed = []
+
+    def push_broks(self, broks):
+        self.arbiter.add(Brok('log', {'log': 'During the push'}))
+        self.pushed.extend(broks.values())
+        return True
+
+
+class TestLogBroksInDaemons(NoSetup, ShinkenTest):
+
+    def test_arbiter_keeps_broks_added_during_push(self):
+        arbiter = Arbiter([''], [''], False, False, None, None)
+        arbiter.conf = Pluginconf()
+        link = PushingBrokerLink(arbiter)
+        arbiter.conf.brokers = [link]
+        arbiter.add(Brok('log', {'log': 'Before the push'}))
+        arbiter.push_broks_to_broker()
+        self.assertEqual(1, len(link.pushed))
+        # The one of the writer is for the next push
+        self.assertEqual(1, len(arbiter.broks))
+        arbiter.push_broks_to_broker()
+        self.assertEqual(2, len(link.pushed))
+
+    def test_broker_keeps_broks_added_during_integration(self):
+        broker = Broker('', False, False, False, None)
+        broker.add(Brok('log', {'log': 'Before'}))
+        add_broks_to_queue = broker.add_broks_to_queue
+
+        def add_and_raise(broks):
+            add_broks_to_queue(broks)
+            broker.add(Brok('log', {'log': 'During'}))
+        broker.add_broks_to_queue = add_and_raise
+        broker.interger_internal_broks()
+        self.assertEqual(1, len(broker.broks))
+        self.assertEqual(1, len(broker.broks_internal_raised))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -217,7 +217,50 @@ class TestMacroResolver(ShinkenTest):
         print com
         self.assertEqual('plugins/nothing ::1', com)
 
-        
+
+    # The command lines are compiled once, then only the values
+    # of the macros are get
+    def test_compiled_templates(self):
+        mr = self.get_mr()
+        (svc, hst) = self.get_hst_svc()
+        com = mr.resolve_command(svc.check_command, svc.get_data_for_checks())
+        # The command call keeps it
+        template = svc.check_command.compiled_line[1]
+        self.assertIsNot(None, template)
+        self.assertEqual(0, len(mr.templates))
+        # The same as the old way
+        data = svc.get_data_for_checks() + [mr, self.conf]
+        c_line = svc.check_command.command.command_line
+        self.assertEqual(mr._resolve_in_loops(c_line, data, svc.check_command.args), com)
+
+        # The values change, not the template
+        svc.state = 'CRITICAL'
+        com = mr.resolve_command(svc.check_command, svc.get_data_for_checks())
+        self.assertIn('--previous-state=CRITICAL', com)
+        self.assertIs(template, svc.check_command.compiled_line[1])
+
+        # A $$ is a $, and a $ without its ending one stay here
+        cc = CommandCall(self.conf.commands, "special_macro!100$$")
+        self.assertEqual('plugins/nothing 100$', mr.resolve_command(cc, data))
+        cc = CommandCall(self.conf.commands, "special_macro!$HOSTNAME")
+        self.assertEqual('plugins/nothing $HOSTNAME', mr.resolve_command(cc, data))
+
+    # The other lines are in a bounded cache, the least used go first
+    def test_templates_cache(self):
+        mr = self.get_mr()
+        (svc, hst) = self.get_hst_svc()
+        data = svc.get_data_for_checks()
+        mr.templates_max_size = 2
+        try:
+            self.assertEqual('test_host_0', mr.resolve_simple_macros_in_string('$HOSTNAME$', data[:]))
+            mr.resolve_simple_macros_in_string('$SERVICEDESC$', data[:])
+            # Used again, so the other one is the least used
+            mr.resolve_simple_macros_in_string('$HOSTNAME$', data[:])
+            mr.resolve_simple_macros_in_string('$HOSTSTATE$', data[:])
+            self.assertEqual([('$HOSTNAME$', None), ('$HOSTSTATE$', None)], mr.templates.keys())
+        finally:
+            del mr.templates_max_size
+
 
 if __name__ == '__main__':
     unittest.main()
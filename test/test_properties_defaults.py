@@ -105,8 +105,10 @@ class TestConfig(PropertiesTester, ShinkenTest):
         ('workdir', '/var/run/shinken/'),
         ('config_base_dir', ''),
         ('modules_dir', '/var/lib/shinken/modules'),
+        ('config_cache_file', ''),
         ('use_local_log', True),
         ('log_level', 'WARNING'),
+        ('async_log', True),
         ('local_log', '/var/log/shinken/arbiterd.log'),
         ('resource_file', '/tmp/resources.txt'),
         ('shinken_user', shinken.daemon.get_cur_user()),
@@ -206,6 +208,7 @@ class TestConfig(PropertiesTester, ShinkenTest):
         ('cleaning_queues_interval', 900),
         ('disable_old_nagios_parameters_whining', False),
         ('enable_problem_impacts_states_change', False),
+        ('full_status_broks', True),
         ('resource_macros_names', []),
 
         # SSL part
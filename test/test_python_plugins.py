@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This file is used to test the python plugins run in the workers processes
+#
+
+import os
+import imp
+import shutil
+import tempfile
+import Queue
+
+from shinken_test import *
+from shinken.action import Action
+from shinken.message import Message
+from shinken.objects.module import Module
+from shinken.pythonplugins import PythonPlugins
+
+PLUGIN = '''
+import os
+import sys
+import time
+
+nb_calls = 0
+
+def main():
+    global nb_calls
+    nb_calls += 1
+    if sys.argv[1] == 'ok':
+        print "OK - call %d of %s|calls=%d" % (nb_calls, os.environ.get('MYVAR'), nb_calls)
+        sys.exit(0)
+    if sys.argv[1] == 'crash':
+        raise ValueError('I crash')
+    if sys.argv[1] == 'sleep':
+        time.sleep(10)
+    if sys.argv[1] == 'sleep_and_catch':
+        try:
+            time.sleep(10)
+        except Exception:
+            print "OK - nothing bad"
+            return 0
+    print "CRITICAL - bad"
+    return 2
+
+if __name__ == '__main__':
+    main()
+'''
+
+
+class TestPythonPlugins(ShinkenTest):
+    # Uncomment this is you want to use a specific configuration
+    # for your test
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'check_py.py')
+        with open(self.path, 'w') as f:
+            f.write(PLUGIN)
+        self.plugins = PythonPlugins()
+        self.plugins.register_from_string('%s, /nowhere/check_other.py:run' % self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_action(self, command, timeout=10):
+        a = Action()
+        a.command = command
+        a.timeout = timeout
+        a.env = {'MYVAR': u'myvalue'}
+        a.status = 'queue'
+        return a
+
+    def run_action(self, a):
+        argv = self.plugins.get_argv(a)
+        self.assertIsNot(None, argv)
+        self.plugins.run(a, argv, 8192)
+        return a
+
+    def test_run(self):
+        a = self.run_action(self.get_action('%s ok' % self.path))
+        self.assertEqual('done', a.status)
+        self.assertEqual(0, a.exit_status)
+        self.assertEqual('OK - call 1 of myvalue', a.output)
+        self.assertEqual('calls=1', a.perf_data)
+        # The environment is back
+        self.assertNotIn('MYVAR', os.environ)
+
+        # The plugin is loaded only once, so it keeps its state. It
+        # can be found by its name too
+        a = self.run_action(self.get_action('check_py.py ok'))
+        self.assertEqual('OK - call 2 of myvalue', a.output)
+
+        a = self.run_action(self.get_action('%s bad' % self.path))
+        self.assertEqual(2, a.exit_status)
+        self.assertEqual('CRITICAL - bad', a.output)
+
+    def test_crash_and_timeout(self):
+        # A crash is like a crashed python process
+        a = self.run_action(self.get_action('%s crash' % self.path))
+        self.assertEqual('done', a.status)
+        self.assertEqual(1, a.exit_status)
+        self.assertIn('ValueError: I crash', a.long_output)
+
+        # The plugin and the timeout need the real time.sleep and time.time
+        time_hacker.set_real_time()
+        try:
+            a = self.run_action(self.get_action('%s sleep' % self.path, timeout=0.2))
+        finally:
+            time_hacker.set_my_time()
+        self.assertEqual('timeout', a.status)
+        self.assertEqual(3, a.exit_status)
+        self.assertLess(a.execution_time, 1)
+
+        # A plugin cannot catch its timeout as an error
+        time_hacker.set_real_time()
+        try:
+            a = self.run_action(self.get_action('%s sleep_and_catch' % self.path, timeout=0.2))
+        finally:
+            time_hacker.set_my_time()
+        self.assertEqual('timeout', a.status)
+        self.assertEqual(3, a.exit_status)
+
+    # The values can be str, with non ascii characters
+    def test_str_env(self):
+        a = self.get_action('%s ok' % self.path)
+        a.env = {'MYVAR': 'my \xc3\xa9 value'}
+        a = self.run_action(a)
+        self.assertEqual('done', a.status)
+        self.assertEqual('OK - call 1 of my \xc3\xa9 value', a.output)
+        self.assertNotIn('MYVAR', os.environ)
+
+    # The module runs the plugins in its process, so it does not take the
+    # checks after one, the other workers can do them
+    def test_module_takes_one_plugin(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'modules', 'python_plugins', 'module.py')
+        module = imp.load_source('python_plugins_module', path)
+        inst = module.get_instance(Module({'module_name': 'python-plugins',
+                                           'module_type': 'python_plugins',
+                                           'plugins': self.path}))
+        inst.init()
+        inst.checks = []
+        inst.s = Queue.Queue()
+        for cmd in ('/bin/echo fork', '%s ok' % self.path, '/bin/echo after'):
+            inst.s.put(Message(id=0, type='Do', data=self.get_action(cmd)))
+        inst.get_new_checks()
+        self.assertEqual(2, len(inst.checks))
+        self.assertEqual(1, inst.s.qsize())
+
+        inst.launch_new_checks()
+        (fork_chk, plugin_chk) = inst.checks
+        self.assertEqual('done', plugin_chk.status)
+        self.assertEqual('OK - call 1 of myvalue', plugin_chk.output)
+        self.assertEqual('launched', fork_chk.status)
+        while fork_chk.status == 'launched':
+            fork_chk.check_finished(8192)
+        self.assertEqual('fork', fork_chk.output)
+        # Now we can take the next ones
+        inst.get_new_checks()
+        self.assertEqual(3, len(inst.checks))
+
+    def test_not_registered(self):
+        # Not registered, not loadable, or shell: it's for the fork way
+        self.assertIs(None, self.plugins.get_argv(self.get_action('/bin/echo ok')))
+        self.assertIs(None, self.plugins.get_argv(self.get_action('check_other.py ok')))
+        self.assertIs(None, self.plugins.get_argv(self.get_action('%s ok | grep OK' % self.path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,6 +27,8 @@ import cPickle as pickle
 from shinken_test import *
 
 from shinken.safepickle import SafeUnpickler
+from shinken.util import compressed_dumps, compressed_loads
+from shinken.objects.command import Command
 
 
 should_not_change = False
@@ -71,7 +73,28 @@ class TestSafePickle(ShinkenTest):
         self.assertRaises(ValueError, launch_safe_pickle)
         print should_not_change
         self.assertFalse(should_not_change)
-        
-        
+
+
+    def test_binary_protocol(self):
+        # The binary protocol creates the new style objects with __newobj__
+        c = Command({'command_name': 'check_ping', 'command_line': 'check_ping -H $HOSTADDRESS$'})
+        buf = pickle.dumps({'command': c}, pickle.HIGHEST_PROTOCOL)
+        c2 = SafeUnpickler.loads(buf)['command']
+        self.assertEqual('check_ping -H $HOSTADDRESS$', c2.command_line)
+
+        # And the unsafe objects are still refused
+        buf = pickle.dumps(SadPanda(), pickle.HIGHEST_PROTOCOL)
+        self.assertRaises(ValueError, SafeUnpickler.loads, buf)
+
+
+    def test_compressed_dumps(self):
+        data = {'conf': 'x' * 100000, 'command': Command({'command_name': 'check_ping'})}
+        buf = compressed_dumps(data)
+        self.assertLess(len(buf), 10000)
+        data2 = compressed_loads(buf)
+        self.assertEqual(data['conf'], data2['conf'])
+        self.assertEqual('check_ping', data2['command'].command_name)
+
+
 if __name__ == '__main__':
     unittest.main()
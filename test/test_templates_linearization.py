@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+#
+# This file is used to test the inheritance from the linearized templates
+#
+
+from shinken_test import *
+from shinken.objects.host import Host, Hosts
+
+
+def get_hosts():
+    hosts = [
+        Host({'name': u'generic', 'register': u'0', 'check_interval': u'5',
+              'hostgroups': [u'linux'], '_OS': u'linux'}),
+        Host({'name': u'dmz', 'register': u'0', 'use': [u'generic'],
+              'hostgroups': [u'+dmz'], '_ZONE': u'dmz'}),
+        Host({'name': u'db', 'register': u'0', 'use': [u'generic'],
+              'max_check_attempts': u'2', 'notes': u'null'}),
+        Host({'name': u'dmz-db', 'register': u'0', 'use': [u'dmz', u'db'],
+              '_OS': u'bsd'}),
+        Host({'host_name': u'srv1', 'use': [u'dmz-db'], 'hostgroups': [u'+mysql']}),
+        Host({'host_name': u'srv2', 'use': [u'db', u'dmz'], 'check_interval': u'1'}),
+        Host({'host_name': u'srv3', 'use': [u'generic']}),
+    ]
+    hosts = Hosts(hosts)
+    hosts.linkify_templates()
+    return hosts
+
+
+class TestTemplatesLinearization(ShinkenTest):
+    # Uncomment this is you want to use a specific configuration
+    # for your test
+    def setUp(self):
+        pass
+
+    def test_linearization(self):
+        hosts = get_hosts()
+        tpls = [t.name for t in hosts.get_templates_linearization()]
+        self.assertEqual(4, len(tpls))
+        # Each template comes after its own templates
+        self.assertLess(tpls.index('generic'), tpls.index('dmz'))
+        self.assertLess(tpls.index('generic'), tpls.index('db'))
+        self.assertLess(tpls.index('dmz'), tpls.index('dmz-db'))
+        self.assertLess(tpls.index('db'), tpls.index('dmz-db'))
+
+    def test_loop(self):
+        hosts = Hosts([Host({'name': u'a', 'register': u'0', 'use': [u'b']}),
+                       Host({'name': u'b', 'register': u'0', 'use': [u'a']}),
+                       Host({'host_name': u'srv', 'use': [u'a']})])
+        for h in hosts.templates.values() + hosts.items.values():
+            hosts.linkify_item_templates(h)
+        self.assertIs(None, hosts.get_templates_linearization())
+        # The recursive inheritance still manage it
+        hosts.apply_inheritance()
+
+    def test_same_as_recursive(self):
+        hosts = get_hosts()
+        hosts.apply_inheritance()
+
+        # Without linearization, the templates are resolved recursively
+        # by each item
+        ref = get_hosts()
+        ref.get_templates_linearization = lambda: None
+        ref.apply_inheritance()
+
+        for h in ref:
+            h2 = hosts.find_by_name(h.get_name())
+            for prop in Host.properties:
+                self.assertEqual(getattr(h, prop, None), getattr(h2, prop, None))
+            self.assertEqual(h.customs, h2.customs)
+
+        srv1 = hosts.find_by_name('srv1')
+        self.assertEqual(['linux', 'dmz', 'linux', 'mysql'], srv1.hostgroups)
+        self.assertEqual(5, srv1.check_interval)
+        self.assertEqual(2, srv1.max_check_attempts)
+        self.assertFalse(hasattr(srv1, 'notes'))
+        self.assertEqual({'_OS': u'bsd', '_ZONE': u'dmz'}, srv1.customs)
+        srv2 = hosts.find_by_name('srv2')
+        self.assertEqual(1, srv2.check_interval)
+        srv3 = hosts.find_by_name('srv3')
+        self.assertEqual(['linux'], srv3.hostgroups)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -183,8 +183,8 @@ class TestTimeperiods(ShinkenTest):
         # So the next will be after 16:30 and not before 21:00. So
         # It will be 21:00:01 (first second after invalid is valid)
 
-        # we clean the cache of previous calc of t ;)
-        t.cache = {}
+        # we clean the intervals of previous calc of t ;)
+        t.reset_intervals()
         t_next = t.get_next_valid_time_from_t(july_the_12)
         t_next = time.asctime(time.localtime(t_next))
         print "T nxt with exclude:", t_next
@@ -212,7 +212,7 @@ class TestTimeperiods(ShinkenTest):
         t.exclude = [t2]
         # We are a bad boy: first time period want a tuesday
         # but exclude do not want it until 23:58. So next is 58 + 1second :)
-        t.cache = {}
+        t.reset_intervals()
         t_next = t.get_next_valid_time_from_t(july_the_12)
         t_exclude = t2.get_next_valid_time_from_t(july_the_12)
         t_exclude_inv = t2.get_next_invalid_time_from_t(july_the_12)
@@ -248,7 +248,7 @@ class TestTimeperiods(ShinkenTest):
         t.exclude = [t2]
         # We are a bad boy: first time period want a tuesday
         # but exclude do not want it until 23:58. So next is 59 :)
-        t.cache = {}
+        t.reset_intervals()
         t_next = t.get_next_valid_time_from_t(july_the_12)
         #print "Check from", time.asctime(time.localtime(july_the_12))
         #t_exclude = t2.get_next_valid_time_from_t(july_the_12)
@@ -289,7 +289,7 @@ class TestTimeperiods(ShinkenTest):
         t.exclude = [t2]
         # We are a bad boy: first time period want a tuesday
         # but exclude do not want it until 23:58. So next is 59 :)
-        t.cache = {}
+        t.reset_intervals()
         t_next = t.get_next_valid_time_from_t(july_the_12)
         #print "Check from", time.asctime(time.localtime(july_the_12))
         #t_exclude = t2.get_next_valid_time_from_t(july_the_12)
@@ -336,7 +336,7 @@ class TestTimeperiods(ShinkenTest):
         t.exclude = [t2]
         # We are a bad boy: first time period want a tuesday
         # but exclude do not want it until 23:58. So next is 59 :)
-        t.cache = {}
+        t.reset_intervals()
         t_next = t.get_next_valid_time_from_t(july_the_12)
         #print "Check from", time.asctime(time.localtime(july_the_12))
         #t_exclude = t2.get_next_valid_time_from_t(july_the_12)
@@ -377,7 +377,7 @@ class TestTimeperiods(ShinkenTest):
         t.exclude = [t2]
         # We are a bad boy: first time period want a tuesday
         # but exclude do not want it until 23:58. So next is 59 :)
-        t.cache = {}
+        t.reset_intervals()
         t_next = t.get_next_valid_time_from_t(july_the_12)
         #print "Check from", time.asctime(time.localtime(july_the_12))
         #t_exclude = t2.get_next_valid_time_from_t(july_the_12)
@@ -456,6 +456,86 @@ class TestTimeperiods(ShinkenTest):
         print "T next invalid", t_next_invalid
         self.assertEqual("Wed Jul 14 00:00:01 2010", t_next_invalid)
 
+    # The timeperiod computes its valid intervals once, then answers from them
+    def test_intervals(self):
+        self.print_header()
+
+        # Get the 12 of july 2010 at 15:00, monday
+        july_the_12 = time.mktime(time.strptime("12 Jul 2010 15:00:00", "%d %b %Y %H:%M:%S"))
+
+        t = Timeperiod()
+        t.timeperiod_name = 'test_intervals'
+        t.resolve_daterange(t.dateranges, 'monday 16:00-18:00,20:00-21:00')
+        t.resolve_daterange(t.dateranges, 'tuesday 16:30-24:00')
+        t.exclude = []
+
+        t_next = t.get_next_valid_time_from_t(july_the_12)
+        self.assertEqual("Mon Jul 12 16:00:00 2010", time.asctime(time.localtime(t_next)))
+        # The intervals of the next day were computed too, and we can
+        # still answer a bit in the past
+        self.assertEqual(int(july_the_12) - t.intervals_behind, t.intervals_from)
+        self.assertEqual(2, len(t.intervals_starts))
+        self.assertEqual(t.intervals_starts[0], t_next)
+
+        # Now the answers come from them
+        t.find_next_valid_time_from_t = None
+        t.find_next_invalid_time_from_t = None
+        t_next = t.get_next_valid_time_from_t(july_the_12 + 3600 * 4)
+        self.assertEqual("Mon Jul 12 20:00:00 2010", time.asctime(time.localtime(t_next)))
+        self.assertTrue(t.is_time_valid(july_the_12 + 3600 * 2))
+        self.assertFalse(t.is_time_valid(july_the_12 + 3600 * 4))
+        self.assertEqual(july_the_12 + 3600 * 4, t.get_next_invalid_time_from_t(july_the_12 + 3600 * 4))
+        t_next_invalid = t.get_next_invalid_time_from_t(july_the_12 + 3600 * 2)
+        self.assertEqual(t.intervals_ends[0], t_next_invalid)
+        # After the last interval, we kept the next valid one
+        t_next = t.get_next_valid_time_from_t(july_the_12 + 3600 * 7)
+        self.assertEqual("Tue Jul 13 16:30:00 2010", time.asctime(time.localtime(t_next)))
+
+        # The past intervals are dropped
+        del t.find_next_valid_time_from_t
+        del t.find_next_invalid_time_from_t
+        now = time.time()
+        t.intervals_ends[1] = now + 3600
+        t.intervals_until = now + 7200
+        t.clean_cache()
+        self.assertEqual(1, len(t.intervals_starts))
+        self.assertEqual(int(time.time()) - t.intervals_behind, t.intervals_from)
+
+    # The end of an interval still valid after the computed window is only
+    # looked for once
+    def test_clipped_interval(self):
+        self.print_header()
+
+        # Get the 12 of july 2010 at 15:00, monday
+        july_the_12 = time.mktime(time.strptime("12 Jul 2010 15:00:00", "%d %b %Y %H:%M:%S"))
+
+        t = Timeperiod()
+        t.timeperiod_name = 'test_clipped_interval'
+        for day in ('monday', 'tuesday', 'wednesday'):
+            t.resolve_daterange(t.dateranges, '%s 00:00-24:00' % day)
+        t.exclude = []
+
+        self.assertEqual(july_the_12, t.get_next_valid_time_from_t(july_the_12))
+        self.assertTrue(t.is_time_valid(july_the_12))
+        self.assertTrue(t.intervals_clipped)
+        self.assertEqual(t.intervals_until, t.intervals_ends[-1])
+
+        calls = []
+        find_next_invalid_time_from_t = t.find_next_invalid_time_from_t
+
+        def counting_find(t0, until=None):
+            calls.append(t0)
+            return find_next_invalid_time_from_t(t0, until)
+        t.find_next_invalid_time_from_t = counting_find
+        for i in xrange(3):
+            t_next_invalid = t.get_next_invalid_time_from_t(july_the_12 + i)
+            self.assertEqual("Thu Jul 15 00:00:00 2010", time.asctime(time.localtime(t_next_invalid)))
+        self.assertEqual(1, len(calls))
+        # A bit before the asked time is in the window too
+        self.assertEqual(t_next_invalid, t.get_next_invalid_time_from_t(july_the_12 - 60))
+        self.assertEqual(1, len(calls))
+        del t.find_next_invalid_time_from_t
+
 
     def test_issue_1385(self):
         '''
@@ -46,12 +46,15 @@ class TestTPStateLog(ShinkenTest):
         # Now make this tp unable to be active again by removing al it's daterange:p
         dr = tp.dateranges
         tp.dateranges = []
+        # The valid intervals computed with the old dateranges are wrong now
+        tp.reset_intervals()
         tp.check_and_log_activation_change()
         self.assert_any_log_match("TIMEPERIOD TRANSITION: 24x7;1;0")
         self.show_and_clear_logs()
 
         # Ok, let get back to work :)
         tp.dateranges = dr
+        tp.reset_intervals()
         tp.check_and_log_activation_change()
         self.assert_any_log_match("TIMEPERIOD TRANSITION: 24x7;0;1")
         self.show_and_clear_logs()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This file is used to test the poller workers, that wait for the checks
+# events instead of sleeping
+#
+
+import os
+import sys
+import shutil
+import tempfile
+from Queue import Empty
+from multiprocessing import Queue
+
+from shinken_test import *
+from shinken.action import Action
+from shinken.message import Message
+from shinken.worker import Worker, get_queue_fd
+from shinken import posixspawn
+
+
+class TestWorker(ShinkenTest):
+    # Uncomment this is you want to use a specific configuration
+    # for your test
+    def setUp(self):
+        pass
+
+    def get_action(self, command, timeout=10):
+        a = Action()
+        a.command = command
+        a.timeout = timeout
+        a.env = {}
+        a.module_type = 'fork'
+        a.status = 'queue'
+        return a
+
+    def get_result(self, returns_queue, timeout=10):
+        try:
+            return returns_queue.get(timeout=timeout)
+        except Empty:
+            self.fail('The worker did not give the result')
+
+    # The satellites give such queues to their workers, the workers wait
+    # for their jobs on it
+    def test_jobs_queue_fd(self):
+        if os.name == 'nt':
+            return
+        self.assertIsNot(None, get_queue_fd(Queue()))
+
+    def test_checks_results(self):
+        if os.name == 'nt':
+            return
+        self.do_test_checks_results('popen')
+
+    # The same, but the processes are launched with posix_spawn
+    def test_checks_results_posix_spawn(self):
+        if not posixspawn.is_available():
+            return
+        self.do_test_checks_results('posix_spawn')
+
+    def do_test_checks_results(self, spawn_method):
+        s = Queue()
+        returns_queue = Queue()
+        w = Worker(1, s, returns_queue, 4, max_plugins_output_length=200000,
+                   spawn_method=spawn_method)
+        w.start()
+        try:
+            # The result comes back as soon as the check exits
+            t0 = time.time()
+            s.put(Message(id=0, type='Do', data=self.get_action('echo "OK|a=1"')))
+            a = self.get_result(returns_queue)
+            self.assertEqual('done', a.status)
+            self.assertEqual('OK', a.output)
+            self.assertEqual('a=1', a.perf_data)
+            self.assertLess(time.time() - t0, 1)
+
+            # A big output must not block the check
+            s.put(Message(id=0, type='Do',
+                          data=self.get_action(sys.executable + r""" -u -c 'print "A"*100000'""")))
+            a = self.get_result(returns_queue)
+            self.assertEqual('done', a.status)
+            self.assertEqual(0, a.exit_status)
+            self.assertEqual(100000, len(a.output))
+
+            # And a too long one is killed
+            t0 = time.time()
+            s.put(Message(id=0, type='Do', data=self.get_action('sleep 10', timeout=1)))
+            a = self.get_result(returns_queue)
+            self.assertEqual('timeout', a.status)
+            self.assertLess(time.time() - t0, 3)
+
+            # The environment is given to the process
+            a = self.get_action('sh -c "echo $MYVAR"')
+            a.env = {'MYVAR': u'my value'}
+            s.put(Message(id=0, type='Do', data=a))
+            a = self.get_result(returns_queue)
+            self.assertEqual('my value', a.output)
+        finally:
+            w.send_message(Message(id=0, type='Die'))
+            w.join(5)
+            if w.is_alive():
+                w.terminate()
+
+    # The command is looked for in the PATH of the check, like with Popen
+    def test_posix_spawn_env_path(self):
+        if not posixspawn.is_available():
+            return
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            plugin = os.path.join(tmp_dir, 'my_plugin')
+            f = open(plugin, 'w')
+            f.write('#!/bin/sh\necho "in my path"\n')
+            f.close()
+            os.chmod(plugin, 0755)
+            p = posixspawn.spawn(['my_plugin'], False, {'PATH': tmp_dir})
+            self.assertEqual('in my path\n', p.stdout.read())
+            os.waitpid(p.pid, 0)
+            self.assertRaises(OSError, posixspawn.spawn, ['my_plugin'], False, {})
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    # If we cannot get the exit status of the process, we do not know
+    def test_posix_spawn_lost_child(self):
+        if not posixspawn.is_available():
+            return
+        p = posixspawn.SpawnedProcess(os.getpid(), None, None)
+        self.assertEqual(3, p.poll())
+
+
+if __name__ == '__main__':
+    unittest.main()